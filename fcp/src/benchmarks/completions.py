@@ -0,0 +1,54 @@
+"""Wall time of concurrent experts on blocking versus awaited completions, against litellm's mock provider."""
+
+import asyncio
+import time
+from litellm import completion
+from containment.structures.cli_basic import AsyncTyper
+from containment.netio.completions import mk_complete
+
+MODEL = "anthropic/claude-sonnet-4-20250514"
+SYSTEM_PROMPT = "You are a benchmark."
+MOCK_RESPONSE = "<proof>auto_hoare_pos</proof>"
+
+cli = AsyncTyper()
+
+
+async def _blocking_expert(rounds: int, delay: float) -> None:
+    """An expert calling the synchronous `completion` from its coroutine, as before."""
+    for _ in range(rounds):
+        completion(
+            model=MODEL,
+            messages=[{"role": "user", "content": "prove it"}],
+            mock_response=MOCK_RESPONSE,
+            mock_delay=delay,
+        )
+        await asyncio.sleep(0)  # e.g. the typecheck tool call
+    return None
+
+
+async def _awaiting_expert(rounds: int, delay: float) -> None:
+    complete = mk_complete(
+        MODEL, SYSTEM_PROMPT, mock_response=MOCK_RESPONSE, mock_delay=delay
+    )
+    for _ in range(rounds):
+        await complete([{"role": "user", "content": "prove it"}])
+        await asyncio.sleep(0)
+    return None
+
+
+@cli.command()
+async def main(experts: int = 8, rounds: int = 3, delay: float = 0.5) -> None:
+    """
+    Run `experts` experts of `rounds` completions each, where every completion takes `delay` seconds.
+    """
+    for name, expert in (("blocking", _blocking_expert), ("awaited", _awaiting_expert)):
+        start = time.perf_counter()
+        await asyncio.gather(*(expert(rounds, delay) for _ in range(experts)))
+        elapsed = time.perf_counter() - start
+        print(f"{name:>9}: {elapsed:7.3f}s")
+    print(f"  slowest: {rounds * delay:7.3f}s  sum: {experts * rounds * delay:7.3f}s")
+    return None
+
+
+if __name__ == "__main__":
+    cli()
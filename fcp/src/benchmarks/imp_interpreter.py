@@ -0,0 +1,72 @@
+"""Throughput of the python imp interpreter, and how fast it falsifies a wrong program, against the seconds a lean check takes."""
+
+import random
+import time
+from containment.structures.cli_basic import AsyncTyper
+from containment.structures import HoareTriple, Specification
+from containment.interpreter import Falsifier, falsify
+
+TRIPLES = {
+    "increment": ("x > 0", "imp { x := x + 1; }", "x > 1", ""),
+    "swap": (
+        "x = ~n <^> y = ~m",
+        "imp { temp := x; x := y; y := temp; }",
+        "x = ~m <^> y = ~n",
+        "n m",
+    ),
+    "min": (
+        "x = ~n <^> y = ~m",
+        "imp { if (x < y) { min := x; } else { min := y; } }",
+        "min <= ~n <^> min <= ~m",
+        "n m",
+    ),
+    "fact": (
+        "n = ~k",
+        "imp { out := 1; while (n > 0) { out := out * n; n := n - 1; } }",
+        "out >= 1",
+        "k",
+    ),
+}
+WRONG = ("x = 0", "imp { x := x + 1; }", "x > 8", "")
+
+cli = AsyncTyper()
+
+
+def _triple(pre: str, command: str, post: str, metavariables: str) -> HoareTriple:
+    return HoareTriple(
+        specification=Specification(
+            precondition=pre, postcondition=post, metavariables=metavariables
+        ),
+        command=command,
+    )
+
+
+@cli.command()
+def main(batch: int = 100_000, repeats: int = 100) -> None:
+    """
+    Compile each triple, run its program on a `batch` of sampled states, then time `repeats` falsifications of a wrong triple from scratch.
+    """
+    for name, spec in TRIPLES.items():
+        start = time.perf_counter()
+        falsifier = Falsifier(_triple(*spec))
+        compiled = time.perf_counter() - start
+        inputs = list(falsifier.samples(batch, random.Random(0)))
+        start = time.perf_counter()
+        counterexample, ended = falsifier.check(inputs)
+        seconds = time.perf_counter() - start
+        print(
+            f"{name:>10}: compile {compiled * 1000:6.2f}ms  {batch / seconds:10.0f} states/s  ({ended} runs ended, counterexample: {counterexample is not None})"
+        )
+    wrong = _triple(*WRONG)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        if falsify(wrong) is None:
+            raise RuntimeError(f"{wrong} should have a counterexample")
+    print(
+        f"falsify a wrong triple (parse, compile, sample): {(time.perf_counter() - start) / repeats * 1000:.2f}ms"
+    )
+    return None
+
+
+if __name__ == "__main__":
+    cli()
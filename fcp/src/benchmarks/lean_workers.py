@@ -0,0 +1,74 @@
+"""Latency of `lake exe check` subprocesses versus the persistent lean worker pool."""
+
+import asyncio
+import statistics
+import time
+from containment.structures import Specification, HoareTriple
+from containment.structures.cli_basic import AsyncTyper
+from containment.fsio.lake import Checker
+from containment.fsio.prompts import load_txt
+from containment.fsio.tools import temp_lakeproj_init
+from containment.fsio.workers import LeanWorkerPool
+
+TRIPLE = HoareTriple(
+    specification=Specification(precondition="x > 0", postcondition="x > 1"),
+    command="imp { x := x + 1; }",
+)
+PROOFS = {"proven": "auto_hoare_pos", "sorry": "sorry", "fail": "<NOT A PROOF>"}
+
+cli = AsyncTyper()
+
+
+def _summary(name: str, latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+    return f"{name:>12}: mean {statistics.mean(latencies):7.3f}s  median {statistics.median(latencies):7.3f}s  p95 {p95:7.3f}s  (n={len(latencies)})"
+
+
+@cli.command()
+async def main(rounds: int = 5, workers: int = 2) -> None:
+    """
+    Check the same triple with a proven, a sorry and a broken proof `rounds` times on each path.
+    """
+    codes = [
+        load_txt("loop/Positive.lean.template", proof=proof, **TRIPLE.model_dump())
+        for proof in PROOFS.values()
+    ]
+    checker = Checker(cwd=temp_lakeproj_init())
+
+    subprocess_latencies = []
+    for _ in range(rounds):
+        for code in codes:
+            start = time.perf_counter()
+            checker.run_code(code)
+            subprocess_latencies.append(time.perf_counter() - start)
+
+    pool = LeanWorkerPool(workers)
+    start = time.perf_counter()
+    await pool.start()
+    startup = time.perf_counter() - start
+    pooled_latencies = []
+    for _ in range(rounds):
+        for code in codes:
+            start = time.perf_counter()
+            await checker.run_code_pooled(code, pool)
+            pooled_latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(checker.run_code_pooled(code, pool) for _ in range(rounds) for code in codes)
+    )
+    concurrent = time.perf_counter() - start
+    await pool.close()
+
+    print(_summary("lake exe", subprocess_latencies))
+    print(_summary("workers", pooled_latencies))
+    print(f"worker pool startup ({workers} workers): {startup:.3f}s")
+    print(
+        f"{len(codes) * rounds} concurrent checks on {workers} workers: {concurrent:.3f}s"
+    )
+    return None
+
+
+if __name__ == "__main__":
+    cli()
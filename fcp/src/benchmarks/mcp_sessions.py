@@ -0,0 +1,76 @@
+"""Time to a usable MCP session (a fresh `mcp-server` per expert versus a lease from the session pool), and per-call latency over each transport."""
+
+import statistics
+import time
+from containment.structures.cli_basic import AsyncTyper
+from containment.structures.enums import MCPTransport
+from containment.mcp.clients.pool import ServerConnection, SessionPool
+
+PROMPT_ARGUMENTS = {
+    "precondition": "x > 0",
+    "postcondition": "x > 1",
+    "metavariables": "",
+    "failed_attempts": "",
+}
+
+cli = AsyncTyper()
+
+
+def _summary(name: str, latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+    return f"{name:>16}: mean {statistics.mean(latencies) * 1000:8.3f}ms  median {statistics.median(latencies) * 1000:8.3f}ms  p95 {p95 * 1000:8.3f}ms  (n={len(latencies)})"
+
+
+async def _call_latencies(transport: MCPTransport, calls: int) -> list[float]:
+    """Time `get_prompt` and a cheap `call_tool` on one connection, the round trips every expert iteration makes."""
+    connection = await ServerConnection.open(transport=transport)
+    if connection.session is None:
+        raise RuntimeError("Unreachable: an open connection has a session.")
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await connection.session.get_prompt("imp_user_prompt", PROMPT_ARGUMENTS)
+        await connection.session.call_tool("lean-queue-metrics", {})
+        latencies.append(time.perf_counter() - start)
+    await connection.close()
+    return latencies
+
+
+@cli.command()
+async def main(rounds: int = 5, calls: int = 200) -> None:
+    """
+    Open `rounds` initialized sessions one after the other on each path, then make `calls` prompt and tool round trips on each transport.
+    """
+    spawned = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        connection = await ServerConnection.open(transport=MCPTransport.STDIO)
+        spawned.append(time.perf_counter() - start)
+        await connection.close()
+
+    pool = SessionPool(1, max_size=1, transport=MCPTransport.STDIO)
+    start = time.perf_counter()
+    await pool.start()
+    startup = time.perf_counter() - start
+    leased = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        async with pool.lease():
+            leased.append(time.perf_counter() - start)
+    await pool.close()
+
+    print(_summary("spawned", spawned))
+    print(_summary("leased", leased))
+    print(f"pool startup (1 session): {startup:.3f}s")
+    for transport in MCPTransport:
+        print(
+            _summary(
+                f"{transport.value} calls", await _call_latencies(transport, calls)
+            )
+        )
+    return None
+
+
+if __name__ == "__main__":
+    cli()
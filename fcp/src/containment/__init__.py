@@ -1,5 +1,7 @@
 """Formal containment protocol CLI."""
 
+import asyncio
+import signal
 import subprocess
 from containment.structures.cli_basic import AsyncTyper
 from containment.structures import (
@@ -9,21 +11,37 @@ from containment.structures import (
     VerificationFailure,
 )
 from containment.structures.enums.data import ModelName
-from containment.structures.enums import ProofMethod
-from containment.mcp.server import mcp
+from containment.structures.enums import (
+    ProofMethod,
+    CompletionCacheMode,
+    MCPTransport,
+)
+from containment.mcp.server import SERVE_TRANSPORT, mcp
 from containment.mcp.clients.experts.imp import ImpExpert
-from containment.mcp.clients.experts.proof.loop import ProofExpert as LoopProofExpert
-from containment.protocol import boundary
+from containment.mcp.clients.experts.proof.loop import (
+    PROOF_BEAM,
+    ProofExpert as LoopProofExpert,
+)
+from containment.protocol import PIPELINE_DEPTH, boundary
+from containment.mcp.clients.experts.proof.hedge import HEDGE
 from containment.fsio.experiment import run_experiments
 from containment.fsio.data import MODEL_DICT
 from containment.fsio.logs import logs
+from containment.fsio.workspaces import workspace_pool
+from containment.mcp.clients.pool import MCP_TRANSPORT, session_pool
+from containment.fsio.tools import exit_on_signal
+from containment.netio.completions import COMPLETION_CACHE_MODE, completion_cache
 
 sonnet = MODEL_DICT["snt4"]
 haiku = MODEL_DICT["hku35"]
 
 
 def mcp_server_run() -> None:
-    mcp.run(transport="stdio")
+    """
+    Serve over stdio, or to many clients over the network with `FCP_MCP_SERVE=streamable-http` at `FASTMCP_HOST`:`FASTMCP_PORT` (default 127.0.0.1:8000).
+    """
+    signal.signal(signal.SIGTERM, exit_on_signal)
+    mcp.run(transport=SERVE_TRANSPORT)  # type: ignore
 
 
 def inspector() -> None:
@@ -110,10 +128,19 @@ def contain() -> None:
         proof_loop_budget: int = 10,
         proof_search_max_steps: int = 100,
         proof_search_max_trials_per_goal: int = 10,
+        proof_beam: int = PROOF_BEAM,
+        pipeline_depth: int = PIPELINE_DEPTH,
+        hedge: bool = HEDGE,
+        portfolio_models: list[ModelName] | None = None,
+        mcp_transport: MCPTransport = MCP_TRANSPORT,
     ) -> None:
         """
         Run the containment protocol at the given precondition-postcondition pair.
+
+        `--hedge` starts a refutation of a program only once its proof stalls, instead of never.
+        `--proof-method portfolio` races the loop and the tree search, and the loop with each `--portfolio-models` too.
         """
+        session_pool.transport = mcp_transport
         model_id = MODEL_DICT[model.value].litellm_id
         specification = Specification(
             precondition=precondition,
@@ -122,15 +149,29 @@ def contain() -> None:
         )
         msg = f"Running containment protocol at {model_id} for {specification}"
         logs.info(msg)
-        result = await boundary(
-            model_id,
-            specification,
-            proof_method=proof_method,
-            proof_loop_budget=proof_loop_budget,
-            attempt_budget=attempt_budget,
-            proof_search_max_steps=proof_search_max_steps,
-            proof_search_max_trials_per_goal=proof_search_max_trials_per_goal,
+        await asyncio.gather(
+            session_pool.start(),
+            *([] if mcp_transport == MCPTransport.HTTP else [workspace_pool.start()]),
         )
+        try:
+            result = await boundary(
+                model_id,
+                specification,
+                proof_method=proof_method,
+                proof_loop_budget=proof_loop_budget,
+                attempt_budget=attempt_budget,
+                proof_search_max_steps=proof_search_max_steps,
+                proof_search_max_trials_per_goal=proof_search_max_trials_per_goal,
+                proof_beam=proof_beam,
+                pipeline_depth=pipeline_depth,
+                hedge=hedge,
+                portfolio_models=[
+                    MODEL_DICT[name.value].litellm_id for name in portfolio_models or []
+                ],
+            )
+        finally:
+            workspace_pool.close()
+            await session_pool.close()
 
         if isinstance(result, list):
             msg = f"({model_id}, {specification}): No code found that is provably safe to run in the world."
@@ -143,6 +184,9 @@ def contain() -> None:
             logs.info(msg)
             msg = f"\t The lean code of the proof for you to audit is located in {result.audit_trail}"
             logs.info(msg)
+            if result.metadata.strategy is not None:
+                msg = f"\t Won by {result.metadata.strategy}, strategies ran for {result.metadata.strategy_seconds}"
+                logs.info(msg)
         return None
 
     @cli.command()
@@ -151,20 +195,35 @@ def contain() -> None:
         attempt_budget: int = 10,
         models: list[ModelName] | None = None,
         sequential: bool = False,
+        completion_cache_mode: CompletionCacheMode = COMPLETION_CACHE_MODE,
+        mcp_transport: MCPTransport = MCP_TRANSPORT,
     ) -> None:
         """
         Run the containment protocol experiments from `data.toml`
+
+        `--completion-cache-mode replay` reruns a recorded run without network access or token spend.
+        `--mcp-transport memory` runs the MCP server inside this process instead of one subprocess per session.
         """
+        completion_cache.mode = completion_cache_mode
+        session_pool.transport = mcp_transport
         if models is None:
             model_ids = [name.value for name in INCLUDE_MODELS]
         else:
             model_ids = [name.value for name in models]
-        results = await run_experiments(
-            proof_loop_budget,
-            attempt_budget,
-            include_models=model_ids,
-            sequential=sequential,
+        await asyncio.gather(
+            session_pool.start(),
+            *([] if mcp_transport == MCPTransport.HTTP else [workspace_pool.start()]),
         )
+        try:
+            results = await run_experiments(
+                proof_loop_budget,
+                attempt_budget,
+                include_models=model_ids,
+                sequential=sequential,
+            )
+        finally:
+            workspace_pool.close()
+            await session_pool.close()
         print(results)
         return None
 
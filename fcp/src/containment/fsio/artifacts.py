@@ -1,5 +1,6 @@
 from pathlib import Path
 import json
+import re
 import shutil
 import tomli_w
 from containment.structures import HoareTriple
@@ -24,6 +25,28 @@ def write_artifact(tmpdir: Path, triple: HoareTriple) -> Path:
     return target_dir
 
 
+def write_artifact_code(lean_code: str, triple: HoareTriple) -> Path:
+    """
+    Write the lean code to artifacts/{timestamp}/{hash(triple)}.lean, for workspaces that live on another host.
+    """
+    with open(target_dir / f"{hash(triple)}.lean", "w") as artifact:
+        artifact.write(lean_code)
+    return target_dir
+
+
+def write_attempt_code(lean_code: str, triple: HoareTriple, attempt: str) -> Path:
+    """
+    Write the lean code of a failed attempt to artifacts/{timestamp}/{hash(triple)}-{attempt}.lean, since the workspace it was checked in is reused.
+
+    `attempt` should tell apart every expert on the triple, e.g. by its model and a run id. Characters that don't belong in a filename, like the `/` of model names, become `_`.
+    """
+    attempt = re.sub(r"[^\w.-]", "_", attempt)
+    path = target_dir / f"{hash(triple)}-{attempt}.lean"
+    with open(path, "w") as artifact:
+        artifact.write(lean_code)
+    return path
+
+
 def dump_toml(content: dict) -> None:
     """
     Dump the content to a toml file in the artifacts directory at current timestamp
@@ -0,0 +1,146 @@
+"""Content-addressed on-disk cache of typecheck results."""
+
+import hashlib
+import json
+import os
+import tempfile
+from functools import cache
+from pathlib import Path
+from containment.structures import LakeResponse
+from containment.fsio.tools import LAKE_DIR
+
+UP = ".."
+TYPECHECK_CACHE_DIR = Path(
+    os.getenv(
+        "FCP_TYPECHECK_CACHE_DIR",
+        str(Path.cwd() / UP / "experiments" / "cache" / "typecheck"),
+    )
+)
+TYPECHECK_CACHE_MAX_ENTRIES = int(os.getenv("FCP_TYPECHECK_CACHE_MAX_ENTRIES", "4096"))
+TYPECHECK_CACHE_ENABLED = os.getenv("FCP_TYPECHECK_CACHE", "1") != "0"
+
+# Everything besides `Artifacts/Basic.lean` that can change the outcome of a check.
+LIBRARY_GLOBS = [
+    "lean-toolchain",
+    "lakefile.toml",
+    "lake-manifest.json",
+    "Check.lean",
+    "Imp.lean",
+    "Imp/**/*.lean",
+    "Artifacts.lean",
+    "Artifacts/*Tests.lean",
+]
+
+
+@cache
+def library_digest(lake_dir: Path = LAKE_DIR) -> str:
+    """Digest of the lean toolchain pin, the lake configuration and the Imp library sources."""
+    digest = hashlib.sha256()
+    for pattern in LIBRARY_GLOBS:
+        for path in sorted(lake_dir.glob(pattern)):
+            digest.update(str(path.relative_to(lake_dir)).encode())
+            digest.update(b"\0")
+            digest.update(path.read_bytes())
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TypecheckCache:
+    """
+    Maps rendered lean source to the `LakeResponse` it produced, one json file per entry.
+
+    Entries are keyed by a digest of the source and of `library_digest`, so editing Imp or bumping the toolchain invalidates everything.
+    Reads touch the entry's mtime, and writes evict the least recently used entries beyond `max_entries`.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = TYPECHECK_CACHE_DIR,
+        *,
+        max_entries: int = TYPECHECK_CACHE_MAX_ENTRIES,
+        library: str | None = None,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.library = library if library is not None else library_digest()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._num_entries = len(self._entries())
+
+    def key(self, lean_code: str, namespace: str = "lake") -> str:
+        """Stable digest of the check. `namespace` separates checkers whose output formats differ."""
+        digest = hashlib.sha256()
+        for part in (namespace, self.library, lean_code):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _entries(self) -> list[Path]:
+        return list(self.cache_dir.glob("*.json"))
+
+    def get(self, lean_code: str, namespace: str = "lake") -> LakeResponse | None:
+        """Look up the response for the lean code, counting a hit or a miss."""
+        path = self._path(self.key(lean_code, namespace))
+        try:
+            with open(path, "r") as entry:
+                response = LakeResponse(**json.load(entry))
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return response
+
+    def put(
+        self, lean_code: str, response: LakeResponse, namespace: str = "lake"
+    ) -> None:
+        """Store the response atomically, so concurrent servers sharing the directory never read a partial entry."""
+        path = self._path(self.key(lean_code, namespace))
+        is_new = not path.exists()
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as entry:
+            entry.write(response.jsons)
+        os.replace(tmp, path)
+        if is_new:
+            self._num_entries += 1
+        if self._num_entries > self.max_entries:
+            self._evict()
+        return None
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries until at most `max_entries` remain."""
+        entries = []
+        for path in self._entries():
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except FileNotFoundError:  # evicted by another process
+                continue
+        entries.sort()
+        excess = len(entries) - self.max_entries
+        for _, path in entries[: max(excess, 0)]:
+            path.unlink(missing_ok=True)
+            self.evictions += 1
+        self._num_entries = min(len(entries), self.max_entries)
+        return None
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        for path in self._entries():
+            path.unlink(missing_ok=True)
+        self._num_entries = 0
+        return None
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Hit, miss and eviction counters of this process, plus the number of entries on disk."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": self._num_entries,
+        }
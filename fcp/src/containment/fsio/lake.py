@@ -1,6 +1,21 @@
-from containment.structures import HoareTriple, LakeResponse, CheckerBase
+from containment.structures import (
+    HoareTriple,
+    LakeResponse,
+    CheckerBase,
+    BatchCandidate,
+    TheoremCheck,
+)
 from containment.fsio.prompts import load_txt
-from containment.fsio.tools import lake_exe_check
+from containment.fsio.tools import (
+    OnStage,
+    lake_exe_check,
+    lake_exe_check_async,
+    lake_elaborate_async,
+)
+from containment.parsing.lean import response_diagnostics, theorem_checks
+from containment.fsio.workers import LeanWorkerPool, term_check
+
+BATCH_THEOREM_PREFIX = "my_hoare_triple_"
 
 
 class Checker(CheckerBase):
@@ -49,3 +64,68 @@ class Checker(CheckerBase):
         """Run the lake tool and return the response."""
         self.write_code(lean_code)
         return lake_exe_check(self.cwd)
+
+    async def run_code_async(
+        self, lean_code: str, on_stage: OnStage | None = None
+    ) -> LakeResponse:
+        """Run the lake tool without blocking the event loop, waiting for a free lean slot."""
+        self.write_code(lean_code)
+        return await lake_exe_check_async(self.cwd, on_stage)
+
+    async def run_code_pooled(
+        self, lean_code: str, pool: LeanWorkerPool, on_stage: OnStage | None = None
+    ) -> LakeResponse:
+        """Write the lean code to the tmpdir, but elaborate it on a persistent lean worker instead of `lake exe check`."""
+        self.write_code(lean_code)
+        return await pool.check(lean_code, on_stage)
+
+    async def run_code_elaborate(
+        self, lean_code: str, on_stage: OnStage | None = None
+    ) -> LakeResponse:
+        """Write the lean code to the tmpdir and elaborate it with `lean --json`, followed by the term check of `Check.lean`, skipping the `check` executable."""
+        self.write_code(lean_code)
+        return await lake_elaborate_async(
+            self.cwd, on_stage, lean_code=f"{lean_code}\n\n{term_check(self.cwd)}"
+        )
+
+    def write_batch(
+        self, candidates: list[BatchCandidate]
+    ) -> tuple[str, dict[str, tuple[int, int]]]:
+        """
+        Write every candidate as its own theorem, `my_hoare_triple_{i}`, into one file in the tmpdir.
+
+        Returns:
+            The lean code, and the 1-indexed lines `[start, end)` of each theorem by name, in the order of the candidates. The lines are counted as the file is rendered, since a proof could fake or hide a theorem from anything parsing it afterwards
+        """
+        lean_code = load_txt("loop/Batch.lean.template")
+        starts: dict[str, int] = {}
+        for idx, candidate in enumerate(candidates):
+            name = f"{BATCH_THEOREM_PREFIX}{idx}"
+            lean_code += "\n\n"
+            starts[name] = lean_code.count("\n") + 1
+            lean_code += load_txt(
+                "loop/BatchTheorem.lean.template",
+                name=name,
+                **candidate.model_dump(),
+            )
+        ends = [*list(starts.values())[1:], lean_code.count("\n") + 2]
+        self.write_code(lean_code)
+        return lean_code, {
+            name: (start, end) for (name, start), end in zip(starts.items(), ends)
+        }
+
+    async def run_batch(
+        self, candidates: list[BatchCandidate], on_stage: OnStage | None = None
+    ) -> list[TheoremCheck]:
+        """
+        Elaborate many candidate proofs with a single `lean --json`, so they share the import cost.
+
+        Args:
+            candidates: The triples, proofs and polarities to check
+
+        Returns:
+            list[TheoremCheck]: One result per candidate, in order. Every candidate fails when lean timed out, was killed, or failed without saying why
+        """
+        _, spans = self.write_batch(candidates)
+        response = await lake_elaborate_async(self.cwd, on_stage)
+        return theorem_checks(spans, response_diagnostics(response))
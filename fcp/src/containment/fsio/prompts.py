@@ -1,6 +1,8 @@
+from functools import cache
 from pathlib import Path
+from typing import Any, Callable
 from jinja2 import Environment, FileSystemLoader
-from containment.structures import Specification, HoareTriple, Language
+from containment.structures import Specification, HoareTriple, Language, Polarity
 
 TEMPLATE_DIR = Path.cwd() / ".." / "txt"
 
@@ -40,24 +42,56 @@ def expert_system_prompt(language: Language) -> str:
     )
 
 
-def imp_user_prompt(spec: Specification, failed_attempts: str) -> str:
-    """
-    Get the user prompt for the imp oracle.
-    """
-    return load_txt(
-        "imp.user.prompt.template", failed_attempts=failed_attempts, **spec.model_dump()
-    )
+@cache
+def _triple_variables(
+    precondition: str, command: str, postcondition: str, metavariables: str
+) -> dict[str, Any]:
+    """The triple's part of the proof prompt's variables, which doesn't change over an expert's iterations. Callers must not mutate it."""
+    return HoareTriple(
+        specification=Specification(
+            precondition=precondition,
+            postcondition=postcondition,
+            metavariables=metavariables,
+        ),
+        command=command,
+    ).model_dump()
 
 
-def proof_user_prompt(
-    triple: HoareTriple, stderr: str | None = None, positive: bool = True
-) -> str:
-    """
-    Get the user prompt for the proof oracle.
-    """
-    return load_txt(
+def proof_prompt_variables(
+    precondition: str,
+    command: str,
+    postcondition: str,
+    metavariables: str,
+    stderr: str,
+    polarity: str,
+) -> dict[str, Any]:
+    """The variables of the proof user prompt template, from the string arguments of the `hoare_proof_user_prompt` MCP prompt."""
+    return {
+        **_triple_variables(precondition, command, postcondition, metavariables),
+        "stderr": stderr or None,
+        "positive": polarity != Polarity.NEG.value,
+    }
+
+
+def imp_prompt_variables(
+    precondition: str, postcondition: str, metavariables: str, failed_attempts: str
+) -> dict[str, Any]:
+    """The variables of the imp user prompt template, from the string arguments of the `imp_user_prompt` MCP prompt."""
+    return {
+        **Specification(
+            precondition=precondition,
+            postcondition=postcondition,
+            metavariables=metavariables,
+        ).model_dump(),
+        "failed_attempts": failed_attempts,
+    }
+
+
+# The template and argument mapping behind each MCP prompt, shared by the server and by clients that render prompts themselves.
+PROMPT_TEMPLATES: dict[str, tuple[str, Callable[..., dict[str, Any]]]] = {
+    "hoare_proof_user_prompt": (
         "loop/proof.user.prompt.template",
-        **triple.model_dump(),
-        stderr=stderr,
-        positive=positive,
-    )
+        proof_prompt_variables,
+    ),
+    "imp_user_prompt": ("imp.user.prompt.template", imp_prompt_variables),
+}
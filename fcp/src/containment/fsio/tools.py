@@ -1,12 +1,25 @@
+import asyncio
 import atexit
+import ctypes
+import os
+import resource
 import shutil
+import signal
+import stat
 import subprocess
+import sys
 import tempfile
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable
 from pantograph import Server
 from containment.structures import LakeResponse
+from containment.structures.enums import CloneMode
 
 CMD = ["lake", "exe", "check"]
+ELABORATE_CMD = ["lake", "env", "lean", "--json", "Artifacts/Basic.lean"]
+ELABORATE_STDIN_CMD = ["lake", "env", "lean", "--json", "--stdin"]
 UP = ".."
 LAKE_DIR = Path.cwd() / UP / "imp"
 LEAN_PATH = subprocess.run(
@@ -16,7 +29,39 @@ LEAN_PATH = subprocess.run(
     cwd=LAKE_DIR,
 ).stdout.strip()
 
+# Nothing shared by default, copy-on-write where the filesystem supports it.
+CLONE_MODE = CloneMode(os.getenv("FCP_CLONE_MODE", CloneMode.REFLINK.value))
+WORKSPACE_ROOT = os.getenv(
+    "FCP_WORKSPACE_DIR"
+)  # same filesystem as LAKE_DIR, for hardlinks
+LAKE = ".lake"
+# Modules of the root package that are rebuilt whenever `Artifacts/Basic.lean` changes.
+MUTABLE_MODULE_PREFIXES = ("Artifacts", "Check")
+
+LEAN_PROCESS_MEMORY_GB = float(os.getenv("FCP_LEAN_PROCESS_MEMORY_GB", "2"))
+
+
+def _default_lean_concurrency() -> int:
+    """One lean process per core, unless RAM runs out first."""
+    cores = os.cpu_count() or 1
+    ram = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    return max(1, min(cores, int(ram // (LEAN_PROCESS_MEMORY_GB * 2**30))))
+
+
+LEAN_CONCURRENCY = int(os.getenv("FCP_LEAN_CONCURRENCY", "0")) or (
+    _default_lean_concurrency()
+)
+# Hard limits per check, 0 disables. The memory cap applies to each process of the check separately.
+LEAN_TIMEOUT_SECONDS = float(os.getenv("FCP_LEAN_TIMEOUT_SECONDS", "120"))
+LEAN_MEMORY_MB = int(
+    os.getenv("FCP_LEAN_MEMORY_MB", str(int(2 * LEAN_PROCESS_MEMORY_GB * 1024)))
+)
+TIMEOUT_EXIT_CODE = 124  # what coreutils' `timeout` exits with
+PR_SET_PDEATHSIG = 1
+_LIBC = ctypes.CDLL(None, use_errno=True) if sys.platform == "linux" else None
+
 _temp_dirs = set()
+_live_process_groups: set[int] = set()
 
 
 def _cleanup_temp_dirs():
@@ -28,8 +73,82 @@ def _cleanup_temp_dirs():
             print(f"Error cleaning up temporary directory {tmpdir}: {e}")
 
 
+def _kill_process_group(pgid: int) -> None:
+    """SIGKILL lake and every lean process it spawned."""
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):  # already gone
+        pass
+    return None
+
+
+def kill_lean_processes() -> None:
+    """Kill every check still running, so that no lean build outlives this process."""
+    for pgid in list(_live_process_groups):
+        _kill_process_group(pgid)
+    _live_process_groups.clear()
+    return None
+
+
+def exit_on_signal(signum: int, _frame) -> None:
+    """Signal handler that kills the running checks before exiting, since `atexit` hooks don't run on SIGTERM."""
+    kill_lean_processes()
+    raise SystemExit(128 + signum)
+
+
 # Register cleanup function to run at exit
 atexit.register(_cleanup_temp_dirs)
+atexit.register(kill_lean_processes)
+
+
+def _limit_lean_process() -> None:
+    """
+    Runs in the forked child before `exec`. Caps the data segment, which unlike the address space doesn't count the memory lean only reserves.
+    On linux the child is also killed when its parent dies, should the parent be killed before it can clean up.
+    """
+    if LEAN_MEMORY_MB > 0:
+        limit = LEAN_MEMORY_MB * 2**20
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+    if _LIBC is not None:
+        _LIBC.prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    return None
+
+
+def _timed_out(cmd: list[str]) -> LakeResponse:
+    return LakeResponse(
+        exit_code=TIMEOUT_EXIT_CODE,
+        stdout="",
+        stderr=f"`{' '.join(cmd)}` timed out after {LEAN_TIMEOUT_SECONDS:g} seconds and was killed.",
+        timed_out=True,
+    )
+
+
+def _run_lake(cmd: list[str], cwd: Path) -> LakeResponse:
+    """Run a lake command in its own process group, killing the whole group on timeout or interrupt."""
+    with subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        text=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        process_group=0,
+        preexec_fn=_limit_lean_process,
+    ) as process:
+        _live_process_groups.add(process.pid)
+        try:
+            stdout, stderr = process.communicate(timeout=LEAN_TIMEOUT_SECONDS or None)
+        except subprocess.TimeoutExpired:
+            _kill_process_group(process.pid)
+            process.communicate()
+            return _timed_out(cmd)
+        except BaseException:
+            _kill_process_group(process.pid)
+            raise
+        finally:
+            _live_process_groups.discard(process.pid)
+    return LakeResponse.from_subprocess_result(
+        subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+    )
 
 
 def lake_exe_check(cwd: Path) -> LakeResponse:
@@ -38,25 +157,263 @@ def lake_exe_check(cwd: Path) -> LakeResponse:
 
     Assumes: a properly formed lake project is in the directory.
     """
-    result = subprocess.run(CMD, text=True, capture_output=True, cwd=cwd)
+    return _run_lake(CMD, cwd)
 
-    return LakeResponse.from_subprocess_result(result)
+
+def _is_mutable_build_output(relpath: Path) -> bool:
+    """
+    Whether a file under `.lake` may be written by a check. Only the root package's `Artifacts`, `Check` and `bin` outputs are, while the Imp and dependency oleans are only ever read.
+    """
+    parts = relpath.parts
+    if len(parts) < 3 or parts[1] != "build":
+        return parts[1] != "packages"  # lake's config cache is small, so don't share it
+    if parts[2] == "bin":
+        return True
+    return any(part.startswith(MUTABLE_MODULE_PREFIXES) for part in parts[3:])
 
 
-def temp_lakeproj_init(lake_dir: Path = LAKE_DIR) -> Path:
+def _link_or_copy(src: Path, dst: Path) -> None:
     """
-    Copies the lake project to a temporary directory. We're allowing stale tmp files because we want to pass around the tmpdir without worrying about it getting cleaned up.
+    Hardlink, falling back to a copy across filesystems.
+
+    A linked file is made read-only, in `src` too since they share the inode, so that a rebuild in any clone fails to write through to the others instead of silently corrupting them.
     """
-    tmpdir = Path(tempfile.mkdtemp())
-    _temp_dirs.add(tmpdir)  # Add to set of directories to clean up
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+        return None
+    mode = os.stat(dst).st_mode
+    os.chmod(dst, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+    return None
+
+
+def _clone_lake_dir(lake_dir: Path, tmpdir: Path, mode: CloneMode) -> None:
+    """
+    Materialize `lake_dir` in `tmpdir`. Sources are always copied, what differs is how much of `.lake` is shared with `lake_dir`.
+
+    - `COPY`: nothing is shared.
+    - `SYMLINK`: `.lake/packages` is a symlink, and the build directory is copied.
+    - `HARDLINK`: every immutable file in `.lake` is hardlinked read-only, and the mutable build outputs are copied.
+    - `REFLINK`: copy-on-write clone of everything where the filesystem supports it, otherwise a plain copy. The default.
+
+    Sharing is safe as long as the Imp sources in the clone match `lake_dir`, because then lake never rebuilds the shared oleans.
+    """
+    if mode == CloneMode.REFLINK:
+        result = subprocess.run(
+            ["cp", "-a", "--reflink=auto", f"{lake_dir}/.", str(tmpdir)],
+            capture_output=True,
+        )
+        if result.returncode == 0:
+            return None
+        mode = CloneMode.COPY
+    if mode == CloneMode.COPY:
+        shutil.copytree(lake_dir, tmpdir, symlinks=True, dirs_exist_ok=True)
+        return None
     shutil.copytree(
         lake_dir,
         tmpdir,
+        symlinks=True,
         dirs_exist_ok=True,
+        ignore=lambda directory, _: [LAKE] if Path(directory) == lake_dir else [],
+    )
+    lake = lake_dir / LAKE
+    if not lake.exists():
+        return None
+    if mode == CloneMode.SYMLINK:
+        shutil.copytree(
+            lake,
+            tmpdir / LAKE,
+            symlinks=True,
+            ignore=lambda directory, _: ["packages"] if Path(directory) == lake else [],
+        )
+        if (lake / "packages").exists():
+            os.symlink(lake / "packages", tmpdir / LAKE / "packages")
+        return None
+    for root, dirs, files in os.walk(lake):
+        relroot = Path(root).relative_to(lake_dir)
+        (tmpdir / relroot).mkdir(parents=True, exist_ok=True)
+        for name in dirs:
+            if (lake_dir / relroot / name).is_symlink():
+                os.symlink(
+                    os.readlink(lake_dir / relroot / name), tmpdir / relroot / name
+                )
+        for name in files:
+            relpath = relroot / name
+            if _is_mutable_build_output(relpath):
+                shutil.copy2(
+                    lake_dir / relpath, tmpdir / relpath, follow_symlinks=False
+                )
+            else:
+                _link_or_copy(lake_dir / relpath, tmpdir / relpath)
+    return None
+
+
+class LeanSlots:
+    """
+    Process-wide bound on concurrently running lean processes, with metrics on how long checks queue for a slot.
+    """
+
+    def __init__(self, limit: int = LEAN_CONCURRENCY) -> None:
+        self.limit = limit
+        self.waiting = 0
+        self.running = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def _semaphore_for_loop(self) -> asyncio.Semaphore:
+        """The semaphore, recreated when used from a new event loop (each `asyncio.run`)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[float]:
+        """Hold a slot for the duration of the context. Yields the seconds spent queueing."""
+        semaphore = self._semaphore_for_loop()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        start = time.monotonic()
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - start
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.running += 1
+        try:
+            yield waited
+        finally:
+            self.running -= 1
+            semaphore.release()
+
+    @property
+    def metrics(self) -> dict[str, float]:
+        """Queue depth now and at worst, and the mean and max seconds waited for a slot."""
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "acquired": self.acquired,
+            "mean_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+lean_slots = LeanSlots()
+
+# Told each stage a check enters ("queued", "building", "elaborating"), e.g. to notify the MCP client waiting on it.
+OnStage = Callable[[str], Awaitable[None]]
+
+
+async def _lake_async(
+    cmd: list[str],
+    cwd: Path,
+    on_stage: OnStage | None = None,
+    *,
+    stage: str = "building",
+    stdin: str | None = None,
+) -> LakeResponse:
+    """
+    Run a lake command without blocking the event loop, once a lean slot is free, feeding it `stdin` if given.
+
+    The command runs in its own process group under the limits of `_limit_lean_process`. The group is killed when the check times out or is cancelled.
+    `on_stage` hears "queued" and then `stage` once the slot is acquired.
+    """
+    if on_stage is not None:
+        await on_stage("queued")
+    async with lean_slots.slot():
+        if on_stage is not None:
+            await on_stage(stage)
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            stdin=asyncio.subprocess.PIPE if stdin is not None else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            process_group=0,
+            preexec_fn=_limit_lean_process,
+        )
+        _live_process_groups.add(process.pid)
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(stdin.encode() if stdin is not None else None),
+                LEAN_TIMEOUT_SECONDS or None,
+            )
+        except TimeoutError:
+            _kill_process_group(process.pid)
+            await process.wait()
+            return _timed_out(cmd)
+        except BaseException:  # cancelled, e.g. because the other polarity won
+            _kill_process_group(process.pid)
+            raise
+        finally:
+            _live_process_groups.discard(process.pid)
+    return LakeResponse(
+        exit_code=process.returncode if process.returncode is not None else 1,
+        stdout=stdout.decode(),
+        stderr=stderr.decode(),
     )
+
+
+async def lake_exe_check_async(
+    cwd: Path, on_stage: OnStage | None = None
+) -> LakeResponse:
+    """
+    Run `lake exe check` in the given directory without blocking the event loop, once a lean slot is free.
+
+    Assumes: a properly formed lake project is in the directory.
+    """
+    return await _lake_async(CMD, cwd, on_stage)
+
+
+async def lake_elaborate_async(
+    cwd: Path, on_stage: OnStage | None = None, lean_code: str | None = None
+) -> LakeResponse:
+    """
+    Elaborate `Artifacts/Basic.lean`, or `lean_code` from stdin, with `lean --json`, which prints one json diagnostic per line. Nothing is built or linked.
+
+    Assumes: a properly formed lake project is in the directory, with `Imp` already built.
+    """
+    if lean_code is not None:
+        return await _lake_async(
+            ELABORATE_STDIN_CMD, cwd, on_stage, stage="elaborating", stdin=lean_code
+        )
+    return await _lake_async(ELABORATE_CMD, cwd, on_stage, stage="elaborating")
+
+
+def temp_lakeproj_init(lake_dir: Path = LAKE_DIR, mode: CloneMode = CLONE_MODE) -> Path:
+    """
+    Clones the lake project to a temporary directory. We're allowing stale tmp files because we want to pass around the tmpdir without worrying about it getting cleaned up.
+
+    See `_clone_lake_dir` for the `mode`s, set by `FCP_CLONE_MODE`.
+    """
+    tmpdir = Path(tempfile.mkdtemp(dir=WORKSPACE_ROOT))
+    _temp_dirs.add(tmpdir)  # Add to set of directories to clean up
+    try:
+        _clone_lake_dir(lake_dir, tmpdir, mode)
+    except BaseException:
+        remove_lakeproj(tmpdir)
+        raise
     return tmpdir
 
 
+def remove_lakeproj(tmpdir: Path) -> None:
+    """Eagerly remove a temporary lake project instead of waiting for exit."""
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    _temp_dirs.discard(tmpdir)
+    return None
+
+
 async def pantograph_init(cwd: Path) -> Server:
     """
     Initialize the Pantograph server.
@@ -65,3 +422,13 @@ async def pantograph_init(cwd: Path) -> Server:
         lean_path=LEAN_PATH, project_path=str(cwd), imports=["Aesop", "Imp"]
     )
     return server
+
+
+def pantograph_close(server: Server) -> None:
+    """
+    Kill the server's lean REPL now, rather than whenever the server is garbage collected.
+
+    pantograph only exposes this as the private `_close` that its `__del__` runs, so this is the one place that reaches for it.
+    """
+    server._close()
+    return None
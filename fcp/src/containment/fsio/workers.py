@@ -0,0 +1,182 @@
+"""Persistent Lean elaboration workers, so that checks don't pay for importing `Aesop` and `Imp` every time."""
+
+import asyncio
+import os
+from containment.fsio.logs import logs
+from pathlib import Path
+from pantograph import Server
+from containment.structures import LakeResponse
+from containment.fsio.tools import (
+    LAKE_DIR,
+    LEAN_TIMEOUT_SECONDS,
+    TIMEOUT_EXIT_CODE,
+    OnStage,
+    pantograph_close,
+    pantograph_init,
+)
+from containment.mcp.clients.experts.proof import SORRY_CANARY
+from containment.parsing.lean import CHECKED_TERM, PROVEN_OK
+
+LEAN_WORKERS = int(os.getenv("FCP_LEAN_WORKERS", "0"))
+
+
+def strip_header(lean_code: str) -> str:
+    """
+    Remove the leading `import` lines. The workers already have `Aesop` and `Imp` in their environment, and lean rejects `import` anywhere but the header.
+    """
+    lines = lean_code.splitlines()
+    idx = 0
+    while idx < len(lines) and (
+        lines[idx].startswith("import ") or not lines[idx].strip()
+    ):
+        idx += 1
+    return "\n".join(lines[idx:])
+
+
+def term_check(lake_dir: Path) -> str:
+    """The term check of `Check.lean` without its header, to elaborate right after the code it checks."""
+    return strip_header((lake_dir / "Check.lean").read_text())
+
+
+def response_from_messages(messages: list[str]) -> LakeResponse:
+    """
+    Build the `LakeResponse` that `lake exe check` would have produced from the worker's elaboration messages, which end with the output of `Check.lean`'s term check.
+
+    As with the check executable, code that elaborates without errors is only proven when the term check says so. Should the check not report at all, e.g. because there is no `my_hoare_triple`, the code fails.
+    """
+    has_error = any(": error: " in message for message in messages)
+    checked = any(
+        canary in message
+        for message in messages
+        for canary in (PROVEN_OK, SORRY_CANARY)
+    )
+    stderr = list(messages)
+    if not has_error and not checked:
+        stderr.append(f"The term check of `{CHECKED_TERM}` reported nothing.")
+    return LakeResponse(
+        exit_code=0 if checked and not has_error else 1,
+        stdout="",
+        stderr="\n".join(stderr),
+    )
+
+
+class LeanWorkerPool:
+    """
+    A fixed number of long-lived pantograph servers with `Aesop` and `Imp` imported, leased out one check at a time.
+
+    A slot whose server failed to spawn stays in the pool as None, and the next check to lease it spawns the server, so the pool never shrinks.
+    """
+
+    def __init__(self, size: int, lake_dir: Path = LAKE_DIR) -> None:
+        if size < 1:
+            raise ValueError(f"A worker pool needs at least one worker, got {size}")
+        self.size = size
+        self.lake_dir = lake_dir
+        self._idle: asyncio.Queue[Server | None] = asyncio.Queue()
+        self._start_lock = asyncio.Lock()
+        self._started = False
+        self._respawning: set[asyncio.Task] = set()
+        self._term_check = ""
+
+    async def start(self) -> None:
+        """Spawn the workers. Idempotent, and called lazily by `check`."""
+        async with self._start_lock:
+            if self._started:
+                return None
+            self._term_check = term_check(self.lake_dir)
+            servers = await asyncio.gather(
+                *(pantograph_init(self.lake_dir) for _ in range(self.size))
+            )
+            for server in servers:
+                self._idle.put_nowait(server)
+            self._started = True
+        return None
+
+    async def _respawn(self) -> None:
+        """Add a fresh worker in place of one that was killed, or an empty slot when it can't be spawned."""
+        server = None
+        try:
+            server = await pantograph_init(self.lake_dir)
+        except Exception as exc:
+            logs.warning(
+                f"Lean worker failed to respawn, retrying on its next check: {exc}"
+            )
+        finally:
+            self._idle.put_nowait(server)
+        return None
+
+    def _respawn_later(self) -> None:
+        """Respawn in the background, so the check that broke its worker doesn't wait for lean to start again."""
+        respawn = asyncio.create_task(self._respawn())
+        self._respawning.add(respawn)
+        respawn.add_done_callback(self._respawning.discard)
+        return None
+
+    async def _lease(self) -> Server:
+        """The next idle worker, spawning it first when its slot is empty."""
+        server = await self._idle.get()
+        if server is not None:
+            return server
+        try:
+            return await pantograph_init(self.lake_dir)
+        except BaseException:
+            self._idle.put_nowait(None)
+            raise
+
+    async def check(
+        self, lean_code: str, on_stage: OnStage | None = None
+    ) -> LakeResponse:
+        """
+        Elaborate the lean code, followed by the term check of `Check.lean`, on the next idle worker.
+
+        A worker that crashes or exceeds `FCP_LEAN_TIMEOUT_SECONDS` is killed, and the check is reported as failed or timed out.
+        A cancelled check kills its worker at once, rather than letting it finish elaborating code nobody waits for. Either way a replacement is spawned in the background.
+        """
+        await self.start()
+        if on_stage is not None:
+            await on_stage("queued")
+        try:
+            server = await self._lease()
+        except Exception as exc:
+            return LakeResponse(
+                exit_code=1, stdout="", stderr=f"Lean worker failed to start: {exc}"
+            )
+        try:
+            if on_stage is not None:
+                await on_stage("elaborating")
+            units = await asyncio.wait_for(
+                server.check_compile_async(
+                    f"{strip_header(lean_code)}\n\n{self._term_check}"
+                ),
+                LEAN_TIMEOUT_SECONDS or None,
+            )
+        except asyncio.CancelledError:
+            pantograph_close(server)
+            self._respawn_later()
+            raise
+        except Exception as exc:  # the worker is in an unknown state, so replace it
+            pantograph_close(server)
+            self._respawn_later()
+            if isinstance(exc, TimeoutError):
+                return LakeResponse(
+                    exit_code=TIMEOUT_EXIT_CODE,
+                    stdout="",
+                    stderr=f"Lean worker timed out after {LEAN_TIMEOUT_SECONDS:g} seconds and was replaced.",
+                    timed_out=True,
+                )
+            return LakeResponse(
+                exit_code=1, stdout="", stderr=f"Lean worker failed: {exc}"
+            )
+        self._idle.put_nowait(server)
+        return response_from_messages(
+            [message for unit in units for message in unit.messages]
+        )
+
+    async def close(self) -> None:
+        """Shut down the idle workers."""
+        while not self._idle.empty():
+            server = self._idle.get_nowait()
+            if server is not None:
+                pantograph_close(server)
+        self._started = False
+        return None
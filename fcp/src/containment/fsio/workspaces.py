@@ -0,0 +1,182 @@
+"""A pool of pre-cloned lake projects, leased to experts and recycled."""
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from functools import cached_property
+from pathlib import Path
+from typing import AsyncIterator
+from containment.fsio.tools import LAKE_DIR, remove_lakeproj, temp_lakeproj_init
+
+WORKSPACES = int(os.getenv("FCP_WORKSPACES", "4"))
+WORKSPACES_MAX = int(os.getenv("FCP_WORKSPACES_MAX", "32"))
+WORKSPACE_IDLE_SECONDS = float(os.getenv("FCP_WORKSPACE_IDLE_SECONDS", "300"))
+
+
+def _remove_created(creation: asyncio.Future) -> None:
+    """Remove the workspace a cancelled lease was still cloning, once cloning is done."""
+    if not creation.cancelled() and creation.exception() is None:
+        remove_lakeproj(creation.result())
+    return None
+
+
+class WorkspacePool:
+    """
+    Keeps `size` lake projects warm and never holds more than `max_size`.
+
+    A returned workspace is reset by rewriting `Artifacts/Basic.lean` only, so its build directory stays warm for the next lease.
+    Idle workspaces beyond the warm `size` are removed after `idle_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        size: int = WORKSPACES,
+        *,
+        max_size: int = WORKSPACES_MAX,
+        idle_timeout: float = WORKSPACE_IDLE_SECONDS,
+        lake_dir: Path = LAKE_DIR,
+    ) -> None:
+        if max_size < max(size, 1):
+            raise ValueError(
+                f"max_size {max_size} must be at least the warm size {size} and positive"
+            )
+        self.size = size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.lake_dir = lake_dir
+        self._idle: list[tuple[float, Path]] = []  # (returned at, workspace)
+        self._leased: set[Path] = set()
+        self._creating = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._cond = asyncio.Condition()
+
+    @cached_property
+    def pristine_basic(self) -> str:
+        """`Artifacts/Basic.lean` as cloned, read when first needed rather than at import, relative to whatever the cwd is then."""
+        return (self.lake_dir / "Artifacts" / "Basic.lean").read_text()
+
+    @property
+    def total(self) -> int:
+        return len(self._idle) + len(self._leased) + self._creating
+
+    def _condition(self) -> asyncio.Condition:
+        """The condition, recreated when the pool is used from a new event loop (each `asyncio.run`)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def start(self) -> None:
+        """Pre-create workspaces up to the warm size, off the critical path of the first leases."""
+        cond = self._condition()
+        async with cond:
+            missing = self.size - self.total
+            if missing <= 0:
+                return None
+            self._creating += missing
+        created: list[Path | BaseException] = []
+        try:
+            created = await asyncio.gather(
+                *(self._create() for _ in range(missing)), return_exceptions=True
+            )
+        finally:
+            async with cond:
+                self._creating -= missing
+                now = time.monotonic()
+                self._idle.extend(
+                    (now, workspace)
+                    for workspace in created
+                    if isinstance(workspace, Path)
+                )
+                cond.notify_all()
+        for error in created:
+            if isinstance(error, BaseException):
+                raise error
+        return None
+
+    async def _create(self) -> Path:
+        """Clone a workspace off the event loop. Should the caller be cancelled first, the clone is removed once it's done instead of leaking."""
+        creation = asyncio.ensure_future(
+            asyncio.to_thread(temp_lakeproj_init, self.lake_dir)
+        )
+        try:
+            return await asyncio.shield(creation)
+        except asyncio.CancelledError:
+            creation.add_done_callback(_remove_created)
+            raise
+
+    def _evict_idle(self) -> None:
+        """Remove workspaces that have idled past the timeout, keeping the warm size."""
+        now = time.monotonic()
+        while (
+            len(self._idle) + len(self._leased) > self.size
+            and self._idle
+            and now - self._idle[0][0] > self.idle_timeout
+        ):
+            _, workspace = self._idle.pop(0)
+            remove_lakeproj(workspace)
+        return None
+
+    async def _acquire(self) -> Path:
+        cond = self._condition()
+        async with cond:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    _, workspace = self._idle.pop()  # most recently returned
+                    self._leased.add(workspace)
+                    return workspace
+                if self.total < self.max_size:
+                    break
+                await cond.wait()
+            self._creating += 1  # reserve the slot before releasing the lock
+        try:
+            workspace = await self._create()
+        except BaseException:
+            self._creating -= 1
+            async with cond:
+                cond.notify()
+            raise
+        self._creating -= 1
+        self._leased.add(workspace)
+        return workspace
+
+    def _reset(self, workspace: Path) -> None:
+        with open(workspace / "Artifacts" / "Basic.lean", "w") as basic_dot_lean:
+            basic_dot_lean.write(self.pristine_basic)
+        return None
+
+    async def _release(self, workspace: Path) -> None:
+        cond = self._condition()
+        async with cond:
+            self._leased.discard(workspace)
+            try:
+                self._reset(workspace)
+            except OSError:  # the workspace was damaged, so don't recycle it
+                remove_lakeproj(workspace)
+            else:
+                self._idle.append((time.monotonic(), workspace))
+            self._evict_idle()
+            cond.notify()
+        return None
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[Path]:
+        """Lease a workspace for the duration of the context, waiting if `max_size` are already leased."""
+        workspace = await self._acquire()
+        try:
+            yield workspace
+        finally:
+            await self._release(workspace)
+
+    def close(self) -> None:
+        """Remove every idle workspace. Leased ones are left to the exit hook."""
+        while self._idle:
+            _, workspace = self._idle.pop()
+            remove_lakeproj(workspace)
+        return None
+
+
+workspace_pool = WorkspacePool()
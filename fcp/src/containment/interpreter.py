@@ -0,0 +1,344 @@
+"""
+Run imp programs in python, to falsify a Hoare triple on sampled states before any proof is attempted.
+
+The semantics are those of `imp/Imp/Stmt/BigStep.lean`: values are unbounded ints, conditions are truthy when nonzero,
+and a division by zero is undefined, so the program has no run from that state. A triple only claims partial correctness,
+so runs that get stuck, or don't finish within the fuel, are no counterexamples.
+A program is compiled to one python function, which then runs a whole batch of states.
+"""
+
+import os
+import random
+from typing import Callable, Iterable, Iterator
+from containment.fsio.logs import logs
+from containment.parsing.imp import ImpSyntaxError, parse_assertion, parse_program
+from containment.structures import HoareTriple
+from containment.structures.imp import (
+    Assertion,
+    Assign,
+    Binary,
+    Comparison,
+    Connect,
+    Const,
+    Counterexample,
+    Escape,
+    Expr,
+    If,
+    Meta,
+    Negation,
+    Seq,
+    Skip,
+    Stmt,
+    Unary,
+    Var,
+    While,
+)
+
+FALSIFY = os.getenv("FCP_FALSIFY", "1") != "0"
+FALSIFY_SAMPLES = int(os.getenv("FCP_FALSIFY_SAMPLES", "2000"))
+FALSIFY_FUEL = int(os.getenv("FCP_FALSIFY_FUEL", "1000"))  # loop iterations per run
+MAX_BITS = 4096
+
+type State = dict[str, int]
+
+
+class Unsupported(ValueError):
+    """The triple escapes to lean in a way python can't follow, so it can't be falsified here."""
+
+
+class Stuck(Exception):
+    """The run has no next step, e.g. it divides by zero."""
+
+
+class OutOfFuel(Exception):
+    pass
+
+
+def _div(a: int, b: int) -> int:
+    """Lean's `Int` division, rounding so that the remainder is nonnegative, and undefined by zero in imp."""
+    if b == 0:
+        raise Stuck
+    return a // b if b > 0 else -(a // -b)
+
+
+def _mul(a: int, b: int) -> int:
+    product = a * b
+    if product.bit_length() > MAX_BITS:
+        raise OutOfFuel  # too large to be worth following
+    return product
+
+
+_RUNTIME = {"_div": _div, "_mul": _mul, "Stuck": Stuck, "OutOfFuel": OutOfFuel}
+_COMPARISONS = {"<": "<", "≤": "<=", "≥": ">=", ">": ">", "==": "=="}
+_RELATIONS = {"=": "==", "!=": "!=", "<": "<", ">": ">", "<=": "<=", ">=": ">="}
+
+
+def variables(node: Expr | Stmt | Assertion) -> list[str]:
+    """The imp variables the node reads or writes, in order of appearance."""
+    found: dict[str, None] = {}
+
+    def walk(node: Expr | Stmt | Assertion) -> None:
+        match node:
+            case Var(name=name):
+                found[name] = None
+            case Assign(name=name, value=value):
+                found[name] = None
+                walk(value)
+            case Unary(operand=operand) | Negation(operand=operand):
+                walk(operand)
+            case (
+                Binary(left=left, right=right)
+                | Comparison(left=left, right=right)
+                | Connect(left=left, right=right)
+            ):
+                walk(left)
+                walk(right)
+            case Seq(statements=statements):
+                for statement in statements:
+                    walk(statement)
+            case If(condition=condition, then=then, orelse=orelse):
+                walk(condition)
+                walk(then)
+                walk(orelse)
+            case While(condition=condition, body=body):
+                walk(condition)
+                walk(body)
+        return None
+
+    walk(node)
+    return list(found)
+
+
+class _Compiler:
+    """Emits python source for a triple's program and assertions, with imp variables and metavariables as locals."""
+
+    def __init__(self, names: list[str], metavariables: list[str]) -> None:
+        self.names = {name: f"v{idx}" for idx, name in enumerate(names)}
+        self.metas = {name: f"m{idx}" for idx, name in enumerate(metavariables)}
+
+    def prologue(self) -> list[str]:
+        return [f"{local} = state[{name!r}]" for name, local in self.names.items()] + [
+            f"{local} = meta[{name!r}]" for name, local in self.metas.items()
+        ]
+
+    def expr(self, expr: Expr) -> str:
+        match expr:
+            case Const(value=value):
+                return f"({value})"
+            case Var(name=name):
+                return self.names[name]
+            case Meta(name=name):
+                if name not in self.metas:
+                    raise Unsupported(f"`~{name}` is not a metavariable")
+                return self.metas[name]
+            case Escape(term=term):
+                raise Unsupported(f"`{term}` is opaque to python")
+            case Unary(op="-", operand=operand):
+                return f"(-{self.expr(operand)})"
+            case Unary(op="!", operand=operand):
+                return f"(1 if {self.expr(operand)} == 0 else 0)"
+            case Binary(op=op, left=left, right=right):
+                a, b = self.expr(left), self.expr(right)
+                match op:
+                    case "+" | "||":  # `or` adds, see `BinOp.apply`
+                        return f"({a} + {b})"
+                    case "-":
+                        return f"({a} - {b})"
+                    case "*" | "&&":  # `and` multiplies
+                        return f"_mul({a}, {b})"
+                    case "/":
+                        return f"_div({a}, {b})"
+                    case _:
+                        return f"(1 if {a} {_COMPARISONS[op]} {b} else 0)"
+        raise Unsupported(f"unknown expression {expr!r}")
+
+    def stmt(self, stmt: Stmt, indent: str) -> list[str]:
+        match stmt:
+            case Skip():
+                return [f"{indent}pass"]
+            case Assign(name=name, value=value):
+                return [f"{indent}{self.names[name]} = {self.expr(value)}"]
+            case Seq(statements=statements):
+                return [line for s in statements for line in self.stmt(s, indent)]
+            case If(condition=condition, then=then, orelse=orelse):
+                return [
+                    f"{indent}if {self.expr(condition)} != 0:",
+                    *self.stmt(then, indent + "    "),
+                    f"{indent}else:",
+                    *self.stmt(orelse, indent + "    "),
+                ]
+            case While(condition=condition, body=body):
+                return [
+                    f"{indent}while {self.expr(condition)} != 0:",
+                    f"{indent}    fuel -= 1",
+                    f"{indent}    if fuel < 0:",
+                    f"{indent}        raise OutOfFuel",
+                    *self.stmt(body, indent + "    "),
+                ]
+            case Escape(term=term):
+                raise Unsupported(f"`{term}` is opaque to python")
+        raise Unsupported(f"unknown statement {stmt!r}")
+
+    def assertion(self, assertion: Assertion) -> str:
+        match assertion:
+            case Comparison(op=op, left=left, right=right):
+                return f"({self.expr(left)} {_RELATIONS[op]} {self.expr(right)})"
+            case Connect(op="<^>", left=left, right=right):
+                return f"({self.assertion(left)} and {self.assertion(right)})"
+            case Connect(op="<>", left=left, right=right):
+                return f"({self.assertion(left)} or {self.assertion(right)})"
+            case Negation(operand=operand):
+                return f"(not {self.assertion(operand)})"
+        # `->>` and `<<->>` quantify over every state, see `Assertion.implies`
+        raise Unsupported(f"`{assertion}` is not a predicate on one state")
+
+    def function(self, name: str, body: list[str]) -> Callable:
+        source = "\n".join(
+            [f"def {name}(state, meta, fuel):", *("    " + line for line in body)]
+        )
+        namespace = dict(_RUNTIME)
+        exec(compile(source, f"<imp {name}>", "exec"), namespace)
+        return namespace[name]
+
+
+def _equalities(assertion: Assertion) -> Iterator[tuple[str, Expr]]:
+    """The `x = term` conjuncts of an assertion, which pin `x` in every state satisfying it."""
+    match assertion:
+        case Connect(op="<^>", left=left, right=right):
+            yield from _equalities(left)
+            yield from _equalities(right)
+        case (
+            Comparison(op="=", left=Var(name=name), right=term)
+            | Comparison(op="=", left=term, right=Var(name=name))
+        ):
+            if name not in variables(term):
+                yield name, term
+    return None
+
+
+class Falsifier:
+    """
+    A triple compiled to python: its program, its pre- and postcondition, and what pins its variables.
+
+    Pass the `program` when it is already parsed, e.g. by the expert that validated it.
+
+    Raises:
+        ImpSyntaxError: when the program or an assertion doesn't parse
+        Unsupported: when they escape to lean beyond `~metavariable` and integer arithmetic
+    """
+
+    def __init__(self, triple: HoareTriple, program: Seq | None = None) -> None:
+        specification = triple.specification
+        self.program = parse_program(triple.command) if program is None else program
+        self.precondition = parse_assertion(specification.precondition)
+        self.postcondition = parse_assertion(specification.postcondition)
+        self.metavariables = specification.metavariables.split()
+        # variables only the assertions mention are part of the state too
+        self.names = list(
+            dict.fromkeys(
+                variables(self.program)
+                + variables(self.precondition)
+                + variables(self.postcondition)
+            )
+        )
+        compiler = _Compiler(self.names, self.metavariables)
+        prologue = compiler.prologue()
+        state = "{" + ", ".join(f"{n!r}: {v}" for n, v in compiler.names.items()) + "}"
+        self._run = compiler.function(
+            "run", [*prologue, *compiler.stmt(self.program, ""), f"return {state}"]
+        )
+        self._pre = compiler.function(
+            "pre", [*prologue, f"return {compiler.assertion(self.precondition)}"]
+        )
+        self._post = compiler.function(
+            "post", [*prologue, f"return {compiler.assertion(self.postcondition)}"]
+        )
+        self._pins = [
+            (
+                name,
+                compiler.function(
+                    f"pin{idx}", [*prologue, f"return {compiler.expr(term)}"]
+                ),
+            )
+            for idx, (name, term) in enumerate(_equalities(self.precondition))
+        ]
+
+    def run(self, state: State, meta: State, fuel: int = FALSIFY_FUEL) -> State | None:
+        """The final state, or None when the run gets stuck or runs out of fuel."""
+        try:
+            return self._run(state, meta, fuel)
+        except (Stuck, OutOfFuel):
+            return None
+
+    def check(
+        self, inputs: Iterable[tuple[State, State]], fuel: int = FALSIFY_FUEL
+    ) -> tuple[Counterexample | None, int]:
+        """
+        Run the program from each (state, metavariables) input that satisfies the precondition.
+
+        Returns:
+            The first counterexample, if any, and the number of runs that ended
+        """
+        pre, run, post = self._pre, self._run, self._post
+        ended = 0
+        for state, meta in inputs:
+            if not pre(state, meta, 0):
+                continue
+            try:
+                after = run(state, meta, fuel)
+            except (Stuck, OutOfFuel):
+                continue
+            ended += 1
+            if not post(after, meta, 0):
+                return Counterexample(
+                    metavariables=meta, before=state, after=after
+                ), ended
+        return None, ended
+
+    def samples(self, count: int, rng: random.Random) -> Iterator[tuple[State, State]]:
+        """Random states and metavariables, with the variables the precondition equates to a term set to it."""
+        for _ in range(count):
+            meta = {name: _sample(rng) for name in self.metavariables}
+            state = {name: _sample(rng) for name in self.names}
+            for name, pin in self._pins:
+                try:
+                    state[name] = pin(state, meta, 0)
+                except (Stuck, OutOfFuel):
+                    pass
+            yield state, meta
+
+
+def _sample(rng: random.Random) -> int:
+    """Mostly small ints, where programs branch, some larger ones, and a few extremes."""
+    roll = rng.random()
+    if roll < 0.6:
+        return rng.randint(-4, 12)
+    if roll < 0.9:
+        return rng.randint(-1000, 1000)
+    return rng.choice([0, 1, -1, 2**31 - 1, -(2**31), 2**63])
+
+
+def falsify(
+    triple: HoareTriple,
+    *,
+    program: Seq | None = None,
+    samples: int = FALSIFY_SAMPLES,
+    fuel: int = FALSIFY_FUEL,
+    seed: int = 0,
+) -> Counterexample | None:
+    """
+    Look for a concrete counterexample to the triple on `samples` random states.
+
+    None means none was found, including when the triple can't be run in python at all: lean decides those.
+    """
+    try:
+        falsifier = Falsifier(triple, program)
+    except (ImpSyntaxError, Unsupported) as exc:
+        logs.debug(f"Not falsifying {triple}: {exc}")
+        return None
+    counterexample, ended = falsifier.check(
+        falsifier.samples(samples, random.Random(seed)), fuel
+    )
+    if counterexample is None:
+        logs.debug(f"No counterexample to {triple} in {ended} runs")
+    return counterexample
@@ -1,41 +1,120 @@
-from typing import Any, Callable
+import asyncio
+from typing import Any, Callable, Coroutine
 from abc import abstractmethod
 from mcp import ClientSession
-from mcp.client.stdio import StdioServerParameters, stdio_client
+from mcp.shared.session import ProgressFnT
+from mcp.types import (
+    CallToolResult,
+    CancelledNotification,
+    CancelledNotificationParams,
+    ClientNotification,
+    RequestId,
+)
 from containment.netio.completions import mk_complete
 from containment.structures.mcp import MCPClientBase
+from containment.mcp.clients.prompts import LOCAL_PROMPTS
+from containment.structures.enums import MCPTransport
+from containment.fsio.logs import logs
+from containment.mcp.clients.pool import (
+    MCP_POOLING,
+    SERVER_PARAMETERS,
+    ServerConnection,
+    sent_request_ids,
+    session_pool,
+)
+
+
+async def _notify_cancelled(session: ClientSession, request_id: RequestId) -> None:
+    await session.send_notification(
+        ClientNotification(
+            CancelledNotification(
+                method="notifications/cancelled",
+                params=CancelledNotificationParams(
+                    requestId=request_id, reason="The client stopped waiting."
+                ),
+            )
+        )
+    )
+    return None
+
+
+def _log_progress(tool: str) -> ProgressFnT:
+    async def on_progress(
+        progress: float, total: float | None, message: str | None
+    ) -> None:
+        logs.debug(f"{tool}: {message} ({progress:g}/{total})")
+        return None
+
+    return on_progress
 
 
 class MCPClient(MCPClientBase):
     """Subclasses are MCP clients connected to the server defined in `..server`"""
 
-    SERVER_PARAMETERS = StdioServerParameters(
-        command="uv",
-        args=["run", "mcp-server"],
-        env=None,  # Optional environment variables
-    )
+    SERVER_PARAMETERS = SERVER_PARAMETERS
 
     def _mk_complete(
-        self, model: str, system_prompt: str
-    ) -> Callable[[list[dict]], dict]:
-        return mk_complete(model, system_prompt)
+        self, model: str, system_prompt: str, **kwargs: Any
+    ) -> Callable[[list[dict]], Coroutine[Any, Any, dict]]:
+        return mk_complete(model, system_prompt, **kwargs)
 
-    async def _connect_to_server_and_run(self) -> Any:
-        async with stdio_client(self.SERVER_PARAMETERS) as (read, write):
-            async with ClientSession(read, write) as session:
-                await session.initialize()
+    async def _run_on(self, connection: ServerConnection) -> Any:
+        self.available_tools = connection.tools
+        self.available_resources = connection.resource_templates
+        self.available_prompts = connection.prompts
+        self.session = connection.session
+        self.prompt_renderer = connection.prompt_renderer
+        self.remote_workspaces = connection.transport == MCPTransport.HTTP
+        try:
+            return await self.run()
+        finally:
+            self.session = None
+            self.prompt_renderer = None
 
-                response = await session.list_tools()
-                self.available_tools = response.tools
+    async def _connect_to_server_and_run(self) -> Any:
+        """
+        Run on a session leased from the shared pool, or on a connection of its own when `FCP_MCP_POOL=0`.
+        """
+        if MCP_POOLING:
+            async with session_pool.lease() as connection:
+                return await self._run_on(connection)
+        connection = await ServerConnection.open(
+            self.SERVER_PARAMETERS, session_pool.transport
+        )
+        try:
+            return await self._run_on(connection)
+        finally:
+            await connection.close()
 
-                response = await session.list_resource_templates()
-                self.available_resources = response.resourceTemplates
+    async def _prompt_content(self, name: str, arguments: dict[str, str]) -> list[dict]:
+        """
+        The content of the user message of the server's prompt `name`, rendered client-side unless `FCP_LOCAL_PROMPTS=0`.
+        """
+        if LOCAL_PROMPTS and self.prompt_renderer is not None:
+            return await self.prompt_renderer.render(name, arguments)
+        user_prompt = await self.session.get_prompt(name, arguments=arguments)
+        return [message.content.model_dump() for message in user_prompt.messages]
 
-                response = await session.list_prompts()
-                self.available_prompts = response.prompts
+    async def _call_tool(self, name: str, arguments: dict[str, Any]) -> CallToolResult:
+        """
+        Call a tool of the server with its progress logged.
 
-                self.session = session
-                return await self.run()
+        When the caller is cancelled, e.g. because the other polarity already won, the server is told to cancel the call too, which kills its lean processes.
+        The call's request id is the one the session's write stream saw this task send, see `sent_request_ids`.
+        """
+        session = self.session
+        request_ids: list[RequestId] = []
+        token = sent_request_ids.set(request_ids)
+        try:
+            return await session.call_tool(
+                name, arguments, progress_callback=_log_progress(name)
+            )
+        except asyncio.CancelledError:
+            for request_id in request_ids:
+                await asyncio.shield(_notify_cancelled(session, request_id))
+            raise
+        finally:
+            sent_request_ids.reset(token)
 
     @abstractmethod
     async def run(self) -> Any:
@@ -1,5 +1,7 @@
 """Imp expert."""
 
+import asyncio
+import os
 from containment.mcp.clients.basic import MCPClient
 from containment.structures import (
     HoareTriple,
@@ -8,10 +10,25 @@ from containment.structures import (
     Specification,
     ImpFailure,
     Failure,
+    StreamMetrics,
 )
 from containment.fsio.logs import logs
 from containment.fsio.prompts import expert_system_prompt
 from containment.parsing.regex import parse_program_completion
+from containment.netio.completions import STREAM_COMPLETIONS
+from containment.interpreter import FALSIFY, falsify
+from containment.parsing.imp import ImpSyntaxError, parse_program
+
+CHECK_SYNTAX = os.getenv("FCP_CHECK_IMP_SYNTAX", "1") != "0"
+
+
+def _failed_attempt(failure: Failure) -> str:
+    feedback = ""
+    if isinstance(failure, ImpFailure) and failure.counterexample is not None:
+        feedback = f"<counterexample>{failure.counterexample.feedback}</counterexample>"
+    if isinstance(failure, ImpFailure) and failure.syntax_error is not None:
+        feedback = f"<syntax_error>{failure.syntax_error}</syntax_error>"
+    return f"<failed_attempt>{failure.failure_str}{feedback}</failed_attempt>"
 
 
 class ImpExpert(MCPClient):
@@ -20,16 +37,28 @@ class ImpExpert(MCPClient):
         model: str,
         spec: Specification,
         failed_attempts: list[Failure] | None = None,
+        *,
+        stream: bool = STREAM_COMPLETIONS,
+        check_syntax: bool = CHECK_SYNTAX,
+        falsify: bool = FALSIFY,
     ) -> None:
         super().__init__()
         self.model = model
         self.spec = spec
+        self.check_syntax = check_syntax
+        self.falsify = falsify
         if failed_attempts is None:
             self.failed_attempts = []
         else:
             self.failed_attempts = failed_attempts
         self.system_prompt = expert_system_prompt("imp")
-        self.complete = self._mk_complete(self.model, self.system_prompt)
+        self.stream_metrics: list[StreamMetrics] = []
+        self.complete = self._mk_complete(
+            self.model,
+            self.system_prompt,
+            stop_tag="imp" if stream else None,
+            on_metrics=self.stream_metrics.append,
+        )
         self.triple = None
         self.failure = None
 
@@ -57,7 +86,7 @@ class ImpExpert(MCPClient):
     async def _complete_triple(self) -> HoareTriple | ImpFailure:
         failed_attempts = (
             "\n".join(
-                f"<failed_attempt>{failed_attempt.failure_str}</failed_attempt>"
+                _failed_attempt(failed_attempt)
                 for failed_attempt in self.failed_attempts
             )
             if self.failed_attempts is not None
@@ -69,16 +98,13 @@ class ImpExpert(MCPClient):
             "metavariables": self.spec.metavariables,
             "failed_attempts": failed_attempts,
         }
-        user_prompt = await self.session.get_prompt(
-            "imp_user_prompt", arguments=prompt_arguments
-        )
-        completion = self.complete(
+        completion = await self.complete(
             [
                 {
                     "role": "user",
-                    "content": [
-                        message.content.model_dump() for message in user_prompt.messages
-                    ],
+                    "content": await self._prompt_content(
+                        "imp_user_prompt", prompt_arguments
+                    ),
                 }
             ]
         )
@@ -87,15 +113,50 @@ class ImpExpert(MCPClient):
         if program is None:
             msg = f"{self.spec.name},{self.model}: No program found. XML parse error, probably"
             logs.info(msg)
+            metadata = ExpertMetadata(model=self.model, polarity=Polarity.POS)
+            metadata.set_stream_metrics(self.stream_metrics)
             return ImpFailure(
                 specification=self.spec,
                 attempted_completion=message_content,
                 failed_attempts=self.failed_attempts,
-                metadata=ExpertMetadata(model=self.model, polarity=Polarity.POS),
+                metadata=metadata,
                 error_message=msg,
             )
         triple = HoareTriple(specification=self.spec, command=program)
         triple.add_tokens_spent_on_command(completion["usage"]["total_tokens"])
+        metadata = ExpertMetadata(model=self.model, polarity=Polarity.POS)
+        metadata.set_tokens_spent(triple.tokens_spent_on_command)
+        metadata.set_stream_metrics(self.stream_metrics)
+        ast = None
+        if self.check_syntax or self.falsify:
+            try:
+                ast = parse_program(program)
+            except ImpSyntaxError as exc:
+                if self.check_syntax:
+                    msg = f"{self.spec.name},{self.model}: Imp syntax error at {exc}"
+                    logs.info(msg)
+                    return ImpFailure(
+                        specification=self.spec,
+                        attempted_completion=program,
+                        failed_attempts=self.failed_attempts,
+                        metadata=metadata,
+                        error_message=msg,
+                        syntax_error=exc.feedback,
+                    )
+        if self.falsify and ast is not None:
+            # a triple that is false on a concrete state isn't worth a proof loop
+            counterexample = await asyncio.to_thread(falsify, triple, program=ast)
+            if counterexample is not None:
+                msg = f"{self.spec.name},{self.model}: {counterexample.feedback}"
+                logs.info(msg)
+                return ImpFailure(
+                    specification=self.spec,
+                    attempted_completion=program,
+                    failed_attempts=self.failed_attempts,
+                    metadata=metadata,
+                    error_message=msg,
+                    counterexample=counterexample,
+                )
         return triple
 
     async def run(self) -> HoareTriple | ImpFailure:
@@ -0,0 +1,117 @@
+"""Hedged proving: the negative polarity only joins once the positive loop stalls, and then shares its iteration budget by progress."""
+
+import asyncio
+import math
+import os
+import time
+from containment.structures import Polarity
+
+HEDGE = os.getenv("FCP_HEDGE", "0") != "0"
+HEDGE_STALL_ITERATIONS = int(os.getenv("FCP_HEDGE_STALL_ITERATIONS", "3"))
+HEDGE_STALL_SECONDS = float(os.getenv("FCP_HEDGE_STALL_SECONDS", "300"))
+HEDGE_BUDGET_FACTOR = float(os.getenv("FCP_HEDGE_BUDGET_FACTOR", "1.5"))
+PROGRESS_WINDOW = 3
+
+
+class Hedge:
+    """
+    Schedules the proof loops of both polarities on one triple.
+
+    The positive loop is stalled after `stall_iterations` iterations, or `stall_seconds`, without lowering its best error count.
+    From then on the loops draw from one budget of `budget` iterations, by stride scheduling: an iteration costs a polarity `1 / weight`,
+    where the weight is 1 plus the times its error count fell over its last `PROGRESS_WINDOW` iterations, and the polarity that has spent less goes next.
+    Loops at equal spend run their iterations concurrently. A finished loop leaves the whole remaining budget to the other.
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        *,
+        stall_iterations: int = HEDGE_STALL_ITERATIONS,
+        stall_seconds: float = HEDGE_STALL_SECONDS,
+    ) -> None:
+        self.budget = budget
+        self.stall_iterations = stall_iterations
+        self.stall_seconds = stall_seconds
+        self.used = 0
+        self.errors: dict[Polarity, list[int]] = {polarity: [] for polarity in Polarity}
+        self._spent: dict[Polarity, float] = {}  # of the polarities still running
+        self._best: int | None = None
+        self._since_progress = 0
+        self._last_progress = time.monotonic()
+        self._stalled = asyncio.Event()
+        self._cond = asyncio.Condition()
+
+    @classmethod
+    def for_loop(
+        cls, proof_loop_budget: int, factor: float = HEDGE_BUDGET_FACTOR
+    ) -> "Hedge":
+        """A hedge whose budget is `factor` times the iterations of one loop."""
+        return cls(math.ceil(factor * proof_loop_budget))
+
+    @property
+    def remaining(self) -> int:
+        return self.budget - self.used
+
+    def weight(self, polarity: Polarity) -> int:
+        recent = self.errors[polarity][-PROGRESS_WINDOW - 1 :]
+        return 1 + sum(later < earlier for earlier, later in zip(recent, recent[1:]))
+
+    def report(self, polarity: Polarity, errors: int) -> None:
+        """Record the error count of a failed iteration."""
+        self.errors[polarity].append(errors)
+        if polarity != Polarity.POS:
+            return None
+        if self._best is None or errors < self._best:
+            self._best = errors
+            self._since_progress = 0
+            self._last_progress = time.monotonic()
+        else:
+            self._since_progress += 1
+            if self._since_progress >= self.stall_iterations:
+                self._stalled.set()
+        return None
+
+    async def stalled(self) -> None:
+        """Return once the positive loop has stalled."""
+        while not self._stalled.is_set():
+            deadline = self._last_progress + self.stall_seconds
+            try:
+                await asyncio.wait_for(
+                    self._stalled.wait(), max(0.0, deadline - time.monotonic())
+                )
+            except TimeoutError:
+                if time.monotonic() - self._last_progress >= self.stall_seconds:
+                    self._stalled.set()
+        return None
+
+    async def admit(self, polarity: Polarity) -> bool:
+        """
+        Wait for the polarity's turn to run an iteration, and charge it to the budget.
+
+        Returns:
+            False once the budget is spent
+        """
+        async with self._cond:
+            # a loop joining late starts level with the least spent, instead of catching up in a burst
+            self._spent.setdefault(polarity, min(self._spent.values(), default=0.0))
+            while True:
+                if self.used >= self.budget:
+                    return False
+                others = [
+                    spent for other, spent in self._spent.items() if other != polarity
+                ]
+                if not others or self._spent[polarity] <= min(others):
+                    break
+                await self._cond.wait()
+            self.used += 1
+            self._spent[polarity] += 1 / self.weight(polarity)
+            self._cond.notify_all()
+        return True
+
+    async def finish(self, polarity: Polarity) -> None:
+        """Leave the schedule, unblocking the other loop."""
+        async with self._cond:
+            self._spent.pop(polarity, None)
+            self._cond.notify_all()
+        return None
@@ -1,39 +1,111 @@
+import asyncio
+import json
+import os
+import uuid
+from contextlib import asynccontextmanager
 from pathlib import Path
-from containment.fsio.tools import temp_lakeproj_init
+from typing import AsyncIterator
+from containment.fsio.workspaces import workspace_pool
 from containment.mcp.clients.basic import MCPClient
 from containment.mcp.clients.experts.proof import SORRY_CANARY
-from containment.fsio.artifacts import write_artifact
+from containment.mcp.clients.experts.proof.hedge import Hedge
+from containment.fsio.artifacts import (
+    write_artifact,
+    write_artifact_code,
+    write_attempt_code,
+)
 from containment.structures import (
     HoareTriple,
     LakeResponse,
+    ElaborationReport,
     Polarity,
     ExpertMetadata,
     VerificationSuccess,
     VerificationFailure,
     VerificationResult,
+    StreamMetrics,
+    BatchCandidate,
+    TheoremCheck,
+    ServerWorkspace,
 )
 from containment.fsio.prompts import load_txt, expert_system_prompt
 from containment.parsing.regex import parse_program_completion
 from containment.fsio.logs import logs
+from containment.netio.completions import STREAM_COMPLETIONS, input_token_split
+from containment.parsing.lean import compact_stderr, error_count
+from litellm import token_counter
+
+STRUCTURED_CHECKS = os.getenv("FCP_STRUCTURED_CHECKS", "1") != "0"
+PROOF_BEAM = int(os.getenv("FCP_PROOF_BEAM", "1"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("FCP_CONTEXT_TOKENS", "48000"))
+KEEP_RECENT_TURNS = 1
 
-MAX_CONVERSATION_LENGTH = 32
 
+def _compact_turn(message: dict, stderr: str) -> dict:
+    """A copy of the user turn with the lean feedback it was rendered with compacted."""
+    compact = compact_stderr(stderr)
+    content = message["content"]
+    if isinstance(content, str):
+        return {**message, "content": content.replace(stderr, compact)}
+    return {
+        **message,
+        "content": [
+            {**block, "text": block["text"].replace(stderr, compact)}
+            if "text" in block
+            else block
+            for block in content
+        ],
+    }
 
-def filter_conversation_length(
-    conversation: list[dict], max_conversation_length: int = MAX_CONVERSATION_LENGTH
-) -> list[dict]:
+
+def fit_conversation(
+    conversation: list[dict],
+    model: str,
+    *,
+    budget: int,
+    stderrs: dict[int, str],
+    system_prompt: str = "",
+    keep_recent: int = KEEP_RECENT_TURNS,
+) -> tuple[list[dict], int]:
     """
-    Filter the conversation to the last MAX_CONVERSATION_LENGTH messages, maintaining the 0th message.
+    Keep the conversation within `budget` prompt tokens by the model's tokenizer, maintaining the 0th message.
+    The budget covers the `system_prompt` too, which is sent ahead of the conversation.
+
+    First the lean feedback in user turns older than the `keep_recent` latest is compacted, oldest first, see `compact_stderr`.
+    If that isn't enough, the oldest exchanges are dropped, but never the latest user turn.
+
+    Args:
+        stderrs: The feedback each user turn was rendered with, by `id` of the message. Entries of compacted and dropped turns are removed.
+
+    Returns:
+        The fitted conversation and its prompt tokens, system prompt included
     """
-    if not conversation:
-        return []
-    system_message = conversation[0]
-    tail = conversation[1:]
-    if not tail:
-        return [system_message]
-    if len(tail) >= max_conversation_length:
-        tail = tail[-max_conversation_length:]
-    return [system_message] + tail
+    conversation = list(conversation)
+    system_tokens = (
+        token_counter(
+            model=model, messages=[{"role": "system", "content": system_prompt}]
+        )
+        if system_prompt
+        else 0
+    )
+    budget -= system_tokens
+    tokens = token_counter(model=model, messages=conversation)
+    user_turns = [idx for idx, msg in enumerate(conversation) if msg["role"] == "user"]
+    old_turns = user_turns[:-keep_recent] if keep_recent else user_turns
+    for idx in old_turns:
+        if tokens <= budget:
+            break
+        stderr = stderrs.pop(id(conversation[idx]), None)
+        if not stderr:
+            continue
+        conversation[idx] = _compact_turn(conversation[idx], stderr)
+        tokens = token_counter(model=model, messages=conversation)
+    while tokens > budget and len(conversation) > 2:
+        stderrs.pop(id(conversation.pop(1)), None)
+        while len(conversation) > 2 and conversation[1]["role"] != "user":
+            stderrs.pop(id(conversation.pop(1)), None)
+        tokens = token_counter(model=model, messages=conversation)
+    return conversation, tokens + system_tokens
 
 
 class ProofExpert(MCPClient):
@@ -46,19 +118,43 @@ class ProofExpert(MCPClient):
         polarity: Polarity,
         *,
         max_iterations: int = 25,
+        structured: bool = STRUCTURED_CHECKS,
+        stream: bool = STREAM_COMPLETIONS,
+        beam: int = PROOF_BEAM,
+        context_tokens: int = CONTEXT_TOKEN_BUDGET,
+        hedge: Hedge | None = None,
     ) -> None:
         super().__init__()
         self.model = model
         self.triple = triple
         self.polarity = polarity
         self.max_iterations = max_iterations
-        self.max_conversation_length = MAX_CONVERSATION_LENGTH
+        self.structured = structured
+        self.beam = beam
+        self.context_tokens = context_tokens
+        self.hedge = hedge
+        # tells apart the audit trails of experts on the same triple, polarity and model
+        self.run_id = uuid.uuid4().hex[:8]
+        self.prompt_tokens: list[int] = []  # per iteration, after fitting
+        self._stderrs: dict[int, str] = {}
         self.system_prompt = expert_system_prompt("loop/proof")
-        self.complete = self._mk_complete(model, self.system_prompt)
+        self.stream_metrics: list[StreamMetrics] = []
+        self.complete = self._mk_complete(
+            model,
+            self.system_prompt,
+            stop_tag="proof" if stream else None,
+            on_metrics=self.stream_metrics.append,
+        )
         self.proof = None
         self.verification_result = None
         self.code_dt = []
         self.tokens_spent = 0
+        self.cached_input_tokens = 0
+        self.uncached_input_tokens = 0
+        self.workspace_id: str | None = None
+        self._granted = (
+            False  # the hedge admitted the first iteration before connecting
+        )
 
     @classmethod
     async def connect_and_run(
@@ -68,11 +164,29 @@ class ProofExpert(MCPClient):
         polarity: Polarity,
         *,
         max_iterations: int = 25,
+        beam: int = PROOF_BEAM,
+        hedge: Hedge | None = None,
     ) -> "ProofExpert":
         """
         Async instantiation: connect to the MCP server.
+
+        With a `hedge`, every iteration waits for its turn in the hedge's schedule, and the loop ends early when the hedge's budget is spent.
+        The first turn is waited for before leasing a session and a workspace, so a loop that waits to join holds neither.
         """
-        mcp_client = cls(model, triple, polarity, max_iterations=max_iterations)
+        mcp_client = cls(
+            model,
+            triple,
+            polarity,
+            max_iterations=max_iterations,
+            beam=beam,
+            hedge=hedge,
+        )
+        if hedge is not None:
+            if not await hedge.admit(polarity):
+                await hedge.finish(polarity)
+                mcp_client.verification_result = []
+                return mcp_client
+            mcp_client._granted = True
         mcp_client.verification_result = await mcp_client._connect_to_server_and_run()
         return mcp_client
 
@@ -88,7 +202,7 @@ class ProofExpert(MCPClient):
         self.code_dt.append(basic)
         return basic
 
-    async def _iter(self, stderr: str, cwd: Path) -> LakeResponse:
+    async def _iter(self, stderr: str, cwd: Path) -> tuple[bool, str]:
         prompt_arguments = {
             "precondition": self.triple.specification.precondition,
             "postcondition": self.triple.specification.postcondition,
@@ -97,31 +211,165 @@ class ProofExpert(MCPClient):
             "stderr": stderr,
             "polarity": self.polarity.value,
         }
-        user_prompt = await self.session.get_prompt(
-            "hoare_proof_user_prompt", arguments=prompt_arguments
+        user_turn = {
+            "role": "user",
+            "content": await self._prompt_content(
+                "hoare_proof_user_prompt", prompt_arguments
+            ),
+        }
+        if stderr:
+            self._stderrs[id(user_turn)] = stderr
+        self.conversation, prompt_tokens = fit_conversation(
+            self.conversation + [user_turn],
+            self.model,
+            budget=self.context_tokens,
+            stderrs=self._stderrs,
+            system_prompt=self.system_prompt,
         )
-        curr_conversation = [
-            {
-                "role": "user",
-                "content": [
-                    message.content.model_dump() for message in user_prompt.messages
-                ],
-            }
-        ]
-        self.conversation = self.conversation + curr_conversation
-        completion = self.complete(self.conversation)
-        proof_content = completion["choices"][0].message.content
-        self.tokens_spent += completion["usage"]["total_tokens"]
+        self.prompt_tokens.append(prompt_tokens)
+        if self.beam > 1:
+            return await self._iter_beam(cwd)
+        completion = await self.complete(self.conversation)
+        proof_content = self._spend(completion)
         self.conversation.append({"role": "assistant", "content": proof_content})
         self.proof = parse_program_completion(proof_content, "proof")
-        tool_arguments = {"lean_code": self._render_code(self.proof), "cwd": str(cwd)}
-        tool_result = await self.session.call_tool(
-            "typecheck", arguments=tool_arguments
+        return await self._typecheck(self._render_code(self.proof), cwd)
+
+    def _spend(self, completion: dict) -> str:
+        """Account for the completion's tokens, and return its content."""
+        self.tokens_spent += completion["usage"]["total_tokens"]
+        cached, uncached = input_token_split(completion["usage"])
+        self.cached_input_tokens += cached
+        self.uncached_input_tokens += uncached
+        return completion["choices"][0].message.content
+
+    async def _iter_beam(self, cwd: Path) -> tuple[bool, str]:
+        """
+        Sample `beam` proofs concurrently and check them together with one `typecheck-batch`.
+
+        The first candidate that passes wins, and is checked again on its own so that the workspace holds it for the audit trail.
+        Otherwise the candidate with the fewest errors continues the conversation, and its errors are the feedback.
+        """
+        completions = await asyncio.gather(
+            *(self.complete(self.conversation) for _ in range(self.beam))
+        )
+        contents = [self._spend(completion) for completion in completions]
+        proofs = [parse_program_completion(content, "proof") for content in contents]
+        candidates = [
+            BatchCandidate(triple=self.triple, proof=proof, polarity=self.polarity)
+            for proof in proofs
+        ]
+        tool_result = await self._call_tool(
+            "typecheck-batch",
+            arguments={
+                "candidates": [
+                    candidate.model_dump(mode="json") for candidate in candidates
+                ],
+                **self._location(cwd),
+            },
+        )
+        checks = [
+            TheoremCheck(**json.loads(content.text))  # type: ignore
+            for content in tool_result.content
+        ]
+        best = min(
+            range(len(checks)),
+            key=lambda idx: (
+                not checks[idx].success,
+                proofs[idx] is None,
+                len(checks[idx].errors) + checks[idx].has_sorry,
+                idx,
+            ),
         )
+        self.conversation.append({"role": "assistant", "content": contents[best]})
+        self.proof = proofs[best]
+        lean_code = self._render_code(self.proof)
+        if checks[best].success:
+            return await self._typecheck(lean_code, cwd)
+        feedback = "\n".join(checks[best].errors)
+        if checks[best].has_sorry:
+            feedback += "\nThe proof uses sorry."
+        return False, feedback.strip()
+
+    async def _typecheck(self, lean_code: str, cwd: Path) -> tuple[bool, str]:
+        """
+        Check the rendered proof with its sorry canary.
+
+        When `structured`, the proof and the term check are only elaborated, and the json diagnostics are the feedback. Otherwise `lake exe check` builds and runs the check executable.
+
+        Returns:
+            Whether the triple is proven without sorry, and the feedback for the next prompt
+        """
+        tool_arguments = {"lean_code": lean_code, **self._location(cwd)}
+        if self.structured:
+            tool_result = await self._call_tool(
+                "typecheck-structured", arguments=tool_arguments
+            )
+            report = ElaborationReport(**json.loads(tool_result.content[0].text))  # type: ignore
+            return report.success, report.feedback
+        tool_result = await self._call_tool("typecheck", arguments=tool_arguments)
         lake_response_str = tool_result.content[0].text  # type: ignore
-        return LakeResponse.from_jsons_clean(lake_response_str)
+        lake_response = LakeResponse.from_jsons_clean(lake_response_str)
+        proven = (
+            lake_response.exit_code == 0 and SORRY_CANARY not in lake_response.stderr
+        )
+        return proven, lake_response.stderr
+
+    def _location(self, cwd: Path) -> dict[str, str]:
+        """The tool arguments naming the workspace: its id on a shared server, else its path."""
+        if self.workspace_id is not None:
+            return {"workspace": self.workspace_id}
+        return {"cwd": str(cwd)}
+
+    def _write_artifact(self, cwd: Path) -> Path:
+        """Keep the last checked code, copied from the workspace when it is on this host."""
+        if self.workspace_id is not None:
+            return write_artifact_code(self.code_dt[-1], self.triple)
+        return write_artifact(cwd, self.triple)
+
+    def _snapshot(self, iteration: int) -> Path:
+        """The audit trail of a failed iteration: a copy of its code, because the leased workspace is reset for the next lease."""
+        return write_attempt_code(
+            self.code_dt[-1],
+            self.triple,
+            f"{self.polarity.value}-{self.model}-{self.run_id}-{iteration}",
+        )
+
+    async def _admitted(self) -> bool:
+        """Whether the hedge, if any, grants the next iteration."""
+        if self._granted:
+            self._granted = False
+            return True
+        return self.hedge is None or await self.hedge.admit(self.polarity)
+
+    def _report(self, feedback: str) -> None:
+        if self.hedge is not None:
+            self.hedge.report(self.polarity, error_count(feedback))
+        return None
+
+    @asynccontextmanager
+    async def _server_workspace(self) -> AsyncIterator[Path]:
+        """Lease a workspace on the shared server. The path it yields is on the server, for the audit trail only."""
+        tool_result = await self._call_tool("workspace-open", arguments={})
+        workspace = ServerWorkspace(**json.loads(tool_result.content[0].text))  # type: ignore
+        self.workspace_id = workspace.id
+        try:
+            yield workspace.path
+        finally:
+            self.workspace_id = None
+            await self._call_tool(
+                "workspace-close", arguments={"workspace": workspace.id}
+            )
 
     async def _prove_loop(self) -> VerificationResult:
+        """Prove the triple in a workspace leased for the duration of the loop, from the shared server when there is one."""
+        if self.remote_workspaces:
+            async with self._server_workspace() as cwd:
+                return await self._prove_loop_at(cwd)
+        async with workspace_pool.lease() as cwd:
+            return await self._prove_loop_at(cwd)
+
+    async def _prove_loop_at(self, cwd: Path) -> VerificationResult:
         forall_str = (
             f"FORALL {self.triple.specification.metavariables},"
             if self.triple.specification.metavariables
@@ -129,65 +377,71 @@ class ProofExpert(MCPClient):
         )
         triple_str = f"{forall_str} {self.triple.hidden_code}"
         msg_prefix = f"\t{self.model}:{self.triple.specification.name if self.triple.specification.name is not None else self.triple.specification}-"
-        cwd = temp_lakeproj_init()
-        lake_response = await self._iter("", cwd)
         metadata = ExpertMetadata(model=self.model, polarity=self.polarity)
+        if not await self._admitted():
+            return []
+        proven, feedback = await self._iter("", cwd)
         metadata.set_tokens_spent(self.tokens_spent)
-        if lake_response.exit_code == 0 and self.proof is not None:
-            if SORRY_CANARY not in lake_response.stderr:
-                artifact_dir = write_artifact(cwd, self.triple)
-                metadata.successful()
-                return VerificationSuccess(
-                    triple=self.triple,
-                    proof=self.proof,
-                    audit_trail=artifact_dir / f"{hash(self.triple)}.lean",
-                    metadata=metadata,
-                )
-            msg = f"{msg_prefix}: Proof for {self.polarity.value} hoare triple {triple_str} has a sorry."
-            logs.info(msg)
+        metadata.set_input_tokens(self.cached_input_tokens, self.uncached_input_tokens)
+        metadata.set_stream_metrics(self.stream_metrics)
+        metadata.set_prompt_tokens(self.prompt_tokens)
+        if proven and self.proof is not None:
+            artifact_dir = self._write_artifact(cwd)
+            metadata.successful()
+            return VerificationSuccess(
+                triple=self.triple,
+                proof=self.proof,
+                audit_trail=artifact_dir / f"{hash(self.triple)}.lean",
+                metadata=metadata,
+            )
         failures = [
             VerificationFailure(
                 triple=self.triple,
                 proof=self.proof if self.proof is not None else "<UNREACHABLE>",
-                error_message=lake_response.stderr,
-                audit_trail=cwd,
+                error_message=feedback,
+                audit_trail=self._snapshot(0),
                 metadata=metadata,
             )
         ]
+        self._report(feedback)
         for iteration in range(1, self.max_iterations + 1):
+            if not await self._admitted():
+                break
             metadata.incr()
             if not iteration % 3:
                 msg = f"{msg_prefix}: Attempt to prove {self.polarity.value} hoare triple {triple_str}: iteration num {iteration}/{self.max_iterations}"
                 logs.info(msg)
-            self.conversation = filter_conversation_length(self.conversation)
-            lake_response = await self._iter(lake_response.stderr, cwd=cwd)
-            if (
-                lake_response.exit_code == 0
-                and SORRY_CANARY not in lake_response.stderr
-            ):
+            proven, feedback = await self._iter(feedback, cwd=cwd)
+            if proven:
                 msg = f"{msg_prefix}: Proof loop converged after {iteration} iterations! for triple {triple_str}"
                 logs.info(msg)
                 break
+            self._report(feedback)
             metadata.set_tokens_spent(self.tokens_spent)
+            metadata.set_input_tokens(
+                self.cached_input_tokens, self.uncached_input_tokens
+            )
+            metadata.set_stream_metrics(self.stream_metrics)
+            metadata.set_prompt_tokens(self.prompt_tokens)
             failures.append(
                 VerificationFailure(
                     triple=self.triple,
                     proof=self.proof if self.proof is not None else "<UNREACHABLE>",
-                    error_message=lake_response.stderr,
-                    audit_trail=cwd,
+                    error_message=feedback,
+                    audit_trail=self._snapshot(iteration),
                     metadata=metadata,
                 )
             )
 
-        artifact_dir = write_artifact(cwd, self.triple)
-        if lake_response.exit_code != 0 and self.proof is not None:
+        artifact_dir = self._write_artifact(cwd)
+        if not proven and self.proof is not None:
             return failures
         if self.proof is None:
             failures.append(
                 VerificationFailure(
                     triple=self.triple,
                     proof="sorry <UNREACHABLE?>",
-                    error_message=lake_response.stderr,
+                    error_message=feedback,
                     audit_trail=artifact_dir / f"{hash(self.triple)}.lean",
                     metadata=metadata,
                 )
@@ -205,4 +459,8 @@ class ProofExpert(MCPClient):
         """
         Run the functionality of client.
         """
-        return await self._prove_loop()
+        try:
+            return await self._prove_loop()
+        finally:
+            if self.hedge is not None:
+                await self.hedge.finish(self.polarity)
@@ -1,3 +1,4 @@
+import asyncio
 import re
 from collections import defaultdict
 from itertools import chain
@@ -13,7 +14,8 @@ from containment.structures import (
     VerificationResult,
 )
 from containment.fsio.prompts import load_txt
-from containment.fsio.tools import pantograph_init, temp_lakeproj_init
+from containment.fsio.tools import pantograph_close, pantograph_init
+from containment.fsio.workspaces import workspace_pool
 from containment.fsio.artifacts import write_artifact
 from pantograph.expr import GoalState, Tactic
 from pantograph.search import Agent
@@ -101,7 +103,7 @@ class Expert(MCPClient):
         self.verification_result = None
         self.search_agent = DumbHoareSearch()
         self.lean_file_sorry = self._render_code(None)
-        self.cwd = temp_lakeproj_init()
+        self.cwd: Path | None = None
         self.pantograph_server: Server | None = None
 
     def _render_code(self, proof: str | None) -> str:
@@ -135,8 +137,17 @@ class Expert(MCPClient):
             max_trials_per_goal=max_trials_per_goal,
             pantog_verbose=pantog_verbose,
         )
-        mcp_client.pantograph_server = await pantograph_init(mcp_client.cwd)
-        mcp_client.verification_result = await mcp_client._connect_to_server_and_run()
+        async with workspace_pool.lease() as cwd:
+            mcp_client.cwd = cwd
+            mcp_client.pantograph_server = await pantograph_init(cwd)
+            # also when cancelled or timed out, e.g. by a portfolio, so no lean REPL outlives the search
+            try:
+                mcp_client.verification_result = (
+                    await mcp_client._connect_to_server_and_run()
+                )
+            finally:
+                pantograph_close(mcp_client.pantograph_server)
+                mcp_client.pantograph_server = None
         return mcp_client
 
     async def _proof_search(self) -> VerificationResult:
@@ -144,12 +155,12 @@ class Expert(MCPClient):
         Perform the proof search using the DumbHoareSearch agent.
         """
         failures = []
-        if self.pantograph_server is None:
+        if self.pantograph_server is None or self.cwd is None:
             failures.append(
                 VerificationFailure(
                     triple=self.triple,
                     proof="",
-                    error_message="Pantograph server is not initialized.",
+                    error_message="Pantograph server or workspace is not initialized.",
                     audit_trail=Path.cwd(),
                     metadata=ExpertMetadata(
                         model=self.model,
@@ -180,7 +191,9 @@ class Expert(MCPClient):
                     )
                 )
                 return failures
-            search_result = self.search_agent.search(
+            # the search is synchronous, so run it off the event loop for timeouts and cancellation to take effect
+            search_result = await asyncio.to_thread(
+                self.search_agent.search,
                 self.pantograph_server,
                 unit.goal_state,
                 max_steps=self.max_steps,
@@ -0,0 +1,351 @@
+"""A pool of initialized MCP sessions, leased to experts so that they don't each spawn and initialize their own server."""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator
+import anyio
+from mcp import ClientSession
+from mcp.client.stdio import StdioServerParameters, stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.memory import create_client_server_memory_streams
+from mcp.shared.message import SessionMessage
+from mcp.types import JSONRPCRequest, Prompt, RequestId, ResourceTemplate, Tool
+from containment.fsio.logs import logs
+from containment.mcp.clients.prompts import PromptRenderer
+from containment.structures.enums import MCPTransport
+
+MCP_POOLING = os.getenv("FCP_MCP_POOL", "1") != "0"
+MCP_POOL_SIZE = int(os.getenv("FCP_MCP_POOL_SIZE", "2"))
+MCP_POOL_MAX = int(os.getenv("FCP_MCP_POOL_MAX", "32"))
+MCP_PING_TIMEOUT_SECONDS = float(os.getenv("FCP_MCP_PING_TIMEOUT_SECONDS", "5"))
+MCP_TRANSPORT = MCPTransport(os.getenv("FCP_MCP_TRANSPORT", MCPTransport.STDIO))
+MCP_URL = os.getenv("FCP_MCP_URL", "http://127.0.0.1:8000/mcp")
+
+SERVER_PARAMETERS = StdioServerParameters(
+    command="uv",
+    args=["run", "mcp-server"],
+    env=None,  # Optional environment variables
+)
+
+
+# The ids of the requests a task sent while it set a list here, see `_call_tool` of the clients.
+sent_request_ids: ContextVar[list[RequestId] | None] = ContextVar(
+    "sent_request_ids", default=None
+)
+
+
+class _TracedWriteStream:
+    """A session's write stream that notes the id of every request into the sending task's `sent_request_ids`."""
+
+    def __init__(self, stream: Any) -> None:
+        self._stream = stream
+
+    async def send(self, message: SessionMessage) -> None:
+        request_ids = sent_request_ids.get()
+        if request_ids is not None and isinstance(message.message.root, JSONRPCRequest):
+            request_ids.append(message.message.root.id)
+        await self._stream.send(message)
+        return None
+
+    async def __aenter__(self) -> "_TracedWriteStream":
+        await self._stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> bool | None:
+        return await self._stream.__aexit__(*exc_info)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+@asynccontextmanager
+async def _traced_session(read: Any, write: Any) -> AsyncIterator[ClientSession]:
+    async with ClientSession(read, _TracedWriteStream(write)) as session:  # type: ignore[arg-type]
+        await session.initialize()
+        yield session
+
+
+@asynccontextmanager
+async def _initialized_session(
+    parameters: StdioServerParameters, transport: MCPTransport
+) -> AsyncIterator[ClientSession]:
+    match transport:
+        case MCPTransport.STDIO:
+            async with stdio_client(parameters) as (read, write):
+                async with _traced_session(read, write) as session:
+                    yield session
+        case MCPTransport.MEMORY:
+            # imported here: the server imports the experts, which import this module
+            from containment.mcp.server import mcp
+
+            server = mcp._mcp_server
+            async with create_client_server_memory_streams() as (client, served):
+                async with anyio.create_task_group() as server_task:
+                    server_task.start_soon(
+                        lambda: server.run(
+                            *served, server.create_initialization_options()
+                        )
+                    )
+                    try:
+                        async with _traced_session(*client) as session:
+                            yield session
+                    finally:
+                        server_task.cancel_scope.cancel()
+        case MCPTransport.HTTP:
+            async with streamablehttp_client(MCP_URL) as (read, write, _):
+                async with _traced_session(read, write) as session:
+                    yield session
+
+
+class ServerConnection:
+    """
+    An initialized `ClientSession` to the server, with its tools, resource templates and prompts listed once, and the prompt templates compiled once.
+
+    Over stdio the server is an `mcp-server` subprocess. In memory it runs as a task of the client's event loop, sharing the process's typecheck cache and lean slots.
+    Over http it is a shared server at `FCP_MCP_URL`, which hosts the lean workspaces for every client.
+    The transport's task groups must be entered and exited by the same task, so a runner task holds them open until `close`.
+    """
+
+    def __init__(
+        self,
+        parameters: StdioServerParameters,
+        transport: MCPTransport = MCP_TRANSPORT,
+    ) -> None:
+        self.parameters = parameters
+        self.transport = transport
+        self.session: ClientSession | None = None
+        self.tools: list[Tool] = []
+        self.resource_templates: list[ResourceTemplate] = []
+        self.prompts: list[Prompt] = []
+        self.prompt_renderer: PromptRenderer | None = None
+        self._ready: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._runner: asyncio.Task | None = None
+
+    @classmethod
+    async def open(
+        cls,
+        parameters: StdioServerParameters = SERVER_PARAMETERS,
+        transport: MCPTransport = MCP_TRANSPORT,
+    ) -> "ServerConnection":
+        """Start the server and wait until the session is initialized."""
+        connection = cls(parameters, transport)
+        connection._runner = asyncio.create_task(connection._run())
+        try:
+            await connection._ready
+        except BaseException:
+            await connection.close()
+            raise
+        return connection
+
+    async def _run(self) -> None:
+        try:
+            async with _initialized_session(self.parameters, self.transport) as session:
+                self.tools = (await session.list_tools()).tools
+                self.resource_templates = (
+                    await session.list_resource_templates()
+                ).resourceTemplates
+                self.prompts = (await session.list_prompts()).prompts
+                self.prompt_renderer = PromptRenderer(session)
+                self.session = session
+                self._ready.set_result(None)
+                await self._closing.wait()
+        except Exception as exc:
+            if not self._ready.done():
+                self._ready.set_exception(exc)
+            else:
+                logs.info(f"MCP server connection lost: {exc!r}")
+        finally:
+            self.session = None
+            if not self._ready.done():
+                self._ready.cancel()
+        return None
+
+    @property
+    def alive(self) -> bool:
+        return (
+            self.session is not None
+            and self._runner is not None
+            and not self._runner.done()
+        )
+
+    async def healthy(self) -> bool:
+        """Whether the server answers a ping within `FCP_MCP_PING_TIMEOUT_SECONDS`."""
+        if self.session is None or not self.alive:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), MCP_PING_TIMEOUT_SECONDS)
+        except Exception:
+            return False
+        return self.alive
+
+    async def close(self) -> None:
+        """End the session and terminate the server. Idempotent."""
+        self._closing.set()
+        if self._runner is None:
+            return None
+        if not self._ready.done() or self._ready.cancelled():
+            self._runner.cancel()
+        await asyncio.wait([self._runner])
+        return None
+
+
+# The connection leased by the current task, inherited by the tasks it spawns, see `SessionPool.lease`.
+leased_connection: ContextVar[ServerConnection | None] = ContextVar(
+    "leased_connection", default=None
+)
+
+
+class SessionPool:
+    """
+    Keeps `size` server connections warm and never holds more than `max_size`.
+
+    Every lease pings its connection first, and a connection that doesn't answer (e.g. its server crashed) is replaced by a fresh one.
+    """
+
+    def __init__(
+        self,
+        size: int = MCP_POOL_SIZE,
+        *,
+        max_size: int = MCP_POOL_MAX,
+        parameters: StdioServerParameters = SERVER_PARAMETERS,
+        transport: MCPTransport = MCP_TRANSPORT,
+    ) -> None:
+        if max_size < max(size, 1):
+            raise ValueError(
+                f"max_size {max_size} must be at least the warm size {size} and positive"
+            )
+        self.size = size
+        self.max_size = max_size
+        self.parameters = parameters
+        self.transport = transport
+        self.reconnects = 0
+        self._idle: list[ServerConnection] = []
+        self._leased: set[ServerConnection] = set()
+        self._creating = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._cond = asyncio.Condition()
+
+    @property
+    def total(self) -> int:
+        return len(self._idle) + len(self._leased) + self._creating
+
+    def _condition(self) -> asyncio.Condition:
+        """
+        The condition, recreated when the pool is used from a new event loop (each `asyncio.run`).
+
+        Connections belong to the loop that opened them, so those of a previous loop are forgotten.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._cond = asyncio.Condition()
+            self._idle = []
+            self._leased = set()
+            self._creating = 0
+        return self._cond
+
+    async def start(self) -> None:
+        """Open connections up to the warm size, off the critical path of the first leases."""
+        cond = self._condition()
+        async with cond:
+            missing = self.size - self.total
+            if missing <= 0:
+                return None
+            self._creating += missing
+        connections: list[ServerConnection] = []
+        try:
+            connections = await asyncio.gather(
+                *(
+                    ServerConnection.open(self.parameters, self.transport)
+                    for _ in range(missing)
+                )
+            )
+        finally:
+            async with cond:
+                self._creating -= missing
+                self._idle.extend(connections)
+                cond.notify_all()
+        return None
+
+    async def _discard(self, connection: ServerConnection) -> None:
+        """Close a connection and free its slot."""
+        cond = self._condition()
+        async with cond:
+            self._leased.discard(connection)
+            cond.notify()
+        await connection.close()
+        return None
+
+    async def _acquire(self) -> ServerConnection:
+        cond = self._condition()
+        while True:
+            async with cond:
+                while not self._idle and self.total >= self.max_size:
+                    await cond.wait()
+                if self._idle:
+                    connection = self._idle.pop()  # most recently returned
+                    self._leased.add(connection)
+                else:
+                    self._creating += 1  # reserve the slot before releasing the lock
+                    connection = None
+            if connection is None:
+                try:
+                    connection = await ServerConnection.open(
+                        self.parameters, self.transport
+                    )
+                except BaseException:
+                    self._creating -= 1
+                    async with cond:
+                        cond.notify()
+                    raise
+                self._creating -= 1
+                self._leased.add(connection)
+                return connection
+            if await connection.healthy():
+                return connection
+            logs.info("MCP server connection failed its health check, reconnecting")
+            self.reconnects += 1
+            await self._discard(connection)
+
+    async def _release(self, connection: ServerConnection) -> None:
+        if not connection.alive:
+            await self._discard(connection)
+            return None
+        cond = self._condition()
+        async with cond:
+            self._leased.discard(connection)
+            self._idle.append(connection)
+            cond.notify()
+        return None
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[ServerConnection]:
+        """
+        Lease a healthy connection for the duration of the context, waiting if `max_size` are already leased.
+
+        A task within a lease, or spawned from one, shares that lease's connection, since a session serves concurrent requests.
+        Otherwise experts fanning out sub-experts (portfolios, hedges, beams) could each wait at `max_size` for a lease their own parents hold.
+        """
+        parent = leased_connection.get()
+        if parent is not None and parent.alive:
+            yield parent
+            return
+        connection = await self._acquire()
+        token = leased_connection.set(connection)
+        try:
+            yield connection
+        finally:
+            leased_connection.reset(token)
+            await self._release(connection)
+
+    async def close(self) -> None:
+        """Close every idle connection. Leased ones are closed with their event loop."""
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(connection.close() for connection in idle))
+        return None
+
+
+session_pool = SessionPool()
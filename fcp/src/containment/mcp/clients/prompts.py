@@ -0,0 +1,41 @@
+"""Client-side rendering of the server's MCP prompts, saving a round trip per prompt."""
+
+import os
+from jinja2 import Environment, Template
+from mcp import ClientSession
+from mcp.types import TextContent, TextResourceContents
+from pydantic import AnyUrl
+from containment.fsio.prompts import PROMPT_TEMPLATES
+
+LOCAL_PROMPTS = os.getenv("FCP_LOCAL_PROMPTS", "1") != "0"
+
+
+class PromptRenderer:
+    """
+    Renders the server's prompts from the jinja source of their templates, fetched and compiled once per session.
+
+    The content is what `get_prompt` returns, so e.g. completion cache keys don't depend on where a prompt was rendered.
+    """
+
+    def __init__(self, session: ClientSession) -> None:
+        self.session = session
+        self._environment = Environment()
+        self._templates: dict[str, Template] = {}
+
+    async def _template(self, name: str) -> Template:
+        if name not in self._templates:
+            result = await self.session.read_resource(
+                AnyUrl(f"prompt-template://{name}")
+            )
+            source = result.contents[0]
+            if not isinstance(source, TextResourceContents):
+                raise ValueError(f"The template of prompt {name} is not text")
+            self._templates[name] = self._environment.from_string(source.text)
+        return self._templates[name]
+
+    async def render(self, name: str, arguments: dict[str, str]) -> list[dict]:
+        """The content of the prompt's user message at the arguments, as `get_prompt` would give it."""
+        _, variables = PROMPT_TEMPLATES[name]
+        template = await self._template(name)
+        text = template.render(**variables(**arguments))
+        return [TextContent(type="text", text=text).model_dump()]
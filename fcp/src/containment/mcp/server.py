@@ -1,17 +1,149 @@
+import asyncio
+import os
+import time
+import uuid
+from contextlib import AsyncExitStack
 from pathlib import Path
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
 from containment.structures import (
-    Polarity,
-    Specification,
-    HoareTriple,
     LakeResponse,
+    BatchCandidate,
+    TheoremCheck,
+    ElaborationReport,
+    ServerWorkspace,
+)
+from containment.fsio.prompts import (
+    PROMPT_TEMPLATES,
+    imp_prompt_variables,
+    load_txt,
+    proof_prompt_variables,
 )
-from containment.fsio.prompts import proof_user_prompt, imp_user_prompt
 from containment.fsio.lake import Checker
-from containment.fsio.tools import temp_lakeproj_init
+from containment.fsio.tools import OnStage, lean_slots, temp_lakeproj_init
+from containment.fsio.workers import LEAN_WORKERS, LeanWorkerPool
+from containment.fsio.workspaces import workspace_pool
+from containment.fsio.cache import TYPECHECK_CACHE_ENABLED, TypecheckCache
+from containment.parsing.lean import elaboration_report, is_verdict
+from containment.fsio.logs import logs
 
 mcp = FastMCP("Formal Containment Protocol")
 
+lean_worker_pool = LeanWorkerPool(LEAN_WORKERS) if LEAN_WORKERS > 0 else None
+typecheck_cache = TypecheckCache() if TYPECHECK_CACHE_ENABLED else None
+
+SERVE_TRANSPORT = os.getenv("FCP_MCP_SERVE", "stdio")
+# Over the network, clients share this host's lean, so they may only name the workspaces it leased them.
+ACCEPT_CLIENT_PATHS = SERVE_TRANSPORT == "stdio"
+WORKSPACE_LEASE_SECONDS = float(os.getenv("FCP_WORKSPACE_LEASE_SECONDS", "3600"))
+WORKSPACE_EXPIRY_INTERVAL_SECONDS = float(
+    os.getenv("FCP_WORKSPACE_EXPIRY_INTERVAL_SECONDS", "60")
+)
+MANAGED_WORKSPACES_ONLY = "This server only checks code in the workspaces it manages. Open one with workspace-open."
+
+# id -> (workspace, its lease, last used)
+_workspaces: dict[str, tuple[ServerWorkspace, AsyncExitStack, float]] = {}
+_expiry: asyncio.Task | None = None
+
+
+def _workspace_dir(cwd: str | None, workspace: str | None) -> Path:
+    """
+    Resolve the directory a tool works in, from a workspace id of `workspace-open` or, over stdio only, a path.
+
+    Raises:
+        ValueError: When the workspace is unknown, or a path is given to a networked server
+    """
+    if workspace is not None:
+        if workspace not in _workspaces:
+            raise ValueError(
+                f"Unknown workspace {workspace}. Open one with workspace-open."
+            )
+        server_workspace, lease, _ = _workspaces[workspace]
+        _workspaces[workspace] = (server_workspace, lease, time.monotonic())
+        return server_workspace.path
+    if cwd is None:
+        raise ValueError("Pass a workspace id from workspace-open.")
+    if not ACCEPT_CLIENT_PATHS:
+        raise ValueError(MANAGED_WORKSPACES_ONLY)
+    return Path(cwd)
+
+
+async def _expire_workspaces() -> None:
+    """Return the workspaces of clients that went away without closing them."""
+    now = time.monotonic()
+    expired = [
+        workspace_id
+        for workspace_id, (_, _, used) in _workspaces.items()
+        if now - used > WORKSPACE_LEASE_SECONDS
+    ]
+    for workspace_id in expired:
+        _, lease, _ = _workspaces.pop(workspace_id)
+        await lease.aclose()
+    return None
+
+
+async def _expire_periodically() -> None:
+    while True:
+        await asyncio.sleep(WORKSPACE_EXPIRY_INTERVAL_SECONDS)
+        try:
+            await _expire_workspaces()
+        except (
+            Exception
+        ) as exc:  # keep sweeping, a lease that fails to close is gone anyway
+            logs.warning(f"Failed to expire workspaces: {exc}")
+
+
+def _sweep_workspaces() -> None:
+    """Expire abandoned workspaces every `FCP_WORKSPACE_EXPIRY_INTERVAL_SECONDS` in the background, once the first is opened."""
+    global _expiry
+    if _expiry is None or _expiry.done():
+        _expiry = asyncio.create_task(_expire_periodically())
+    return None
+
+
+def _stage_reporter(ctx: Context | None) -> OnStage | None:
+    """Report the stages of a check as MCP progress: 0 of 2 while queued for lean, 1 of 2 while building or elaborating."""
+    if ctx is None:
+        return None
+
+    async def on_stage(stage: str) -> None:
+        await ctx.report_progress(0 if stage == "queued" else 1, 2, stage)
+        return None
+
+    return on_stage
+
+
+async def _check(
+    checker: Checker,
+    lean_code: str,
+    *,
+    elaborate: bool = False,
+    on_stage: OnStage | None = None,
+) -> LakeResponse:
+    """
+    Check on the persistent lean workers when `FCP_LEAN_WORKERS` is set, otherwise with `lake exe check` under the global bound on lean processes.
+    With `elaborate`, run `lean --json` instead, whose stdout holds json diagnostics.
+
+    Results are memoized in the typecheck cache unless `FCP_TYPECHECK_CACHE=0`, but only lean's verdicts on the code (see `is_verdict`): timeouts, kills and crashes may pass on another run. A hit still writes the code to the tmpdir, since artifacts are copied from there.
+    """
+    if elaborate:
+        namespace = "elaborate-term-check"
+    else:
+        namespace = "workers" if lean_worker_pool is not None else "lake"
+    if typecheck_cache is not None:
+        cached = typecheck_cache.get(lean_code, namespace)
+        if cached is not None:
+            checker.write_code(lean_code)
+            return cached
+    if elaborate:
+        response = await checker.run_code_elaborate(lean_code, on_stage)
+    elif lean_worker_pool is not None:
+        response = await checker.run_code_pooled(lean_code, lean_worker_pool, on_stage)
+    else:
+        response = await checker.run_code_async(lean_code, on_stage)
+    if typecheck_cache is not None and is_verdict(response):
+        typecheck_cache.put(lean_code, response, namespace)
+    return response
+
 
 @mcp.prompt(
     name="hoare_proof_user_prompt",
@@ -39,18 +171,12 @@ def get_proof_user_prompt(
     Returns:
         A string containing the proof user prompt
     """
-    triple = HoareTriple(
-        specification=Specification(
-            precondition=precondition,
-            postcondition=postcondition,
-            metavariables=metavariables,
+    return load_txt(
+        PROMPT_TEMPLATES["hoare_proof_user_prompt"][0],
+        **proof_prompt_variables(
+            precondition, command, postcondition, metavariables, stderr, polarity
         ),
-        command=command,
     )
-    positive = False if polarity == Polarity.NEG.value else True
-    if not stderr:
-        return proof_user_prompt(triple, positive=positive)
-    return proof_user_prompt(triple, stderr, positive=positive)
 
 
 @mcp.prompt(
@@ -71,20 +197,39 @@ def get_imp_user_prompt(
     Returns:
         A string containing the imp user prompt
     """
-    return imp_user_prompt(
-        Specification(
-            precondition=precondition,
-            postcondition=postcondition,
-            metavariables=metavariables,
+    return load_txt(
+        PROMPT_TEMPLATES["imp_user_prompt"][0],
+        **imp_prompt_variables(
+            precondition, postcondition, metavariables, failed_attempts
         ),
-        failed_attempts,
     )
 
 
+@mcp.resource(
+    "prompt-template://{name}",
+    description="The jinja source of the template behind an MCP prompt, for clients that render prompts themselves.",
+    mime_type="text/plain",
+)
+def get_prompt_template(name: str) -> str:
+    """
+    Get the template of a prompt.
+
+    Args:
+        name: The name of an MCP prompt, e.g. `hoare_proof_user_prompt`
+
+    Returns:
+        The unrendered template. Its variables are those `PROMPT_TEMPLATES` maps the prompt's arguments to.
+    """
+    template_name, _ = PROMPT_TEMPLATES[name]
+    return load_txt(Path(template_name))
+
+
 @mcp.tool("typecheck-freshdir", description="Run the typechecker on the given code.")
-def run_lake_exe_check_freshdir(lean_code: str) -> tuple[Path, LakeResponse]:
+async def run_lake_exe_check_freshdir(
+    lean_code: str,
+) -> tuple[Path, LakeResponse]:
     """
-    Run the lake exe check command at the given code in a temporary directory.
+    Run the lake exe check command at the given code in a temporary directory. Over stdio only, since every call clones the lake project.
 
     Args:
         lean_code: The Lean code to check
@@ -93,23 +238,153 @@ def run_lake_exe_check_freshdir(lean_code: str) -> tuple[Path, LakeResponse]:
         Path: The path to the temporary directory where the code was checked
         LakeResponse: The result of the lake tool
     """
-    cwd = temp_lakeproj_init()
+    if not ACCEPT_CLIENT_PATHS:
+        raise ValueError(MANAGED_WORKSPACES_ONLY)
+    cwd = await asyncio.to_thread(temp_lakeproj_init)
     checker = Checker(cwd=cwd)
-    return cwd, checker.run_code(lean_code)
+    return cwd, await _check(checker, lean_code)
 
 
 @mcp.tool(
-    "typecheck", description="Run the typechecker on the given code in the given dir."
+    "typecheck",
+    description="Run the typechecker on the given code in the given workspace.",
 )
-def run_lake_exe_check(lean_code: str, cwd: str) -> LakeResponse:
+async def run_lake_exe_check(
+    lean_code: str,
+    cwd: str | None = None,
+    workspace: str | None = None,
+    ctx: Context = None,  # type: ignore[assignment]
+) -> LakeResponse:
     """
     Run the lake exe check command at the given code in the specified directory.
 
     Args:
         lean_code: The Lean code to check
-        cwd: The current working directory where the code is located
+        cwd: The current working directory where the code is located, over stdio only
+        workspace: The id of a workspace from `workspace-open`, instead of `cwd`
+        ctx: Injected by FastMCP, to report progress. Cancelling the request kills the lean processes of the check
     Returns:
         LakeResponse: The result of the lake tool
     """
-    checker = Checker(cwd=Path(cwd))
-    return checker.run_code(lean_code)
+    checker = Checker(cwd=_workspace_dir(cwd, workspace))
+    return await _check(checker, lean_code, on_stage=_stage_reporter(ctx))
+
+
+@mcp.tool(
+    "typecheck-structured",
+    description="Elaborate the given code and the sorry check of `my_hoare_triple` in the given workspace, and return json diagnostics, a verdict per theorem and the verdict of the sorry check, without building the check executable.",
+)
+async def run_lean_structured_check(
+    lean_code: str,
+    cwd: str | None = None,
+    workspace: str | None = None,
+    ctx: Context = None,  # type: ignore[assignment]
+) -> ElaborationReport:
+    """
+    Run `lean --json` on the given code, followed by the term check of `Check.lean`, in the specified directory.
+
+    Args:
+        lean_code: The Lean code to check
+        cwd: The current working directory where the code is located, over stdio only
+        workspace: The id of a workspace from `workspace-open`, instead of `cwd`
+        ctx: Injected by FastMCP, to report progress. Cancelling the request kills the lean processes of the check
+    Returns:
+        ElaborationReport: Every diagnostic with its severity and position, success and sorry flags per theorem, and whether the term check passed
+    """
+    checker = Checker(cwd=_workspace_dir(cwd, workspace))
+    response = await _check(
+        checker, lean_code, elaborate=True, on_stage=_stage_reporter(ctx)
+    )
+    return elaboration_report(lean_code, response)
+
+
+@mcp.tool(
+    "typecheck-batch",
+    description="Run the typechecker on many candidate proofs at once, each as its own theorem, in the given workspace.",
+)
+async def run_lake_batch_check(
+    candidates: list[BatchCandidate],
+    cwd: str | None = None,
+    workspace: str | None = None,
+    ctx: Context = None,  # type: ignore[assignment]
+) -> list[TheoremCheck]:
+    """
+    Elaborate all candidates in a single lean file, amortizing the import cost over them.
+
+    Args:
+        candidates: Hoare triples with a proof (None for sorry) and a polarity each
+        cwd: The current working directory where the code is located, over stdio only
+        workspace: The id of a workspace from `workspace-open`, instead of `cwd`
+        ctx: Injected by FastMCP, to report progress. Cancelling the request kills the lean processes of the check
+    Returns:
+        list[TheoremCheck]: success, errors and sorry flag per candidate, in order
+    """
+    checker = Checker(cwd=_workspace_dir(cwd, workspace))
+    return await checker.run_batch(candidates, _stage_reporter(ctx))
+
+
+@mcp.tool(
+    "workspace-open",
+    description="Lease a lake project to check code in, until workspace-close. Pass its id as `workspace` to the typecheck tools.",
+)
+async def workspace_open() -> ServerWorkspace:
+    """
+    Lease a workspace from this server's pool. Leases unused for `FCP_WORKSPACE_LEASE_SECONDS` are returned to the pool.
+
+    Returns:
+        ServerWorkspace: The opaque id to check code in, and where the workspace is on this server
+    """
+    await _expire_workspaces()
+    _sweep_workspaces()
+    lease = AsyncExitStack()
+    path = await lease.enter_async_context(workspace_pool.lease())
+    server_workspace = ServerWorkspace(id=uuid.uuid4().hex, path=path)
+    _workspaces[server_workspace.id] = (server_workspace, lease, time.monotonic())
+    return server_workspace
+
+
+@mcp.tool("workspace-close", description="Return a workspace from workspace-open.")
+async def workspace_close(workspace: str) -> bool:
+    """
+    Return the workspace to this server's pool.
+
+    Args:
+        workspace: The id from `workspace-open`
+    Returns:
+        bool: Whether the workspace was still open
+    """
+    if workspace not in _workspaces:
+        return False
+    _, lease, _ = _workspaces.pop(workspace)
+    await lease.aclose()
+    return True
+
+
+@mcp.tool(
+    "typecheck-cache-stats",
+    description="Hit, miss and eviction counters of the typecheck cache.",
+)
+def typecheck_cache_stats() -> dict[str, int]:
+    """
+    Report the typecheck cache counters of this server process.
+
+    Returns:
+        dict: hits, misses, evictions and the number of entries on disk (empty when the cache is disabled)
+    """
+    if typecheck_cache is None:
+        return {}
+    return typecheck_cache.stats
+
+
+@mcp.tool(
+    "lean-queue-metrics",
+    description="How many lean processes run and wait, and how long checks queue for a slot.",
+)
+def lean_queue_metrics() -> dict[str, float]:
+    """
+    Report the lean concurrency metrics of this server process.
+
+    Returns:
+        dict: the slot limit, running and waiting checks, the worst queue depth, and mean/max seconds waited
+    """
+    return lean_slots.metrics
@@ -2,11 +2,20 @@
 Functions for LLM completion.
 """
 
+import gzip
+import hashlib
+import json
 import os
+import tempfile
+import time
+from collections import Counter
 from pathlib import Path
-from typing import Callable
+from typing import Any, Awaitable, Callable, Coroutine
 import dotenv
-from litellm import completion
+from litellm import acompletion, stream_chunk_builder, ModelResponse
+from containment.structures import StreamMetrics
+from containment.structures.enums import CompletionCacheMode
+from containment.netio.ratelimit import RATE_LIMITING, limiter_for
 
 dotenv.load_dotenv(Path.cwd() / ".." / ".env")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
@@ -14,22 +23,272 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 ORACLE_CONFIG_MAX_TOKENS = 2**14
 
+STREAM_COMPLETIONS = os.getenv("FCP_STREAM_COMPLETIONS", "0") != "0"
+PROMPT_CACHING = os.getenv("FCP_PROMPT_CACHING", "1") != "0"
+CACHE_CONTROL = {"type": "ephemeral"}
+
+UP = ".."
+COMPLETION_CACHE_MODE = CompletionCacheMode(
+    os.getenv("FCP_COMPLETION_CACHE", CompletionCacheMode.LIVE.value)
+)
+COMPLETION_CACHE_DIR = Path(
+    os.getenv(
+        "FCP_COMPLETION_CACHE_DIR",
+        str(Path.cwd() / UP / "experiments" / "cache" / "completions"),
+    )
+)
+
+
+def _with_cache_control(message: dict) -> dict:
+    """A copy of the message whose last content block is a cache breakpoint."""
+    content = message["content"]
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = [dict(block) for block in content]
+    if blocks:
+        blocks[-1]["cache_control"] = CACHE_CONTROL
+    return {**message, "content": blocks}
+
+
+def mark_cacheable(model: str, messages: list[dict]) -> list[dict]:
+    """
+    Anthropic only caches a prompt prefix up to an explicit breakpoint. Mark the system prompt, which never changes, and the latest turn, so that the next call of a loop reads the conversation so far from the cache.
+
+    Other providers, e.g. OpenAI, cache prefixes without being asked, so their messages are left alone.
+    """
+    if not model.startswith("anthropic") or not messages:
+        return messages
+    marked = list(messages)
+    marked[0] = _with_cache_control(marked[0])
+    if len(marked) > 1:
+        marked[-1] = _with_cache_control(marked[-1])
+    return marked
+
+
+def input_token_split(usage: Any) -> tuple[int, int]:
+    """The prompt tokens of a completion's usage that were read from the provider's cache, and those that weren't."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or getattr(
+        usage, "cache_read_input_tokens", None
+    )
+    cached = cached or 0
+    return cached, max(usage.prompt_tokens - cached, 0)
+
+
+async def _close_stream(stream: Any) -> None:
+    """Best effort to hang up on the provider: close the iterator litellm wraps around the http response, where it exposes one."""
+    inner = getattr(stream, "completion_stream", None)
+    for iterator in (inner, getattr(inner, "response_iterator", None)):
+        close = getattr(iterator, "aclose", None) or getattr(iterator, "close", None)
+        if close is None:
+            continue
+        try:
+            result = close()
+            if hasattr(result, "__await__"):
+                await result
+        except Exception:  # closing is an optimization, never an error
+            pass
+    return None
+
+
+async def stream_until_tag(
+    model: str,
+    messages: list[dict],
+    tag: str,
+    on_metrics: Callable[[StreamMetrics], None] | None = None,
+    **completion_kwargs: Any,
+) -> ModelResponse:
+    """
+    Stream the completion and stop reading as soon as `</tag>` has arrived, since `parse_program_completion` ignores whatever follows.
+
+    The chunks so far are assembled into an ordinary completion. Without usage from the provider, litellm counts the tokens itself.
+    """
+    closing = f"</{tag}>"
+    start = time.perf_counter()
+    stream = await acompletion(
+        model=model, messages=messages, stream=True, **completion_kwargs
+    )
+    chunks = []
+    text = ""
+    time_to_first_token = None
+    time_to_tag = None
+    try:
+        async for chunk in stream:  # type: ignore
+            chunks.append(chunk)
+            delta = chunk.choices[0].delta.content or ""
+            if delta and time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            text += delta
+            if closing in text[-(len(delta) + len(closing)) :]:
+                time_to_tag = time.perf_counter() - start
+                break
+    finally:
+        await _close_stream(stream)
+    if on_metrics is not None:
+        on_metrics(
+            StreamMetrics(
+                time_to_first_token=time_to_first_token,
+                time_to_tag=time_to_tag,
+                seconds=time.perf_counter() - start,
+            )
+        )
+    return stream_chunk_builder(chunks, messages=messages)  # type: ignore
+
+
+class CompletionCacheMiss(LookupError):
+    """Replay mode was asked for a completion that was never recorded."""
+
+
+class CompletionCache:
+    """
+    Recorded completions, one gzipped json list per distinct request.
+
+    A request is keyed by a digest of the model and the full message list, system prompt included.
+    The same request made again in one process gets the next recorded completion, so a replayed run sees the same sequence as the recorded one.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = COMPLETION_CACHE_DIR,
+        mode: CompletionCacheMode = COMPLETION_CACHE_MODE,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._occurrences: Counter[str] = Counter()
+        # key -> occurrence -> completion, of the completions this process got live
+        self._live: dict[str, dict[int, dict]] = {}
+
+    def key(self, model: str, messages: list[dict]) -> str:
+        request = json.dumps(
+            {"model": model, "messages": messages}, sort_keys=True, default=str
+        )
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json.gz"
+
+    def _load(self, key: str) -> list[dict]:
+        try:
+            with gzip.open(self._path(key), "rt") as entry:
+                return json.load(entry)
+        except (FileNotFoundError, EOFError, json.JSONDecodeError):
+            return []
+
+    def _dump(self, key: str, completions: list[dict]) -> None:
+        """Write atomically, so that concurrent runs never read a partial entry."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with gzip.open(os.fdopen(fd, "wb"), "wt") as entry:
+            json.dump(completions, entry)
+        os.replace(tmp, self._path(key))
+        return None
+
+    def _record(self, key: str, occurrence: int, completion: dict) -> None:
+        """
+        Store the completion as the `occurrence`th answer to its request.
+
+        Identical requests made concurrently, e.g. by a beam, finish in any order. So the live completions are kept by occurrence, and the entry is rewritten from them once they have no gap: a completion that lands before an earlier one is written along with it.
+        In record mode they replace what was recorded before, in read-through mode they extend it.
+        """
+        live = self._live.setdefault(key, {})
+        live[occurrence] = completion
+        entry = [] if self.mode == CompletionCacheMode.RECORD else self._load(key)
+        for idx in sorted(live):
+            if idx > len(entry):
+                break
+            entry[idx : idx + 1] = [live[idx]]
+        if occurrence < len(entry):
+            self._dump(key, entry)
+        return None
+
+    async def complete(
+        self,
+        model: str,
+        messages: list[dict],
+        live: Callable[[], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        """
+        Answer the request according to the mode, where `live` calls the model.
+
+        Raises:
+            CompletionCacheMiss: In replay mode, when the request was never recorded
+        """
+        if self.mode == CompletionCacheMode.LIVE:
+            return await live()
+        key = self.key(model, messages)
+        occurrence = self._occurrences[key]
+        self._occurrences[key] += 1
+        if self.mode != CompletionCacheMode.RECORD:
+            recorded = self._load(key)
+            if occurrence < len(recorded):
+                self.hits += 1
+                return ModelResponse(**recorded[occurrence])
+            if self.mode == CompletionCacheMode.REPLAY:
+                if not recorded:
+                    raise CompletionCacheMiss(
+                        f"No recorded completion of {model} for request {key}"
+                    )
+                self.hits += 1  # asked more often than recorded, so repeat the last one
+                return ModelResponse(**recorded[-1])
+        self.misses += 1
+        response = await live()
+        self._record(key, occurrence, response.model_dump())
+        return response
+
+
+completion_cache = CompletionCache()
+
 
 def mk_complete(
     model: str,
     system_prompt: str,
-) -> Callable[[list[dict]], dict]:
+    *,
+    cache: CompletionCache | None = None,
+    cache_prompt: bool = PROMPT_CACHING,
+    rate_limit: bool = RATE_LIMITING,
+    stop_tag: str | None = None,
+    on_metrics: Callable[[StreamMetrics], None] | None = None,
+    **completion_kwargs: Any,
+) -> Callable[[list[dict]], Coroutine[Any, Any, dict]]:
     """
     Creates a lambda for sending messages to litellm, whomst returns a completion.
+
+    The completion is awaited, so concurrent experts wait on the network together instead of blocking the event loop in turn.
+    Completions go through `cache`, by default the process-wide one in the mode set by `FCP_COMPLETION_CACHE`.
+    With `rate_limit`, calls that miss the cache wait for the provider's budget, see `ProviderLimiter`.
+    With `cache_prompt`, the stable prefix of the conversation is marked for the provider's prompt cache, see `mark_cacheable`.
+    With `stop_tag`, the completion is streamed and cut off after the closing tag, reporting latencies to `on_metrics`, see `stream_until_tag`.
+    `completion_kwargs` are passed on to litellm, e.g. `mock_response` for offline runs.
     """
+    cache = cache if cache is not None else completion_cache
 
-    def _complete(messages: list[dict]) -> dict:
+    async def _complete(messages: list[dict]) -> dict:
         messages = [
             {
                 "role": "developer" if model.startswith("openai") else "system",
                 "content": system_prompt,
             },
         ] + messages
-        return completion(model=model, messages=messages, stream=False)  # type: ignore
+        sent = mark_cacheable(model, messages) if cache_prompt else messages
+
+        def live() -> Awaitable[ModelResponse]:
+            if stop_tag is not None:
+                return stream_until_tag(
+                    model, sent, stop_tag, on_metrics, **completion_kwargs
+                )
+            return acompletion(
+                model=model, messages=sent, stream=False, **completion_kwargs
+            )  # type: ignore
+
+        if rate_limit:
+            return await cache.complete(
+                model,
+                messages,
+                lambda: limiter_for(model).run(model, messages, live),
+            )  # type: ignore
+        return await cache.complete(model, messages, live)  # type: ignore
 
     return _complete
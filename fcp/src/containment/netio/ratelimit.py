@@ -0,0 +1,191 @@
+"""Client-side rate limiting of LLM calls, one limiter per provider shared by every expert of the process."""
+
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+from litellm import ModelResponse, RateLimitError, token_counter
+from containment.fsio.logs import logs
+
+RATE_LIMITING = os.getenv("FCP_RATE_LIMIT", "1") != "0"
+LLM_MAX_RETRIES = int(os.getenv("FCP_LLM_MAX_RETRIES", "6"))
+BACKOFF_BASE_SECONDS = float(os.getenv("FCP_LLM_BACKOFF_SECONDS", "2"))
+BACKOFF_MAX_SECONDS = 60.0
+
+
+def _provider_setting(provider: str, name: str, default: str) -> float:
+    """`FCP_{PROVIDER}_{NAME}`, falling back to `FCP_LLM_{NAME}` and then the default."""
+    return float(
+        os.getenv(
+            f"FCP_{provider.upper()}_{name}", os.getenv(f"FCP_LLM_{name}", default)
+        )
+    )
+
+
+class TokenBucket:
+    """Refills `per_minute` units evenly over a minute, holding at most a minute's worth."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.available = per_minute
+        self._refilled_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(
+            self.capacity,
+            self.available + (now - self._refilled_at) * self.per_minute / 60,
+        )
+        self._refilled_at = now
+        return None
+
+    async def acquire(self, amount: float) -> None:
+        """Wait until `amount` units are available and take them. Larger amounts than the capacity only need a full bucket."""
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.available >= amount:
+                self.available -= amount
+                return None
+            await asyncio.sleep((amount - self.available) * 60 / self.per_minute)
+
+    def settle(self, amount: float) -> None:
+        """Take (or give back, when negative) the difference between the estimate and what was actually used. The bucket may go into debt."""
+        self._refill()
+        self.available = min(self.capacity, self.available - amount)
+        return None
+
+
+class AdaptiveConcurrency:
+    """
+    Additive-increase, multiplicative-decrease bound on requests in flight.
+
+    Every success raises the limit by `1 / limit`, so about one per window of successes, and every rate limit error halves it.
+    """
+
+    def __init__(self, initial: float, *, minimum: float = 1, maximum: float) -> None:
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._cond = asyncio.Condition()
+
+    def _condition(self) -> asyncio.Condition:
+        """The condition, recreated when used from a new event loop (each `asyncio.run`)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        cond = self._condition()
+        async with cond:
+            while self.in_flight >= int(self.limit):
+                await cond.wait()
+            self.in_flight += 1
+        try:
+            yield None
+        finally:
+            async with cond:
+                self.in_flight -= 1
+                cond.notify_all()
+
+    def increase(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        return None
+
+    def decrease(self) -> None:
+        self.limit = max(self.minimum, self.limit / 2)
+        return None
+
+
+class ProviderLimiter:
+    """
+    Keeps the calls to one provider within its requests and tokens per minute, and backs off with jitter when it answers 429 anyway.
+
+    Budgets are read from `FCP_{PROVIDER}_RPM`, `_TPM`, `_CONCURRENCY` and `_MAX_CONCURRENCY`, or the `FCP_LLM_*` defaults for all providers.
+    """
+
+    def __init__(self, provider: str) -> None:
+        self.provider = provider
+        self.requests = TokenBucket(_provider_setting(provider, "RPM", "50"))
+        self.tokens = TokenBucket(_provider_setting(provider, "TPM", "200000"))
+        self.concurrency = AdaptiveConcurrency(
+            _provider_setting(provider, "CONCURRENCY", "8"),
+            maximum=_provider_setting(provider, "MAX_CONCURRENCY", "64"),
+        )
+        self.rate_limited = 0
+        self.completed = 0
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter: uniform up to the exponentially growing cap."""
+        return random.uniform(
+            0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+        )
+
+    async def run(
+        self,
+        model: str,
+        messages: list[dict],
+        call: Callable[[], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        """
+        Make the call once the budgets allow, retrying it after rate limit errors.
+
+        The prompt's token count is reserved up front, and the bucket is settled with the actual usage afterwards.
+
+        Raises:
+            RateLimitError: When the provider still rate limits after `FCP_LLM_MAX_RETRIES` retries
+        """
+        estimate = token_counter(model=model, messages=messages)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            async with self.concurrency.slot():
+                await self.requests.acquire(1)
+                await self.tokens.acquire(estimate)
+                try:
+                    response = await call()
+                except RateLimitError:
+                    self.rate_limited += 1
+                    self.concurrency.decrease()
+                    self.tokens.settle(-estimate)
+                    if attempt == LLM_MAX_RETRIES:
+                        raise
+                else:
+                    self.completed += 1
+                    self.concurrency.increase()
+                    usage = getattr(response, "usage", None)
+                    if usage is not None:
+                        self.tokens.settle(usage.total_tokens - estimate)
+                    return response
+            delay = self._backoff(attempt)
+            logs.info(
+                f"{self.provider}: rate limited, retrying in {delay:.1f}s with concurrency {self.concurrency.limit:.1f}"
+            )
+            await asyncio.sleep(delay)
+        raise RuntimeError("Unreachable: the last attempt returns or raises.")
+
+    @property
+    def stats(self) -> dict[str, float]:
+        return {
+            "concurrency": self.concurrency.limit,
+            "in_flight": self.concurrency.in_flight,
+            "completed": self.completed,
+            "rate_limited": self.rate_limited,
+        }
+
+
+_limiters: dict[str, ProviderLimiter] = {}
+
+
+def limiter_for(model: str) -> ProviderLimiter:
+    """The limiter of the model's provider, the prefix of its litellm id (`LLM.provider`)."""
+    provider = model.split("/", 1)[0]
+    if provider not in _limiters:
+        _limiters[provider] = ProviderLimiter(provider)
+    return _limiters[provider]
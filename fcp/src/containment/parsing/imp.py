@@ -0,0 +1,553 @@
+"""
+Parse imp programs (`imp { ... }`) and `astn` assertions into the syntax trees of `containment.structures.imp`, without lean.
+
+The grammar and precedences follow `imp/Imp/Stmt/Basic.lean`, `imp/Imp/Expr/Syntax.lean` and `imp/Imp/Hoare/Syntax.lean`.
+Lean escapes (`~term`) are kept: `~ident` as a `Meta`, `~(...)` as the arithmetic over lean identifiers it spells, or else as an opaque `Escape`.
+"""
+
+import re
+from containment.structures.imp import (
+    Assertion,
+    Assign,
+    Binary,
+    Comparison,
+    Connect,
+    Const,
+    Escape,
+    Expr,
+    If,
+    Meta,
+    Negation,
+    Seq,
+    Skip,
+    Stmt,
+    Unary,
+    Var,
+    While,
+)
+
+SYMBOLS = sorted(
+    [
+        "<<->>",
+        "<^>",
+        "<!>",
+        "->>",
+        ":=",
+        "==",
+        "&&",
+        "||",
+        "!=",
+        "<=",
+        ">=",
+        "<>",
+        "≤",
+        "≥",
+        "<",
+        ">",
+        "=",
+        "+",
+        "-",
+        "*",
+        "/",
+        "!",
+        "~",
+        "(",
+        ")",
+        "{",
+        "}",
+        ";",
+    ],
+    key=len,
+    reverse=True,
+)
+# tokens of the imp grammar and lean keywords, which lean won't read as variable names
+RESERVED = {
+    "skip",
+    "if",
+    "else",
+    "while",
+    "imp",
+    "expr",
+    "var",
+    "astn",
+    "fun",
+    "let",
+    "in",
+    "have",
+    "show",
+    "from",
+    "by",
+    "at",
+    "do",
+    "then",
+    "match",
+    "with",
+    "where",
+    "end",
+}
+BINARY_PRECEDENCE = {
+    "*": 70,
+    "/": 70,
+    "+": 65,
+    "-": 65,
+    "<": 50,
+    "≤": 50,
+    "≥": 50,
+    ">": 50,
+    "==": 45,
+    "&&": 35,
+    "||": 35,
+}
+UNARY_PRECEDENCE = 75
+RELATIONS = {"=", "!=", "<", ">", "<=", ">="}
+CONNECTIVES = {"<^>", "<>", "->>", "<<->>"}
+# lean's `Int` division by zero is 0 where imp's is undefined, so `~(a / b)` stays opaque
+ARITHMETIC = {"+", "-", "*"}
+
+# what the model most likely meant, by the token lean would stumble on
+HINTS = {
+    "imp": {
+        "<=": "imp writes less or equal as `≤`",
+        ">=": "imp writes greater or equal as `≥`",
+        "!=": "imp has no `!=`, write `!(a == b)`",
+        "=": "imp compares with `==` and assigns with `:=`",
+        "<^>": "`<^>` belongs to assertions, imp's conjunction is `&&`",
+        "<>": "`<>` belongs to assertions, imp's disjunction is `||`",
+        "<!>": "`<!>` belongs to assertions, imp's negation is `!`",
+        "else": "`else` only follows the `}` of an `if` block",
+    },
+    "astn": {
+        "≤": "assertions write less or equal as `<=`",
+        "≥": "assertions write greater or equal as `>=`",
+        "==": "assertions compare with `=`",
+        "&&": "the conjunction of assertions is `<^>`",
+        "||": "the disjunction of assertions is `<>`",
+        "!": "the negation of assertions is `<!>`",
+        "(": "assertions have no parentheses, `<^>`, `<>`, `->>` and `<<->>` group to the right",
+    },
+}
+EXPECTED_HINTS = {
+    "imp": "the program is one `imp { ... }` term",
+    "else": "every `if` needs an `else` block, `else { skip; }` if nothing else",
+    ";": "every assignment and `skip` ends with `;`",
+}
+CHARACTER_HINTS = {
+    "≠": "imp has no `≠`, write `!(a == b)`",
+    "∧": "imp's conjunction is `&&`, that of assertions `<^>`",
+    "∨": "imp's disjunction is `||`, that of assertions `<>`",
+    "¬": "imp's negation is `!`, that of assertions `<!>`",
+    '"': "imp has only integer values",
+    "%": "imp has no remainder operator",
+}
+
+_IDENT = re.compile(r"[^\W\d][\w']*(?:\.[^\W\d][\w']*)*")
+_NUM = re.compile(r"0[xX][0-9a-fA-F]+|0[bB][01]+|0[oO][0-7]+|\d+")
+_SPACE = re.compile(r"\s+")
+
+
+class ImpSyntaxError(ValueError):
+    """A program or assertion that lean would not parse, at a 1-based line and column, with what was probably meant."""
+
+    def __init__(
+        self,
+        message: str,
+        line: int,
+        column: int,
+        *,
+        hint: str | None = None,
+        source_line: str = "",
+    ) -> None:
+        super().__init__(f"{line}:{column}: {message}")
+        self.message = message
+        self.line = line
+        self.column = column
+        self.hint = hint
+        self.source_line = source_line
+
+    @property
+    def feedback(self) -> str:
+        """The error, the line it is on with a caret under the spot, and the hint, for the next prompt."""
+        lines = [str(self)]
+        if self.source_line:
+            lines += [self.source_line, " " * (self.column - 1) + "^"]
+        if self.hint:
+            lines.append(f"Hint: {self.hint}")
+        return "\n".join(lines)
+
+
+def _int(numeral: str) -> int:
+    return int(numeral, 0) if numeral[1:2].isalpha() else int(numeral)
+
+
+class Token:
+    __slots__ = ("kind", "text", "line", "column")
+
+    def __init__(self, kind: str, text: str, line: int, column: int) -> None:
+        self.kind = kind  # "ident", "num", "sym", "escape" or "eof"
+        self.text = text
+        self.line = line
+        self.column = column
+
+    def __repr__(self) -> str:
+        return f"Token({self.kind}, {self.text!r}, {self.line}:{self.column})"
+
+
+def tokenize(source: str) -> list[Token]:
+    """Split `source` into tokens, dropping whitespace and lean comments. `~(...)` becomes one escape token of the text within the parentheses."""
+    tokens = []
+    line, line_start, pos = 1, 0, 0
+
+    def error(message: str, column: int, hint: str | None = None) -> ImpSyntaxError:
+        end = source.find("\n", line_start)
+        source_line = source[line_start : None if end == -1 else end]
+        return ImpSyntaxError(message, line, column, hint=hint, source_line=source_line)
+
+    def advance(end: int) -> None:
+        nonlocal line, line_start, pos
+        newlines = source.count("\n", pos, end)
+        if newlines:
+            line += newlines
+            line_start = source.rindex("\n", pos, end) + 1
+        pos = end
+
+    while pos < len(source):
+        column = pos - line_start + 1
+        if mtch := _SPACE.match(source, pos):
+            advance(mtch.end())
+            continue
+        if source.startswith("--", pos):
+            end = source.find("\n", pos)
+            advance(len(source) if end == -1 else end)
+            continue
+        if source.startswith("/-", pos):
+            end = source.find("-/", pos + 2)
+            if end == -1:
+                raise error("unterminated comment", column)
+            advance(end + 2)
+            continue
+        if source[pos] == "~":
+            after = _SPACE.match(source, pos + 1)
+            start = after.end() if after else pos + 1
+            if source.startswith("(", start):
+                depth, end = 0, start
+                while end < len(source):
+                    depth += {"(": 1, ")": -1}.get(source[end], 0)
+                    if depth == 0:
+                        break
+                    end += 1
+                if depth:
+                    raise error("unclosed `(` in lean escape", column)
+                tokens.append(Token("escape", source[start + 1 : end], line, column))
+                advance(end + 1)
+                continue
+        if mtch := _NUM.match(source, pos):
+            tokens.append(Token("num", mtch.group(), line, column))
+            advance(mtch.end())
+            continue
+        if mtch := _IDENT.match(source, pos):
+            tokens.append(Token("ident", mtch.group(), line, column))
+            advance(mtch.end())
+            continue
+        for symbol in SYMBOLS:
+            if source.startswith(symbol, pos):
+                tokens.append(Token("sym", symbol, line, column))
+                advance(pos + len(symbol))
+                break
+        else:
+            char = source[pos]
+            raise error(
+                f"unexpected character `{char}`", column, CHARACTER_HINTS.get(char)
+            )
+    tokens.append(Token("eof", "", line, pos - line_start + 1))
+    return tokens
+
+
+class Parser:
+    """Recursive descent over the tokens of one program or assertion."""
+
+    def __init__(self, source: str, grammar: str = "imp") -> None:
+        self.lines = source.splitlines()
+        self.tokens = tokenize(source)
+        self.grammar = grammar  # "imp" or "astn", for the hints
+        self.pos = 0
+
+    @property
+    def token(self) -> Token:
+        return self.tokens[self.pos]
+
+    def error(
+        self,
+        message: str,
+        token: Token | None = None,
+        *,
+        expected: str | None = None,
+        hint: str | None = None,
+    ) -> ImpSyntaxError:
+        token = self.token if token is None else token
+        if hint is None and token.kind in ("sym", "ident"):
+            hint = HINTS[self.grammar].get(token.text)
+        if hint is None and expected is not None:
+            hint = EXPECTED_HINTS.get(expected)
+        source_line = (
+            self.lines[token.line - 1] if token.line <= len(self.lines) else ""
+        )
+        return ImpSyntaxError(
+            message, token.line, token.column, hint=hint, source_line=source_line
+        )
+
+    def at(self, text: str) -> bool:
+        return self.token.kind == "sym" and self.token.text == text
+
+    def at_keyword(self, keyword: str) -> bool:
+        return self.token.kind == "ident" and self.token.text == keyword
+
+    def expect(self, text: str) -> Token:
+        token = self.token
+        if token.kind in ("sym", "ident") and token.text == text:
+            self.pos += 1
+            return token
+        raise self.error(f"expected `{text}`, found {_describe(token)}", expected=text)
+
+    def expect_end(self) -> None:
+        if self.token.kind != "eof":
+            raise self.error(f"unexpected {_describe(self.token)} after the end")
+        return None
+
+    # expressions
+
+    def expression(self, min_precedence: int = 0) -> Expr:
+        left = self.prefix()
+        while (
+            self.token.kind == "sym"
+            and BINARY_PRECEDENCE.get(self.token.text, -1) >= min_precedence
+        ):
+            op = self.token.text
+            self.pos += 1
+            right = self.expression(BINARY_PRECEDENCE[op] + 1)
+            left = Binary(op=op, left=left, right=right)  # type: ignore[arg-type]
+        return left
+
+    def prefix(self) -> Expr:
+        token = self.token
+        match token.kind, token.text:
+            case "num", text:
+                self.pos += 1
+                return Const(value=_int(text))
+            case "ident", name:
+                if name in RESERVED:
+                    raise self.error(f"`{name}` is a keyword, not a variable name")
+                self.pos += 1
+                return Var(name=name)
+            case "escape", term:
+                self.pos += 1
+                return _escaped(term)
+            case "sym", "~":
+                return self.tilde()
+            case "sym", "(":
+                self.pos += 1
+                inner = self.expression()
+                self.expect(")")
+                return inner
+            case "sym", ("-" | "!") as op:
+                self.pos += 1
+                return Unary(op=op, operand=self.expression(UNARY_PRECEDENCE))
+        raise self.error(f"expected an expression, found {_describe(token)}")
+
+    def tilde(self) -> Expr:
+        """`~ident` or `~num`, the `~(...)` escapes being single tokens."""
+        self.expect("~")
+        token = self.token
+        self.pos += 1
+        match token.kind:
+            case "ident":
+                return Meta(name=token.text)
+            case "num":
+                return Const(value=_int(token.text))
+        raise self.error(
+            f"expected a lean term after `~`, found {_describe(token)}", token
+        )
+
+    # statements
+
+    def program(self) -> Seq:
+        self.expect("imp")
+        self.expect("{")
+        body = self.statements()
+        self.expect("}")
+        self.expect_end()
+        return body
+
+    def statements(self) -> Seq:
+        """One or more statements, up to a closing brace."""
+        statements = [self.statement()]
+        while not self.at("}") and self.token.kind != "eof":
+            statements.append(self.statement())
+        return Seq(statements=statements)
+
+    def block(self) -> Seq:
+        self.expect("{")
+        body = self.statements()
+        self.expect("}")
+        return body
+
+    def statement(self) -> Stmt:
+        token = self.token
+        if self.at_keyword("skip"):
+            self.pos += 1
+            self.expect(";")
+            return Skip()
+        if self.at_keyword("if"):
+            self.pos += 1
+            condition = self.condition()
+            then = self.block()
+            self.expect("else")
+            if self.at_keyword("if"):
+                raise self.error(
+                    "expected `{`, found `if`",
+                    hint="imp has no `else if`, nest it: `else { if (...) { ... } else { ... } }`",
+                )
+            return If(condition=condition, then=then, orelse=self.block())
+        if self.at_keyword("while"):
+            self.pos += 1
+            condition = self.condition()
+            return While(condition=condition, body=self.block())
+        if token.kind == "ident":
+            if token.text in RESERVED:
+                raise self.error(f"`{token.text}` is a keyword, not a variable name")
+            self.pos += 1
+            self.expect(":=")
+            value = self.expression()
+            self.expect(";")
+            return Assign(name=token.text, value=value)
+        if token.kind == "escape" or self.at("~"):
+            return self.escaped_statement()
+        raise self.error(
+            f"expected a statement, found {_describe(token)}",
+            hint="a block holds at least one statement, `skip;` if nothing else"
+            if self.at("}")
+            else None,
+        )
+
+    def condition(self) -> Expr:
+        self.expect("(")
+        condition = self.expression()
+        self.expect(")")
+        return condition
+
+    def escaped_statement(self) -> Escape:
+        """`~term`, a lean `Stmt`, or `~term := exp;`, an assignment to a lean `String`."""
+        start = self.token
+        if start.kind == "escape":
+            self.pos += 1
+            term = f"~({start.text})"
+        else:
+            self.expect("~")
+            term = f"~{self.token.text}"
+            self.pos += 1
+        if self.at(":="):
+            self.pos += 1
+            self.expression()
+            self.expect(";")
+            term += " := ..."
+        return Escape(term=term)
+
+    # assertions
+
+    def assertion(self) -> Assertion:
+        """Connectives all bind alike and to the right, and `<!>` negates everything after it, as lean parses them."""
+        if self.at("<!>"):
+            self.pos += 1
+            return Negation(operand=self.assertion())
+        left = self.comparison()
+        if self.token.kind == "sym" and self.token.text in CONNECTIVES:
+            op = self.token.text
+            self.pos += 1
+            return Connect(op=op, left=left, right=self.assertion())  # type: ignore[arg-type]
+        return left
+
+    def comparison(self) -> Comparison:
+        left = self.assertion_term()
+        token = self.token
+        if token.kind != "sym" or token.text not in RELATIONS:
+            raise self.error(
+                f"expected one of {', '.join(f'`{r}`' for r in sorted(RELATIONS))}, found {_describe(token)}"
+            )
+        self.pos += 1
+        return Comparison(op=token.text, left=left, right=self.assertion_term())  # type: ignore[arg-type]
+
+    def assertion_term(self) -> Expr:
+        token = self.token
+        match token.kind:
+            case "ident":
+                self.pos += 1
+                return Var(name=token.text)
+            case "num":
+                self.pos += 1
+                return Const(value=_int(token.text))
+            case "escape":
+                self.pos += 1
+                return _escaped(token.text)
+        if self.at("~"):
+            return self.tilde()
+        raise self.error(
+            f"expected a variable, a numeral or `~term`, found {_describe(token)}"
+        )
+
+
+def _describe(token: Token) -> str:
+    match token.kind:
+        case "eof":
+            return "the end of the input"
+        case "escape":
+            return f"`~({token.text})`"
+    return f"`{token.text}`"
+
+
+def _lean_arithmetic(expr: Expr) -> Expr:
+    """Read an expression parsed from inside `~(...)` as lean arithmetic over lean identifiers."""
+    match expr:
+        case Var(name=name):
+            return Meta(name=name)
+        case Unary(op="-", operand=operand):
+            return Unary(op="-", operand=_lean_arithmetic(operand))
+        case Binary(op=op, left=left, right=right) if op in ARITHMETIC:
+            return Binary(
+                op=op, left=_lean_arithmetic(left), right=_lean_arithmetic(right)
+            )
+        case Const() | Meta():
+            return expr
+    raise ValueError("not integer arithmetic")
+
+
+def _escaped(term: str) -> Expr:
+    """The arithmetic a `~(term)` spells, when it is plain `Int` arithmetic over identifiers, else an opaque `Escape`."""
+    try:
+        parser = Parser(term, "imp")
+        expr = parser.expression()
+        parser.expect_end()
+        return _lean_arithmetic(expr)
+    except ValueError:
+        return Escape(term=f"~({term})")
+
+
+def parse_program(source: str) -> Seq:
+    """
+    Parse an `imp { ... }` term.
+
+    Raises:
+        ImpSyntaxError: where lean's parser would fail
+    """
+    return Parser(source).program()
+
+
+def parse_assertion(source: str) -> Assertion:
+    """
+    Parse the text of an `astn` assertion, such as a specification's precondition.
+
+    Raises:
+        ImpSyntaxError: where lean's parser would fail
+    """
+    parser = Parser(source, "astn")
+    assertion = parser.assertion()
+    parser.expect_end()
+    return assertion
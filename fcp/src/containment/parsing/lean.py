@@ -0,0 +1,186 @@
+import json
+import re
+from containment.structures import (
+    Diagnostic,
+    ElaborationReport,
+    LakeResponse,
+    TheoremCheck,
+)
+from containment.mcp.clients.experts.proof import SORRY_CANARY
+
+SORRY_WARNING = "declaration uses 'sorry'"
+# What `Check.lean`'s term check prints on `CHECKED_TERM`, besides `SORRY_CANARY`.
+PROVEN_OK = "<HOARE_TRIPLE_TERM_PROVEN_OK>"
+CHECKED_TERM = "my_hoare_triple"
+
+_THEOREM = re.compile(r"^(?:theorem|lemma|example)\s+(\S+)", re.MULTILINE)
+# The first line of a message, in `ElaborationReport.feedback` or `lake` output.
+_MESSAGE_START = re.compile(
+    r"^(?:\S*?:)?\d+:\d+: (?:error|warning|information)|^error:"
+)
+# An error lean reports at a position in the code, as `lake` or `lean` print it.
+_POSITIONED_ERROR = re.compile(
+    r"^error: \S*:\d+:\d+:|^\S*:\d+:\d+: error", re.MULTILINE
+)
+COMPACT_MESSAGE_CHARS = 2000
+
+
+def parse_json_diagnostics(output: str) -> list[Diagnostic]:
+    """Parse the messages `lean --json` prints one object per line, skipping any line that isn't one (e.g. lake's own output)."""
+    diagnostics: list[Diagnostic] = []
+    for line in output.splitlines():
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(message, dict) or "severity" not in message:
+            continue
+        pos = message.get("pos") or {}
+        diagnostics.append(
+            Diagnostic(
+                severity=message["severity"],
+                line=pos.get("line", 0),
+                column=pos.get("column", 0),
+                message=message.get("data", ""),
+            )
+        )
+    return diagnostics
+
+
+def is_verdict(response: LakeResponse) -> bool:
+    """
+    Whether the response is lean's judgement of the code: it exited cleanly, or it failed and reported errors in the code.
+
+    A timeout, a kill by a signal (e.g. the memory cap), a crashed worker or a missing toolchain says nothing about the code.
+    """
+    if response.timed_out or response.exit_code < 0:
+        return False
+    if response.exit_code == 0:
+        return True
+    return bool(
+        _POSITIONED_ERROR.search(response.stdout)
+        or _POSITIONED_ERROR.search(response.stderr)
+        or any(
+            diagnostic.severity == "error"
+            for diagnostic in parse_json_diagnostics(response.stdout)
+        )
+    )
+
+
+def theorem_spans(lean_code: str) -> dict[str, tuple[int, int]]:
+    """Map each theorem name to the 1-indexed lines `[start, end)` it occupies, up to the next theorem."""
+    starts = [
+        (lean_code.count("\n", 0, mtch.start()) + 1, mtch.group(1))
+        for mtch in _THEOREM.finditer(lean_code)
+    ]
+    end_of_file = lean_code.count("\n") + 2
+    return {
+        name: (start, starts[idx + 1][0] if idx + 1 < len(starts) else end_of_file)
+        for idx, (start, name) in enumerate(starts)
+    }
+
+
+def theorem_checks(
+    spans: dict[str, tuple[int, int]], diagnostics: list[Diagnostic]
+) -> list[TheoremCheck]:
+    """
+    Attribute each diagnostic to the theorem whose span of lines `[start, end)` contains it, and check the theorems in the order of `spans`. Errors outside every theorem (e.g. in the header) fail all of them.
+    """
+
+    def owner(diagnostic: Diagnostic) -> str | None:
+        for name, (start, end) in spans.items():
+            if start <= diagnostic.line < end:
+                return name
+        return None
+
+    global_errors = [
+        str(diagnostic)
+        for diagnostic in diagnostics
+        if diagnostic.severity == "error" and owner(diagnostic) is None
+    ]
+    checks = []
+    for name in spans:
+        own = [diagnostic for diagnostic in diagnostics if owner(diagnostic) == name]
+        errors = global_errors + [
+            str(diagnostic) for diagnostic in own if diagnostic.severity == "error"
+        ]
+        has_sorry = any(SORRY_WARNING in diagnostic.message for diagnostic in own)
+        checks.append(
+            TheoremCheck(
+                name=name,
+                success=not errors and not has_sorry,
+                has_sorry=has_sorry,
+                errors=errors,
+            )
+        )
+    return checks
+
+
+def response_diagnostics(response: LakeResponse) -> list[Diagnostic]:
+    """
+    The json diagnostics of `lean --json`, plus one error outside every theorem when lean didn't get to a verdict (see `is_verdict`).
+
+    That error fails every theorem, so a timeout, a kill or a failure to even start lean never passes for a proof, and its output still reaches the feedback.
+    """
+    diagnostics = parse_json_diagnostics(response.stdout)
+    if is_verdict(response):
+        return diagnostics
+    reason = response.stderr.strip() or response.stdout.strip()
+    return diagnostics + [
+        Diagnostic(
+            severity="error",
+            line=0,
+            column=0,
+            message=reason or f"lean exited with code {response.exit_code}",
+        )
+    ]
+
+
+def elaboration_report(lean_code: str, response: LakeResponse) -> ElaborationReport:
+    """Turn the output of `lean --json` on the lean code and the term check after it into diagnostics, a verdict per theorem and the term check's verdict."""
+    diagnostics = response_diagnostics(response)
+    messages = [diagnostic.message for diagnostic in diagnostics]
+    return ElaborationReport(
+        exit_code=response.exit_code,
+        diagnostics=diagnostics,
+        theorems=theorem_checks(theorem_spans(lean_code), diagnostics),
+        term_proven=any(PROVEN_OK in message for message in messages)
+        and not any(SORRY_CANARY in message for message in messages),
+    )
+
+
+def error_count(feedback: str) -> int:
+    """The number of errors and sorry warnings in lean's feedback, a coarse measure of how far a proof is from done."""
+    return sum(
+        1
+        for line in feedback.splitlines()
+        if _MESSAGE_START.match(line) and ("error" in line or SORRY_WARNING in line)
+    )
+
+
+def compact_stderr(stderr: str, max_chars: int = COMPACT_MESSAGE_CHARS) -> str:
+    """
+    Shrink lean's feedback on an old attempt to its first error and a goal state, dropping the other messages.
+
+    The goal state (the hypotheses and the `⊢` line) comes from the first message that has one, when the first error doesn't.
+    """
+    messages: list[list[str]] = []
+    for line in stderr.splitlines():
+        if _MESSAGE_START.match(line) or not messages:
+            messages.append([line])
+        else:
+            messages[-1].append(line)
+    if len(messages) <= 1 and len(stderr) <= max_chars:
+        return stderr
+    errors = [message for message in messages if "error" in message[0]]
+    first = errors[0] if errors else messages[0]
+    kept = "\n".join(first)[:max_chars]
+    if "⊢" not in kept:
+        for message in messages:
+            if any(line.lstrip().startswith("⊢") for line in message):
+                kept += "\nGoal state:\n" + "\n".join(message[1:])[:max_chars]
+                break
+    elided = len(messages) - 1
+    if elided > 0:
+        kept += f"\n({elided} more messages elided)"
+    return kept
@@ -1,6 +1,13 @@
 import asyncio
+import os
+import time
+from pathlib import Path
 from containment.mcp.clients.experts.imp import ImpExpert
-from containment.mcp.clients.experts.proof.loop import ProofExpert as LoopProofExpert
+from containment.mcp.clients.experts.proof.loop import (
+    PROOF_BEAM,
+    ProofExpert as LoopProofExpert,
+)
+from containment.mcp.clients.experts.proof.hedge import HEDGE, Hedge
 from containment.mcp.clients.experts.proof.search import (
     Expert as SearchProofExpert,
 )
@@ -8,7 +15,10 @@ from containment.structures.enums import ProofMethod
 from containment.structures import (
     Polarity,
     Specification,
+    Strategy,
+    ExpertMetadata,
     VerificationSuccess,
+    VerificationFailure,
     VerificationResult,
     ImpFailure,
     Failure,
@@ -16,6 +26,10 @@ from containment.structures import (
 )
 from containment.fsio.logs import logs
 
+PIPELINE_DEPTH = int(os.getenv("FCP_PIPELINE_DEPTH", "0"))
+PORTFOLIO_TIMEOUT_SECONDS = float(os.getenv("FCP_PORTFOLIO_TIMEOUT_SECONDS", "900"))
+SYNTAX_RETRIES = int(os.getenv("FCP_SYNTAX_RETRIES", "3"))
+
 
 async def _synthesize_shot(
     model: str,
@@ -44,28 +58,39 @@ async def _synthesize(
     *,
     failed_attempts: list[Failure] | None = None,
     imp_attempts: int = 5,
+    syntax_retries: int = SYNTAX_RETRIES,
 ) -> HoareTriple:
     """
     Synthesize a hoare triple from the specification, allowing multiple attempts.
+
+    A program that doesn't parse is retried straight away with its syntax error, up to `syntax_retries` times, without using up an attempt.
     """
     msg_prefix = f"{model}:{specification.name if specification.name is not None else 'user_spec'}:"
+    # syntax errors are fed back even when the caller keeps no failed attempts
+    feedback = failed_attempts if failed_attempts is not None else []
     result = None
-    for attempt in range(imp_attempts):
+    attempt = 0
+    while attempt < imp_attempts:
         logs.info(
             f"{msg_prefix} Imp Synthesis: Attempt to synthesize hoare triple: {attempt + 1}/{imp_attempts}"
         )
-        result = await _synthesize_shot(
-            model, specification, failed_attempts=failed_attempts
-        )
+        result = await _synthesize_shot(model, specification, failed_attempts=feedback)
         match result:
             case HoareTriple():
                 return result
+            case ImpFailure(syntax_error=str()) if syntax_retries > 0:
+                syntax_retries -= 1
+                logs.warning(
+                    f"{msg_prefix} IMP SYNTAX: Retrying attempt {attempt + 1} ({syntax_retries} syntax retries left): {result.failure_str}"
+                )
+                feedback.append(result)
             case ImpFailure():
                 logs.warning(
                     f"{msg_prefix} IMP SYNTHESIS: Attempt {attempt + 1} failed: {result.failure_str}"
                 )
                 if failed_attempts is not None:
                     failed_attempts.append(result)
+                attempt += 1
     msg = f"{msg_prefix}: Failed to synthesize hoare triple after {imp_attempts} attempts."
     if result is not None:
         msg += f" Last failure: {result.failure_str}"
@@ -80,16 +105,45 @@ async def _synthesize_and_prove_loop(
     proof_loop_budget: int,
     failed_attempts: list[Failure] | None = None,
     multipolarity: bool = True,
+    proof_beam: int = PROOF_BEAM,
+    hedge: bool = False,
 ) -> VerificationResult:
     """
     Synthesize and prove a Hoare triple.
     """
     triple = await _synthesize(model, specification, failed_attempts=failed_attempts)
+    return await _prove_loop(
+        model,
+        triple,
+        proof_loop_budget=proof_loop_budget,
+        multipolarity=multipolarity,
+        proof_beam=proof_beam,
+        hedge=hedge,
+    )
+
+
+async def _prove_loop(
+    model: str,
+    triple: HoareTriple,
+    *,
+    proof_loop_budget: int,
+    multipolarity: bool = True,
+    proof_beam: int = PROOF_BEAM,
+    hedge: bool = False,
+) -> VerificationResult:
+    """
+    Prove a Hoare triple with the loop scaffold, racing both polarities when `multipolarity`, or hedging with the negative one when `hedge`.
+    """
+    if hedge:
+        return await _prove_hedged(
+            model, triple, proof_loop_budget=proof_loop_budget, proof_beam=proof_beam
+        )
     proof_expert_pos = LoopProofExpert.connect_and_run(
         model,
         triple,
         polarity=Polarity.POS,
         max_iterations=proof_loop_budget,
+        beam=proof_beam,
     )
     if multipolarity:
         proof_expert_neg = LoopProofExpert.connect_and_run(
@@ -97,6 +151,7 @@ async def _synthesize_and_prove_loop(
             triple,
             polarity=Polarity.NEG,
             max_iterations=proof_loop_budget,
+            beam=proof_beam,
         )
 
         done, pending = await asyncio.wait(
@@ -108,6 +163,8 @@ async def _synthesize_and_prove_loop(
         )
         for task in pending:
             task.cancel()
+        # wait for the losers to tell the server, so their lean processes are killed now
+        await asyncio.gather(*pending, return_exceptions=True)
         proof_expert = done.pop().result()
         if proof_expert.verification_result is None:
             raise ValueError(
@@ -123,6 +180,78 @@ async def _synthesize_and_prove_loop(
     return proof_expert.verification_result
 
 
+async def _prove_hedged(
+    model: str,
+    triple: HoareTriple,
+    *,
+    proof_loop_budget: int,
+    proof_beam: int = PROOF_BEAM,
+) -> VerificationResult:
+    """
+    Prove a Hoare triple in the positive polarity, starting the negative loop only once the positive one stalls, see `Hedge`.
+
+    A refutation abandons the program at once. A loop that gives up leaves the other to run on, with the rest of the budget.
+    """
+    hedge = Hedge.for_loop(proof_loop_budget)
+    experts = {
+        asyncio.create_task(
+            LoopProofExpert.connect_and_run(
+                model,
+                triple,
+                polarity=Polarity.POS,
+                max_iterations=proof_loop_budget,
+                beam=proof_beam,
+                hedge=hedge,
+            )
+        )
+    }
+    stall: asyncio.Task[None] | None = asyncio.create_task(hedge.stalled())
+    failures: list[Failure] = []
+    try:
+        while experts:
+            done, _ = await asyncio.wait(
+                experts | ({stall} if stall is not None else set()),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if stall in done:
+                stall = None
+                if hedge.remaining > 0:
+                    logs.info(
+                        f"{model}: HEDGE: positive loop stalled, starting the negative one with {hedge.remaining} iterations left to share"
+                    )
+                    experts.add(
+                        asyncio.create_task(
+                            LoopProofExpert.connect_and_run(
+                                model,
+                                triple,
+                                polarity=Polarity.NEG,
+                                max_iterations=proof_loop_budget,
+                                beam=proof_beam,
+                                hedge=hedge,
+                            )
+                        )
+                    )
+            for task in done & experts:
+                experts.discard(task)
+                result = task.result().verification_result
+                match result:
+                    case list():
+                        failures.extend(result)
+                    case VerificationSuccess():
+                        return result
+                    case None:
+                        raise ValueError(
+                            "Unreachable. `verification_result` is initialized to None but is always set to the right type in `.connect_and_run`"
+                        )
+    finally:
+        leftovers = experts | ({stall} if stall is not None else set())
+        for task in leftovers:
+            task.cancel()
+        # wait for the losers to tell the server, so their lean processes are killed now
+        await asyncio.gather(*leftovers, return_exceptions=True)
+    return failures
+
+
 async def _synthesize_and_prove_search(
     model: str,
     specification: Specification,
@@ -162,7 +291,8 @@ async def _synthesize_and_prove_search(
     )
     for task in pending:
         task.cancel()
-
+    # wait for the losers to tell the server, so their lean processes are killed now
+    await asyncio.gather(*pending, return_exceptions=True)
     proof_expert = done.pop().result()
     if proof_expert.verification_result is None:
         raise ValueError(
@@ -177,12 +307,28 @@ async def boundary_loop(
     *,
     proof_loop_budget: int = 10,
     attempt_budget: int = 5,
+    proof_beam: int = PROOF_BEAM,
+    pipeline_depth: int = PIPELINE_DEPTH,
+    hedge: bool = HEDGE,
 ) -> VerificationResult:
     """
     Run the boundary screener, the boundary's main entrypoint, with a loop scaffold for proof search.
 
     Return imp code to the caller (representing the outside world) if the proof is successful, allowing up to `attempt_budget` attempts.
+    With `proof_beam` > 1, each proof iteration samples and checks that many candidates at once.
+    With `pipeline_depth` > 0, the next program is synthesized while up to that many are proved, see `_boundary_loop_pipelined`.
+    With `hedge`, a program whose proof stalls is also attacked in the negative polarity, see `_prove_hedged`.
     """
+    if pipeline_depth > 0:
+        return await _boundary_loop_pipelined(
+            model,
+            specification,
+            proof_loop_budget=proof_loop_budget,
+            attempt_budget=attempt_budget,
+            proof_beam=proof_beam,
+            pipeline_depth=pipeline_depth,
+            hedge=hedge,
+        )
     msg_prefix = f"{model}:{specification.name if specification.name is not None else 'user_spec'}-"
     failed_attempts = []
     for attempt in range(attempt_budget):
@@ -194,6 +340,8 @@ async def boundary_loop(
             proof_loop_budget=proof_loop_budget,
             failed_attempts=failed_attempts,
             multipolarity=False,
+            proof_beam=proof_beam,
+            hedge=hedge,
         )
         match result:
             case list():
@@ -209,6 +357,89 @@ async def boundary_loop(
     return failed_attempts
 
 
+async def _boundary_loop_pipelined(
+    model: str,
+    specification: Specification,
+    *,
+    proof_loop_budget: int,
+    attempt_budget: int,
+    proof_beam: int,
+    pipeline_depth: int,
+    hedge: bool = False,
+) -> VerificationResult:
+    """
+    `boundary_loop`, pipelined: one program is always being synthesized ahead while up to `pipeline_depth` programs are proved at once.
+
+    Each synthesis is prompted with the failures known when it starts. The first positive proof cancels the synthesis and the other proofs.
+    Programs synthesized ahead cost tokens even when an earlier one turns out provable.
+    """
+    msg_prefix = f"{model}:{specification.name if specification.name is not None else 'user_spec'}-"
+    failed_attempts: list[Failure] = []
+    ready: list[HoareTriple] = []
+    synthesis: asyncio.Task[HoareTriple] | None = None
+    synthesis_error: ValueError | None = None
+    proofs: set[asyncio.Task[VerificationResult]] = set()
+    synthesized = 0
+    try:
+        while True:
+            while ready and len(proofs) < pipeline_depth:
+                proofs.add(
+                    asyncio.create_task(
+                        _prove_loop(
+                            model,
+                            ready.pop(0),
+                            proof_loop_budget=proof_loop_budget,
+                            multipolarity=False,
+                            proof_beam=proof_beam,
+                            hedge=hedge,
+                        )
+                    )
+                )
+            if (
+                synthesis is None
+                and synthesis_error is None
+                and not ready
+                and synthesized < attempt_budget
+            ):
+                synthesized += 1
+                msg = f"{msg_prefix} PIPELINED LOOP PROTOCOL: Synthesizing program {synthesized}/{attempt_budget} with {len(proofs)} being proved"
+                logs.info(msg)
+                synthesis = asyncio.create_task(
+                    _synthesize(model, specification, failed_attempts=failed_attempts)
+                )
+            running = proofs | ({synthesis} if synthesis is not None else set())
+            if not running:
+                break
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is synthesis:
+                    synthesis = None
+                    # out of imp attempts: stop synthesizing, but let the proofs in flight finish
+                    try:
+                        ready.append(task.result())
+                    except ValueError as exc:
+                        synthesis_error = exc
+                    continue
+                proofs.discard(task)
+                result = task.result()
+                match result:
+                    case list():
+                        failed_attempts.extend(result)
+                    case VerificationSuccess():
+                        if result.metadata.polarity == Polarity.POS:
+                            msg = f"{msg_prefix}: proof in the positive polarity found, code is safe!"
+                            logs.info(msg)
+                            return result
+    finally:
+        leftovers = proofs | ({synthesis} if synthesis is not None else set())
+        for task in leftovers:
+            task.cancel()
+        await asyncio.gather(*leftovers, return_exceptions=True)
+    if synthesis_error is not None:
+        raise synthesis_error
+    return failed_attempts
+
+
 async def boundary_search(
     model: str,
     specification: Specification,
@@ -250,6 +481,183 @@ async def boundary_search(
     return failed_attempts
 
 
+def portfolio(model: str, extra_models: list[str] | None = None) -> list[Strategy]:
+    """
+    The loop scaffold with `model` and each of `extra_models`, and the tree search.
+
+    The tree search picks tactics from a fixed list, so it only enters once whatever the models.
+    """
+    models = [model, *(m for m in extra_models or [] if m != model)]
+    return [Strategy(method=ProofMethod.LOOP, model=m) for m in models] + [
+        Strategy(method=ProofMethod.TREE_SEARCH_BASIC, model=model)
+    ]
+
+
+async def _prove_strategy(
+    strategy: Strategy,
+    triple: HoareTriple,
+    *,
+    proof_loop_budget: int,
+    proof_search_max_steps: int,
+    proof_search_max_trials_per_goal: int,
+    proof_beam: int,
+    timeout: float,
+) -> VerificationResult:
+    """
+    Prove a Hoare triple in the positive polarity with one strategy, within its own iteration or step budget and `timeout` seconds.
+    """
+    try:
+        async with asyncio.timeout(timeout):
+            match strategy.method:
+                case ProofMethod.LOOP:
+                    return await _prove_loop(
+                        strategy.model,
+                        triple,
+                        proof_loop_budget=proof_loop_budget,
+                        multipolarity=False,
+                        proof_beam=proof_beam,
+                    )
+                case ProofMethod.TREE_SEARCH_BASIC:
+                    proof_expert = await SearchProofExpert.connect_and_run(
+                        strategy.model,
+                        triple,
+                        Polarity.POS,
+                        max_steps=proof_search_max_steps,
+                        max_trials_per_goal=proof_search_max_trials_per_goal,
+                    )
+                    if proof_expert.verification_result is None:
+                        raise ValueError(
+                            "Unreachable. `verification_result` is initialized to None but is always set to the right type in `.connect_and_run`"
+                        )
+                    return proof_expert.verification_result
+                case ProofMethod.PORTFOLIO:
+                    raise ValueError("A portfolio can't enter itself.")
+    except TimeoutError:
+        return [
+            VerificationFailure(
+                triple=triple,
+                proof="",
+                error_message=f"{strategy} ran out of its {timeout:g}s",
+                audit_trail=Path.cwd(),
+                metadata=ExpertMetadata(model=strategy.model, polarity=Polarity.POS),
+            )
+        ]
+
+
+async def _prove_portfolio(
+    strategies: list[Strategy],
+    triple: HoareTriple,
+    *,
+    proof_loop_budget: int,
+    proof_search_max_steps: int,
+    proof_search_max_trials_per_goal: int,
+    proof_beam: int,
+    timeout: float = PORTFOLIO_TIMEOUT_SECONDS,
+) -> VerificationResult:
+    """
+    Race `strategies` on one Hoare triple. The first positive proof wins and the others are cancelled.
+
+    The winner's metadata records its strategy and how long every strategy ran, up to its result or its cancellation.
+    A strategy that crashes is logged and drops out of the race.
+    """
+    start = time.monotonic()
+    tasks = {
+        asyncio.create_task(
+            _prove_strategy(
+                strategy,
+                triple,
+                proof_loop_budget=proof_loop_budget,
+                proof_search_max_steps=proof_search_max_steps,
+                proof_search_max_trials_per_goal=proof_search_max_trials_per_goal,
+                proof_beam=proof_beam,
+                timeout=timeout,
+            )
+        ): strategy
+        for strategy in strategies
+    }
+    seconds: dict[str, float] = {}
+    failures: list[Failure] = []
+    winner: VerificationSuccess | None = None
+    pending = set(tasks)
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                strategy = tasks[task]
+                seconds[str(strategy)] = time.monotonic() - start
+                try:
+                    result = task.result()
+                except Exception as exc:
+                    logs.warning(f"PORTFOLIO: {strategy} crashed: {exc!r}")
+                    continue
+                match result:
+                    case list():
+                        failures.extend(result)
+                    case VerificationSuccess():
+                        if winner is None and result.metadata.polarity == Polarity.POS:
+                            winner = result
+                            winner.metadata.strategy = str(strategy)
+    finally:
+        for task in pending:
+            task.cancel()
+        # wait for the losers to tell the server, so their lean processes are killed now
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in pending:
+            seconds[str(tasks[task])] = time.monotonic() - start
+    logs.info(
+        "PORTFOLIO: "
+        + ", ".join(f"{strategy} ran {secs:.1f}s" for strategy, secs in seconds.items())
+    )
+    if winner is None:
+        return failures
+    winner.metadata.strategy_seconds = seconds
+    return winner
+
+
+async def boundary_portfolio(
+    model: str,
+    specification: Specification,
+    *,
+    strategies: list[Strategy],
+    attempt_budget: int = 5,
+    proof_loop_budget: int = 10,
+    proof_search_max_steps: int = 100,
+    proof_search_max_trials_per_goal: int = 5,
+    proof_beam: int = PROOF_BEAM,
+) -> VerificationResult:
+    """
+    Run the boundary screener, racing a portfolio of proof strategies on each program `model` synthesizes.
+
+    Every strategy gets the full iteration or step budget and `FCP_PORTFOLIO_TIMEOUT_SECONDS`, so a cheap one can win an easy triple early while the expensive ones keep the hard triples covered.
+    """
+    msg_prefix = f"{model}:{specification.name if specification.name is not None else 'user_spec'}-"
+    failed_attempts = []
+    for attempt in range(attempt_budget):
+        msg = f"{msg_prefix} PORTFOLIO PROTOCOL: Attempt to find program provable at specification {specification.name}: {attempt + 1}/{attempt_budget}"
+        logs.info(msg)
+        triple = await _synthesize(
+            model, specification, failed_attempts=failed_attempts
+        )
+        result = await _prove_portfolio(
+            strategies,
+            triple,
+            proof_loop_budget=proof_loop_budget,
+            proof_search_max_steps=proof_search_max_steps,
+            proof_search_max_trials_per_goal=proof_search_max_trials_per_goal,
+            proof_beam=proof_beam,
+        )
+        match result:
+            case list():
+                failed_attempts.extend(result)
+            case VerificationSuccess():
+                msg = f"{msg_prefix}: proof in the positive polarity found by {result.metadata.strategy}, code is safe!"
+                logs.info(msg)
+                return result
+    return failed_attempts
+
+
 async def boundary(
     model: str,
     specification: Specification,
@@ -259,12 +667,17 @@ async def boundary(
     proof_loop_budget: int = 10,
     proof_search_max_steps: int = 100,
     proof_search_max_trials_per_goal: int = 5,
+    proof_beam: int = PROOF_BEAM,
+    pipeline_depth: int = PIPELINE_DEPTH,
+    hedge: bool = HEDGE,
+    portfolio_models: list[str] | None = None,
 ) -> VerificationResult:
     """
     Run the boundary screener, the boundary's main entrypoint.
 
     Return imp code to the caller (representing the outside world) if the proof is successful, allowing up to `attempt_budget` attempts.
     Returns `None` if `attempt_budget` imp programs fail.
+    With `ProofMethod.PORTFOLIO`, the proof methods race each other, and the loop also races with each of `portfolio_models`.
     """
     match proof_method:
         case ProofMethod.LOOP:
@@ -273,6 +686,9 @@ async def boundary(
                 specification,
                 proof_loop_budget=proof_loop_budget,
                 attempt_budget=attempt_budget,
+                proof_beam=proof_beam,
+                pipeline_depth=pipeline_depth,
+                hedge=hedge,
             )
         case ProofMethod.TREE_SEARCH_BASIC:
             return await boundary_search(
@@ -283,3 +699,14 @@ async def boundary(
                 max_trials_per_goal=proof_search_max_trials_per_goal,
                 verbose=True,
             )
+        case ProofMethod.PORTFOLIO:
+            return await boundary_portfolio(
+                model,
+                specification,
+                strategies=portfolio(model, portfolio_models),
+                attempt_budget=attempt_budget,
+                proof_loop_budget=proof_loop_budget,
+                proof_search_max_steps=proof_search_max_steps,
+                proof_search_max_trials_per_goal=proof_search_max_trials_per_goal,
+                proof_beam=proof_beam,
+            )
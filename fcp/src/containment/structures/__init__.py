@@ -3,7 +3,8 @@ from pathlib import Path
 from subprocess import CompletedProcess
 from typing import Literal, Self, Sequence
 from containment.structures.basic import Structure
-from containment.structures.enums import Polarity
+from containment.structures.enums import Polarity, ProofMethod
+from containment.structures.imp import Counterexample
 
 type Language = Literal["imp", "loop/proof", "proof"]  # TODO: clean up
 
@@ -55,12 +56,27 @@ class LLM(Structure):
         return self.litellm_id
 
 
+class StreamMetrics(Structure):
+    """Latencies of one streamed completion, in seconds from the request."""
+
+    time_to_first_token: float | None
+    time_to_tag: float | None  # None when the closing tag never arrived
+    seconds: float
+
+
 class ExpertMetadata(Structure):
     model: str
     polarity: Polarity
     iteration: int = 0
     success: bool = False
     tokens_spent: int = 0
+    cached_input_tokens: int = 0
+    uncached_input_tokens: int = 0
+    time_to_first_token: float | None = None
+    time_to_tag: float | None = None
+    prompt_tokens: list[int] = []  # per iteration
+    strategy: str | None = None  # the portfolio strategy that produced the result
+    strategy_seconds: dict[str, float] = {}  # how long each portfolio strategy ran
 
     def incr(self) -> None:
         self.iteration += 1
@@ -74,6 +90,34 @@ class ExpertMetadata(Structure):
     def set_tokens_spent(self, tokens: int) -> None:
         self.tokens_spent = tokens
 
+    def set_input_tokens(self, cached: int, uncached: int) -> None:
+        """Prompt tokens read from the provider's prompt cache, and those processed afresh."""
+        self.cached_input_tokens = cached
+        self.uncached_input_tokens = uncached
+
+    def set_stream_metrics(self, metrics: list[StreamMetrics]) -> None:
+        """Mean time to first token and to the closing tag over the expert's streamed completions."""
+
+        def mean(values: list[float | None]) -> float | None:
+            present = [value for value in values if value is not None]
+            return sum(present) / len(present) if present else None
+
+        self.time_to_first_token = mean([m.time_to_first_token for m in metrics])
+        self.time_to_tag = mean([m.time_to_tag for m in metrics])
+
+    def set_prompt_tokens(self, tokens: list[int]) -> None:
+        self.prompt_tokens = list(tokens)
+
+
+class Strategy(Structure):
+    """One entrant of a proof portfolio: a proof method driven by a model."""
+
+    method: ProofMethod
+    model: str
+
+    def __str__(self) -> str:
+        return f"{self.method.value}:{self.model}"
+
 
 class VerificationSuccess(Structure):
     triple: HoareTriple
@@ -100,6 +144,9 @@ class ImpFailure(Structure):
     metadata: ExpertMetadata
     failed_attempts: list[VerificationFailure | Self] | None = None
     error_message: str | None = None
+    # found without lean, see `containment.interpreter` and `containment.parsing.imp`
+    counterexample: Counterexample | None = None
+    syntax_error: str | None = None
 
     @property
     def failure_str(self) -> str:
@@ -115,6 +162,7 @@ class LakeResponse(Structure):
     exit_code: int
     stdout: str
     stderr: str
+    timed_out: bool = False
 
     @classmethod
     def from_subprocess_result(
@@ -160,6 +208,75 @@ class LakeResponse(Structure):
         return self
 
 
+class Diagnostic(Structure):
+    """A message lean reported while elaborating, with a 1-indexed line and 0-indexed column."""
+
+    severity: Literal["error", "warning", "information"]
+    line: int
+    column: int
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.line}:{self.column}: {self.severity}: {self.message}"
+
+
+class BatchCandidate(Structure):
+    """One proof attempt of a batch, rendered as its own theorem."""
+
+    triple: HoareTriple
+    proof: str | None
+    polarity: Polarity = Polarity.POS
+
+
+class TheoremCheck(Structure):
+    """The outcome of one theorem in a batch."""
+
+    name: str
+    success: bool
+    has_sorry: bool
+    errors: list[str]
+
+
+class ElaborationReport(Structure):
+    """Machine-readable outcome of elaborating a lean file: every diagnostic, and a verdict per theorem."""
+
+    exit_code: int
+    diagnostics: list[Diagnostic]
+    theorems: list[TheoremCheck]
+    # `Check.lean`'s term check found `my_hoare_triple`, and no sorry in its term.
+    term_proven: bool = False
+
+    @property
+    def success(self) -> bool:
+        """Lean accepted the file, every theorem in it is proven without sorry, and so the term check says."""
+        return (
+            self.exit_code == 0
+            and self.term_proven
+            and bool(self.theorems)
+            and all(theorem.success for theorem in self.theorems)
+        )
+
+    @property
+    def has_sorry(self) -> bool:
+        return any(theorem.has_sorry for theorem in self.theorems)
+
+    @property
+    def feedback(self) -> str:
+        """The errors, sorry warnings and sorry canary, one per line, for the next prompt."""
+        return "\n".join(
+            str(diagnostic)
+            for diagnostic in self.diagnostics
+            if diagnostic.severity == "error" or "sorry" in diagnostic.message.lower()
+        )
+
+
+class ServerWorkspace(Structure):
+    """A workspace the MCP server leased to a client. Tools find it by `id`, and `path` is only reported for the audit trail."""
+
+    id: str
+    path: Path
+
+
 class CheckerBase(Structure):
     cwd: Path
 
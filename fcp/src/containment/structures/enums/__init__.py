@@ -13,3 +13,30 @@ class ProofMethod(str, Enum):
 
     LOOP = "loop"
     TREE_SEARCH_BASIC = "tree_search_basic"
+    PORTFOLIO = "portfolio"  # race the other methods, and optionally several models
+
+
+class CloneMode(str, Enum):
+    """How `temp_lakeproj_init` materializes a copy of the lake project."""
+
+    COPY = "copy"
+    SYMLINK = "symlink"
+    HARDLINK = "hardlink"
+    REFLINK = "reflink"
+
+
+class CompletionCacheMode(str, Enum):
+    """How `mk_complete` uses the on-disk completion cache."""
+
+    LIVE = "live"  # always call the model, never touch the cache
+    RECORD = "record"  # always call the model, and store what it said
+    REPLAY = "replay"  # only answer from the cache, failing on a miss
+    READ_THROUGH = "read-through"  # answer from the cache, calling the model on a miss
+
+
+class MCPTransport(str, Enum):
+    """How MCP clients reach the server in `containment.mcp.server`."""
+
+    STDIO = "stdio"  # a `mcp-server` subprocess per connection
+    MEMORY = "memory"  # the server runs in the client's event loop over memory streams
+    HTTP = "http"  # a shared server at `FCP_MCP_URL`, serving with `FCP_MCP_SERVE=streamable-http`
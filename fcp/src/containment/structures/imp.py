@@ -0,0 +1,108 @@
+"""The abstract syntax of imp programs and of the `astn` assertions around them, mirroring `imp/Imp/Expr`, `imp/Imp/Stmt` and `imp/Imp/Hoare/Syntax.lean`."""
+
+from typing import Literal
+from containment.structures.basic import Structure
+
+type UnaryOp = Literal["-", "!"]
+type BinaryOp = Literal["+", "-", "*", "/", "&&", "||", "<", "≤", "≥", ">", "=="]
+type Relation = Literal["=", "!=", "<", ">", "<=", ">="]
+type Connective = Literal["<^>", "<>", "->>", "<<->>"]
+
+
+class Const(Structure):
+    value: int
+
+
+class Var(Structure):
+    name: str
+
+
+class Meta(Structure):
+    """A lean identifier escaped into imp or an assertion with `~`, e.g. a metavariable of the specification."""
+
+    name: str
+
+
+class Escape(Structure):
+    """Any other lean escaped with `~`, which only lean can make sense of."""
+
+    term: str
+
+
+class Unary(Structure):
+    op: UnaryOp
+    operand: "Expr"
+
+
+class Binary(Structure):
+    op: BinaryOp
+    left: "Expr"
+    right: "Expr"
+
+
+Expr = Const | Var | Meta | Escape | Unary | Binary
+
+
+class Skip(Structure):
+    pass
+
+
+class Assign(Structure):
+    name: str
+    value: Expr
+
+
+class Seq(Structure):
+    statements: list["Stmt"]
+
+
+class If(Structure):
+    condition: Expr
+    then: Seq
+    orelse: Seq
+
+
+class While(Structure):
+    condition: Expr
+    body: Seq
+
+
+Stmt = Skip | Assign | Seq | If | While | Escape
+
+
+class Comparison(Structure):
+    op: Relation
+    left: Expr
+    right: Expr
+
+
+class Connect(Structure):
+    op: Connective
+    left: "Assertion"
+    right: "Assertion"
+
+
+class Negation(Structure):
+    operand: "Assertion"
+
+
+Assertion = Comparison | Connect | Negation
+
+for _node in [Unary, Binary, Seq, If, While, Connect, Negation]:
+    _node.model_rebuild()
+
+
+class Counterexample(Structure):
+    """A run of a program from a state satisfying the precondition to one violating the postcondition."""
+
+    metavariables: dict[str, int]
+    before: dict[str, int]
+    after: dict[str, int]
+
+    @property
+    def feedback(self) -> str:
+        def show(values: dict[str, int]) -> str:
+            return ", ".join(f"{name} = {value}" for name, value in values.items())
+
+        given = f"with {show(self.metavariables)}, " if self.metavariables else ""
+        return f"Counterexample: {given}the program runs from {show(self.before)} to {show(self.after)}, where the postcondition is false."
@@ -5,3 +5,5 @@ class MCPClientBase:
 
     def __init__(self) -> None:
         self.conversation = []
+        self.prompt_renderer = None
+        self.remote_workspaces = False
@@ -1,8 +1,13 @@
+import os
 import pytest
 from pathlib import Path
 import tomllib
-from containment.structures import Specification, HoareTriple
-from containment.fsio.tools import temp_lakeproj_init
+
+# Set before containment is imported, and inherited by the servers the tests spawn, so tests never read or write the shared typecheck cache.
+os.environ["FCP_TYPECHECK_CACHE"] = "0"
+
+from containment.structures import Specification, HoareTriple  # noqa: E402
+from containment.fsio.tools import temp_lakeproj_init  # noqa: E402
 
 # Test data
 SAMPLE_PRECONDITION = "x > 0"
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Iterator
+from litellm import acompletion
+from containment.netio.completions import (
+    CompletionCache,
+    CompletionCacheMiss,
+    input_token_split,
+    mk_complete,
+)
+from containment.structures.enums import CompletionCacheMode
+
+MODEL = "anthropic/claude-sonnet-4-20250514"
+MESSAGES = [{"role": "user", "content": "prove it"}]
+
+
+def _complete(cache: CompletionCache, mock_response: str):
+    return mk_complete(MODEL, "system", cache=cache, mock_response=mock_response)
+
+
+@pytest.mark.asyncio
+async def test_record_then_replay(tmp_path: Path):
+    recorder = CompletionCache(tmp_path, CompletionCacheMode.RECORD)
+    first = await _complete(recorder, "<proof>first</proof>")(MESSAGES)
+    second = await _complete(recorder, "<proof>second</proof>")(MESSAGES)
+    assert first["choices"][0].message.content == "<proof>first</proof>"
+    assert second["choices"][0].message.content == "<proof>second</proof>"
+
+    replayer = CompletionCache(tmp_path, CompletionCacheMode.REPLAY)
+    complete = _complete(replayer, "<proof>live</proof>")
+    replayed = [await complete(MESSAGES) for _ in range(3)]
+    assert [completion["choices"][0].message.content for completion in replayed] == [
+        "<proof>first</proof>",
+        "<proof>second</proof>",
+        "<proof>second</proof>",
+    ]
+    assert replayed[0]["usage"]["total_tokens"] == first["usage"]["total_tokens"]
+    assert replayer.hits == 3
+
+
+@pytest.mark.asyncio
+async def test_record_concurrent(tmp_path: Path):
+    """Identical requests in flight together are all recorded, in the order they were made, whichever finishes first."""
+    recorder = CompletionCache(tmp_path, CompletionCacheMode.RECORD)
+
+    def live(content: str, delay: float):
+        async def call():
+            await asyncio.sleep(delay)
+            return await acompletion(
+                model=MODEL, messages=MESSAGES, mock_response=content
+            )
+
+        return call
+
+    await asyncio.gather(
+        *(
+            recorder.complete(MODEL, MESSAGES, live(f"<proof>{idx}</proof>", delay))
+            for idx, delay in enumerate([0.1, 0.05, 0.0])
+        )
+    )
+    replayer = CompletionCache(tmp_path, CompletionCacheMode.REPLAY)
+    replayed = [await replayer.complete(MODEL, MESSAGES, live("", 0)) for _ in range(3)]
+    assert [completion.choices[0].message.content for completion in replayed] == [
+        "<proof>0</proof>",
+        "<proof>1</proof>",
+        "<proof>2</proof>",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_replay_miss(tmp_path: Path):
+    complete = _complete(
+        CompletionCache(tmp_path, CompletionCacheMode.REPLAY), "<proof>live</proof>"
+    )
+    with pytest.raises(CompletionCacheMiss):
+        await complete(MESSAGES)
+
+
+@pytest.mark.asyncio
+async def test_read_through(tmp_path: Path):
+    cache = CompletionCache(tmp_path, CompletionCacheMode.READ_THROUGH)
+    await _complete(cache, "<proof>live</proof>")(MESSAGES)
+    assert cache.misses == 1
+    reopened = CompletionCache(tmp_path, CompletionCacheMode.READ_THROUGH)
+    completion = await _complete(reopened, "<proof>other</proof>")(MESSAGES)
+    assert completion["choices"][0].message.content == "<proof>live</proof>"
+    assert reopened.hits == 1
+
+
+class _StubAnthropic(BaseHTTPRequestHandler):
+    """Answers `/v1/messages` as if 90 of the prompt tokens were read from the prompt cache."""
+
+    requests: list[dict] = []
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        self.requests.append(body)
+        message = {
+            "id": "msg_stub",
+            "type": "message",
+            "role": "assistant",
+            "model": body["model"],
+            "content": [{"type": "text", "text": "<proof>aesop</proof>"}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": 10,
+                "output_tokens": 5,
+                "cache_read_input_tokens": 90,
+                "cache_creation_input_tokens": 0,
+            },
+        }
+        data = json.dumps(message).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args) -> None:
+        return None
+
+
+@pytest.fixture
+def stub_anthropic() -> Iterator[str]:
+    server = HTTPServer(("127.0.0.1", 0), _StubAnthropic)
+    _StubAnthropic.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_prompt_caching(stub_anthropic: str, tmp_path: Path):
+    complete = mk_complete(
+        MODEL,
+        "system",
+        cache=CompletionCache(tmp_path, CompletionCacheMode.LIVE),
+        cache_prompt=True,
+        api_base=stub_anthropic,
+        api_key="stub",
+    )
+    conversation = MESSAGES + [
+        {"role": "assistant", "content": "<proof>simp</proof>"},
+        {"role": "user", "content": [{"type": "text", "text": "try again"}]},
+    ]
+    completion = await complete(conversation)
+    request = _StubAnthropic.requests[-1]
+    assert request["system"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert request["messages"][-1]["content"][-1]["cache_control"] == {
+        "type": "ephemeral"
+    }
+    assert "cache_control" not in json.dumps(request["messages"][:-1])
+    assert "cache_control" not in json.dumps(conversation)  # not mutated
+    assert input_token_split(completion["usage"]) == (90, 10)
+
+
+@pytest.mark.asyncio
+async def test_stream_stops_at_tag(tmp_path: Path):
+    metrics = []
+    complete = mk_complete(
+        MODEL,
+        "system",
+        cache=CompletionCache(tmp_path, CompletionCacheMode.LIVE),
+        stop_tag="proof",
+        on_metrics=metrics.append,
+        mock_response="<proof>aesop</proof> This proof works because" + " blah" * 100,
+    )
+    completion = await complete(MESSAGES)
+    content = completion["choices"][0].message.content
+    assert "</proof>" in content
+    assert "blah" not in content
+    assert completion["usage"]["total_tokens"] > 0
+    assert metrics[0].time_to_tag is not None
+    assert metrics[0].time_to_first_token <= metrics[0].time_to_tag
@@ -0,0 +1,116 @@
+import pytest
+from containment.interpreter import Falsifier, falsify
+from containment.parsing.imp import ImpSyntaxError, parse_assertion, parse_program
+from containment.structures import HoareTriple, Specification
+from containment.structures.imp import (
+    Assign,
+    Binary,
+    Comparison,
+    Connect,
+    Const,
+    Meta,
+    Negation,
+    Unary,
+    Var,
+)
+
+
+def _triple(
+    precondition: str, command: str, postcondition: str, metavariables: str = ""
+) -> HoareTriple:
+    return HoareTriple(
+        specification=Specification(
+            precondition=precondition,
+            postcondition=postcondition,
+            metavariables=metavariables,
+        ),
+        command=command,
+    )
+
+
+def test_parse_precedence():
+    (assign,) = parse_program("imp { x := 1 + 2 * -y - z; }").statements
+    assert assign == Assign(
+        name="x",
+        value=Binary(
+            op="-",
+            left=Binary(
+                op="+",
+                left=Const(value=1),
+                right=Binary(
+                    op="*",
+                    left=Const(value=2),
+                    right=Unary(op="-", operand=Var(name="y")),
+                ),
+            ),
+            right=Var(name="z"),
+        ),
+    )
+
+
+def test_parse_assertion_connectives_bind_right():
+    assert parse_assertion("<!> x = ~n <^> y < ~(m + 1)") == Negation(
+        operand=Connect(
+            op="<^>",
+            left=Comparison(op="=", left=Var(name="x"), right=Meta(name="n")),
+            right=Comparison(
+                op="<",
+                left=Var(name="y"),
+                right=Binary(op="+", left=Meta(name="m"), right=Const(value=1)),
+            ),
+        )
+    )
+
+
+def test_parse_error_position():
+    with pytest.raises(ImpSyntaxError) as info:
+        parse_program("imp {\n  x := 1;\n  if (x < 2) { skip; }\n}")
+    assert (info.value.line, info.value.column) == (4, 1)
+    assert "`else`" in info.value.message
+
+
+def test_parse_error_feedback():
+    with pytest.raises(ImpSyntaxError) as info:
+        parse_program("imp {\n  x = 1;\n}")
+    feedback = info.value.feedback
+    assert "  x = 1;\n    ^" in feedback
+    assert "Hint:" in feedback and ":=" in feedback
+
+
+def test_falsify_finds_counterexample():
+    counterexample = falsify(_triple("x = 0", "imp { x := x + 1; }", "x > 8"))
+    assert counterexample is not None
+    assert counterexample.before["x"] == 0
+    assert counterexample.after["x"] == 1
+    swap = "imp { x := y; y := x; }"
+    assert falsify(_triple("x = ~n <^> y = ~m", swap, "x = ~m <^> y = ~n", "n m"))
+
+
+@pytest.mark.parametrize(
+    "triple",
+    [
+        _triple("x = 0", "imp { while (x < 9) { x := x + 1; } }", "x > 8"),
+        _triple(
+            "x = ~n <^> y = ~m",
+            "imp { t := x; x := y; y := t; }",
+            "x = ~m <^> y = ~n",
+            "n m",
+        ),
+        # partial correctness: no run, no counterexample
+        _triple("x > 0", "imp { while (1) { skip; } }", "x < 0"),
+        _triple("x > 0", "imp { x := x / 0; }", "x < 0"),
+        # lean's `Int` division leaves a nonnegative remainder: -7 / 2 = -4 and -7 / -2 = 4
+        _triple(
+            "x = ~(0 - 7)", "imp { y := x / 2; x := x / -2; }", "y = ~(0 - 4) <^> x = 4"
+        ),
+    ],
+)
+def test_falsify_keeps_valid_triples(triple: HoareTriple):
+    assert falsify(triple) is None
+
+
+def test_falsify_leaves_lean_escapes_to_lean():
+    triple = _triple("x = ~n", "imp { x := ~(n / 0); }", "x = 1", "n")
+    with pytest.raises(ValueError, match="opaque"):
+        Falsifier(triple)
+    assert falsify(triple) is None
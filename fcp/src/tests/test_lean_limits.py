@@ -0,0 +1,221 @@
+import asyncio
+import os
+import pytest
+from pathlib import Path
+from types import SimpleNamespace
+from containment.fsio import tools, workers
+from containment.mcp import server
+from containment.mcp.clients import basic
+from containment.mcp.clients.basic import MCPClient
+from containment.mcp.clients.pool import ServerConnection
+from containment.fsio.lake import Checker
+from containment.parsing.lean import SORRY_WARNING, theorem_checks
+from containment.structures import BatchCandidate, Diagnostic, HoareTriple
+from containment.structures.enums import MCPTransport
+
+
+def _alive(pid: int) -> bool:
+    """Whether the process runs, counting zombies awaiting their new parent as dead."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    stat = Path(f"/proc/{pid}/stat")
+    return not stat.exists() or stat.read_text().split(") ")[-1][0] != "Z"
+
+
+@pytest.mark.asyncio
+async def test_timeout(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(tools, "LEAN_TIMEOUT_SECONDS", 0.5)
+    response = await tools._lake_async(["sleep", "30"], tmp_path)
+    assert response.timed_out
+    assert response.exit_code == tools.TIMEOUT_EXIT_CODE
+    assert not tools._live_process_groups
+
+
+@pytest.mark.asyncio
+async def test_cancel_kills_grandchildren(tmp_path: Path):
+    """Cancelling a check kills the processes lake spawned, not only lake."""
+    pidfile = tmp_path / "pid"
+    task = asyncio.create_task(
+        tools._lake_async(
+            ["sh", "-c", f"sleep 30 & echo $! > {pidfile}; wait"], tmp_path
+        )
+    )
+    while not pidfile.exists() or not pidfile.read_text().strip():
+        await asyncio.sleep(0.05)
+    grandchild = int(pidfile.read_text())
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0.2)
+    assert not _alive(grandchild)
+    assert not tools._live_process_groups
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "lake", [["sh", "-c", "exit 1"], ["sh", "-c", "kill -9 $$"], ["sleep", "30"]]
+)
+async def test_batch_fails_without_verdict(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    sample_hoare_triple: HoareTriple,
+    lake: list[str],
+):
+    """A lake that prints nothing, is killed or times out fails every candidate, proof or not."""
+    monkeypatch.setattr(tools, "ELABORATE_CMD", lake)
+    monkeypatch.setattr(tools, "LEAN_TIMEOUT_SECONDS", 0.5)
+    (tmp_path / "Artifacts").mkdir()
+    checks = await Checker(cwd=tmp_path).run_batch(
+        [
+            BatchCandidate(triple=sample_hoare_triple, proof="omega"),
+            BatchCandidate(triple=sample_hoare_triple, proof="<NOT A PROOF>"),
+        ]
+    )
+    assert len(checks) == 2
+    assert not any(check.success for check in checks)
+    assert all(check.errors for check in checks)
+
+
+@pytest.mark.asyncio
+async def test_elaboration_runs_term_check(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    """Elaboration reads the code and then `Check.lean`'s term check from stdin, while the workspace keeps the code alone."""
+    monkeypatch.setattr(tools, "ELABORATE_STDIN_CMD", ["cat"])
+    (tmp_path / "Artifacts").mkdir()
+    (tmp_path / "Check.lean").write_text(
+        "import Artifacts\n\n#eval checkSorryInTerm `my_hoare_triple\n"
+    )
+    checker = Checker(cwd=tmp_path)
+    response = await checker.run_code_elaborate(
+        "theorem my_hoare_triple : True := trivial"
+    )
+    assert response.stdout == (
+        "theorem my_hoare_triple : True := trivial\n\n#eval checkSorryInTerm `my_hoare_triple"
+    )
+    assert checker.basic_path.read_text() == "theorem my_hoare_triple : True := trivial"
+
+
+def test_batch_spans_ignore_proof_text(
+    tmp_path: Path, sample_hoare_triple: HoareTriple
+):
+    """A proof that writes its own theorem lines can't move its diagnostics onto another candidate."""
+    (tmp_path / "Artifacts").mkdir()
+    lean_code, spans = Checker(cwd=tmp_path).write_batch(
+        [
+            BatchCandidate(
+                triple=sample_hoare_triple,
+                proof="omega\ntheorem my_hoare_triple_1 : True := by\n  sorry",
+            ),
+            BatchCandidate(triple=sample_hoare_triple, proof="omega"),
+        ]
+    )
+    lines = lean_code.splitlines()
+    fake = lines.index("theorem my_hoare_triple_1 : True := by") + 1
+    assert spans["my_hoare_triple_0"][0] < fake < spans["my_hoare_triple_0"][1]
+    assert lines[spans["my_hoare_triple_1"][0] - 1].startswith(
+        "theorem my_hoare_triple_1 :"
+    )
+    checks = theorem_checks(
+        spans,
+        [Diagnostic(severity="warning", line=fake, column=0, message=SORRY_WARNING)],
+    )
+    assert [check.success for check in checks] == [False, True]
+    assert checks[0].has_sorry
+
+
+class _ToolCaller(MCPClient):
+    async def run(self) -> None:
+        return None
+
+
+@pytest.mark.asyncio
+async def test_cancelled_tool_call_kills_lean(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    """Cancelling a `typecheck` call on the client kills the check on the server, after reporting its stages."""
+    pidfile = tmp_path / "pid"
+    monkeypatch.setattr(
+        tools, "CMD", ["sh", "-c", f"sleep 30 & echo $! > {pidfile}; wait"]
+    )
+    monkeypatch.setattr(server, "typecheck_cache", None)
+    monkeypatch.setattr(server, "lean_worker_pool", None)
+    stages = []
+
+    def collect_progress(tool: str):
+        async def on_progress(progress, total, message) -> None:
+            stages.append(message)
+
+        return on_progress
+
+    monkeypatch.setattr(basic, "_log_progress", collect_progress)
+    (tmp_path / "Artifacts").mkdir()
+    connection = await ServerConnection.open(transport=MCPTransport.MEMORY)
+    client = _ToolCaller()
+    client.session = connection.session
+    task = asyncio.create_task(
+        client._call_tool("typecheck", {"lean_code": "", "cwd": str(tmp_path)})
+    )
+    while not pidfile.exists() or not pidfile.read_text().strip():
+        await asyncio.sleep(0.05)
+    grandchild = int(pidfile.read_text())
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0.2)
+    assert not _alive(grandchild)
+    assert not tools._live_process_groups
+    assert stages == ["queued", "building"]
+    await connection.close()
+
+
+class _Worker:
+    def __init__(self, crash: bool) -> None:
+        self.crash = crash
+
+    async def check_compile_async(self, code: str) -> list:
+        if self.crash:
+            raise RuntimeError("worker died")
+        assert "#eval checkSorryInTerm" in code
+        return [SimpleNamespace(messages=[f'1:0: info: "{workers.PROVEN_OK}"'])]
+
+    def _close(self) -> None:
+        return None
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_keeps_slots(monkeypatch: pytest.MonkeyPatch):
+    """A worker that can't be respawned leaves an empty slot, which the next check fills, instead of shrinking the pool."""
+    spawns: list[bool] = [True, False]  # crashing worker, then a failed respawn
+
+    async def pantograph_init(cwd: Path) -> _Worker:
+        if not spawns:
+            return _Worker(crash=False)
+        if len(spawns) == 1:
+            spawns.pop()
+            raise RuntimeError("no lean toolchain")
+        return _Worker(crash=spawns.pop(0))
+
+    monkeypatch.setattr(workers, "pantograph_init", pantograph_init)
+    pool = workers.LeanWorkerPool(1)
+    failed = await pool.check("theorem t : True := trivial")
+    assert failed.exit_code == 1 and "worker died" in failed.stderr
+    response = await asyncio.wait_for(pool.check("theorem t : True := trivial"), 5)
+    assert response.exit_code == 0
+    assert workers.PROVEN_OK in response.stderr
+
+
+@pytest.mark.parametrize(
+    "messages, exit_code",
+    [
+        ([f'9:0: info: "{workers.PROVEN_OK}"'], 0),
+        (['9:0: info: "<HOARE_TRIPLE_TERM_HAS_SORRY>"'], 0),
+        (['9:0: info: "Bug: Term my_hoare_triple not found"'], 1),
+        (["3:2: error: unsolved goals", f'9:0: info: "{workers.PROVEN_OK}"'], 1),
+    ],
+)
+def test_worker_verdict_needs_term_check(messages: list[str], exit_code: int):
+    """Like `lake exe check`, the worker passes code only once the term check reports on it."""
+    assert workers.response_from_messages(messages).exit_code == exit_code
@@ -1,13 +1,36 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
 import pytest
+from contextlib import AsyncExitStack
 from pathlib import Path
+from mcp.client.stdio import StdioServerParameters
+from containment.mcp import server as mcp_server
 from containment.mcp.server import (
     get_proof_user_prompt,
     get_imp_user_prompt,
     run_lake_exe_check,
+    run_lake_batch_check,
+    run_lean_structured_check,
 )
 from containment.mcp.clients.experts.proof import SORRY_CANARY
-from containment.structures import Specification, HoareTriple, LakeResponse
+from containment.structures import (
+    Specification,
+    HoareTriple,
+    LakeResponse,
+    BatchCandidate,
+    ServerWorkspace,
+)
+from containment.structures.enums import MCPTransport, Polarity
 from containment.fsio.prompts import load_txt
+from containment.fsio.workers import LeanWorkerPool
+from containment.mcp.clients import pool as pool_module
+from containment.mcp.clients.pool import ServerConnection, SessionPool
 
 
 # TODO: use less fixtures... these strings can just be inlined.
@@ -50,13 +73,14 @@ def test_imp_user_prompt(
     assert sample_postcondition in prompt
 
 
-def test_typecheck_tool(temp_lakeproj: Path):
+@pytest.mark.asyncio
+async def test_typecheck_tool(temp_lakeproj: Path):
     """Test the typecheck tool functionality."""
     lean_code = """
     def main' : IO Unit := do
       IO.println "Hello, World!"
     """
-    response = run_lake_exe_check(lean_code, temp_lakeproj)
+    response = await run_lake_exe_check(lean_code, temp_lakeproj)
     assert isinstance(response, LakeResponse)
     assert hasattr(response, "exit_code")
     assert hasattr(response, "stdout")
@@ -67,7 +91,8 @@ def test_typecheck_tool(temp_lakeproj: Path):
     assert response.stderr
 
 
-def test_pos_sorry(sample_hoare_triple: HoareTriple, temp_lakeproj: Path):
+@pytest.mark.asyncio
+async def test_pos_sorry(sample_hoare_triple: HoareTriple, temp_lakeproj: Path):
     """Test lake tool on positive lean template with sorry filled in."""
     pos_sorry = load_txt(
         "loop/Positive.lean.template",
@@ -76,21 +101,24 @@ def test_pos_sorry(sample_hoare_triple: HoareTriple, temp_lakeproj: Path):
     )
     assert isinstance(pos_sorry, str)
     assert "sorry" in pos_sorry
-    response = run_lake_exe_check(pos_sorry, temp_lakeproj)
+    response = await run_lake_exe_check(pos_sorry, temp_lakeproj)
     assert isinstance(response, LakeResponse)
     assert response.exit_code == 0
     assert SORRY_CANARY in response.stderr
 
 
 @pytest.mark.parametrize("polarity", ["Positive", "Negative"])
-def test_fail(sample_hoare_triple: HoareTriple, polarity: str, temp_lakeproj: Path):
+@pytest.mark.asyncio
+async def test_fail(
+    sample_hoare_triple: HoareTriple, polarity: str, temp_lakeproj: Path
+):
     pos_fail = load_txt(
         f"loop/{polarity}.lean.template",
         proof="<NOT A PROOF>",
         **sample_hoare_triple.model_dump(),
     )
     assert isinstance(pos_fail, str)
-    response = run_lake_exe_check(pos_fail, temp_lakeproj)
+    response = await run_lake_exe_check(pos_fail, temp_lakeproj)
     assert isinstance(response, LakeResponse)
     assert response.exit_code == 1
     assert response.stderr
@@ -98,7 +126,8 @@ def test_fail(sample_hoare_triple: HoareTriple, polarity: str, temp_lakeproj: Pa
 
 
 @pytest.mark.parametrize("polarity", ["Positive", "Negative"])
-def test_experiments_sorry(
+@pytest.mark.asyncio
+async def test_experiments_sorry(
     experiment_data: dict, sample_command: str, polarity: str, temp_lakeproj: Path
 ):
     for sample in experiment_data["sample"]:
@@ -119,7 +148,7 @@ def test_experiments_sorry(
             f"loop/{polarity}.lean.template", proof="sorry", **hoare_triple.model_dump()
         )
         assert isinstance(sorry, str)
-        response = run_lake_exe_check(sorry, temp_lakeproj)
+        response = await run_lake_exe_check(sorry, temp_lakeproj)
         assert isinstance(response, LakeResponse)
         assert response.exit_code == 0
         assert SORRY_CANARY in response.stderr
@@ -127,7 +156,8 @@ def test_experiments_sorry(
 
 
 @pytest.mark.parametrize("polarity", ["Positive", "Negative"])
-def test_experiments_fail(
+@pytest.mark.asyncio
+async def test_experiments_fail(
     experiment_data: dict, sample_command: str, polarity: str, temp_lakeproj: Path
 ):
     for sample in experiment_data["sample"]:
@@ -151,7 +181,245 @@ def test_experiments_fail(
             **hoare_triple.model_dump(),
         )
         assert isinstance(fail, str)
-        response = run_lake_exe_check(fail, temp_lakeproj)
+        response = await run_lake_exe_check(fail, temp_lakeproj)
         assert isinstance(response, LakeResponse)
         assert response.exit_code == 1
         assert not response.stdout
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_sorry(sample_hoare_triple: HoareTriple):
+    """The persistent lean workers report the sorry canary like `lake exe check`."""
+    pool = LeanWorkerPool(1)
+    pos_sorry = load_txt(
+        "loop/Positive.lean.template",
+        proof="sorry",
+        **sample_hoare_triple.model_dump(),
+    )
+    response = await pool.check(pos_sorry)
+    await pool.close()
+    assert response.exit_code == 0
+    assert SORRY_CANARY in response.stderr
+
+
+@pytest.mark.asyncio
+async def test_batch(sample_hoare_triple: HoareTriple, temp_lakeproj: Path):
+    """Each candidate of a batch gets its own verdict."""
+    checks = await run_lake_batch_check(
+        [
+            BatchCandidate(triple=sample_hoare_triple, proof=None),
+            BatchCandidate(triple=sample_hoare_triple, proof="<NOT A PROOF>"),
+            BatchCandidate(
+                triple=sample_hoare_triple, proof=None, polarity=Polarity.NEG
+            ),
+        ],
+        str(temp_lakeproj),
+    )
+    assert [check.has_sorry for check in checks] == [True, False, True]
+    assert not any(check.success for check in checks)
+    assert checks[1].errors
+    assert not checks[0].errors
+
+
+@pytest.mark.asyncio
+async def test_structured_sorry(sample_hoare_triple: HoareTriple, temp_lakeproj: Path):
+    """Elaboration flags the sorry on `my_hoare_triple` without running the check executable."""
+    pos_sorry = load_txt(
+        "loop/Positive.lean.template",
+        proof="sorry",
+        **sample_hoare_triple.model_dump(),
+    )
+    report = await run_lean_structured_check(pos_sorry, str(temp_lakeproj))
+    assert report.exit_code == 0
+    assert not report.success
+    assert [theorem.name for theorem in report.theorems] == ["my_hoare_triple"]
+    assert report.has_sorry
+    assert "sorry" in report.feedback
+
+
+def _server_pids() -> list[int]:
+    """The `mcp-server` processes spawned by this test process."""
+    pids = []
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            ppid = int(stat.read_text().split(") ")[-1].split()[1])
+            cmdline = (stat.parent / "cmdline").read_bytes()
+        except (OSError, ValueError):
+            continue
+        if ppid == os.getpid() and b"mcp_server_run" in cmdline:
+            pids.append(int(stat.parent.name))
+    return pids
+
+
+@pytest.mark.asyncio
+async def test_session_pool_reconnects():
+    pool = SessionPool(
+        0,
+        max_size=1,
+        parameters=StdioServerParameters(
+            command=sys.executable,
+            args=["-c", "from containment import mcp_server_run; mcp_server_run()"],
+            env=dict(os.environ),
+        ),
+    )
+    async with pool.lease() as connection:
+        assert "typecheck" in [tool.name for tool in connection.tools]
+    async with pool.lease() as reused:
+        assert reused is connection
+    for pid in _server_pids():
+        os.kill(pid, signal.SIGKILL)
+    async with pool.lease() as replacement:
+        assert replacement is not connection
+        assert await replacement.healthy()
+    assert pool.reconnects == 1
+    await pool.close()
+    assert not _server_pids()
+
+
+@pytest.mark.asyncio
+async def test_memory_transport(
+    sample_precondition: str, sample_postcondition: str, sample_metavariables: str
+):
+    pool = SessionPool(0, max_size=1, transport=MCPTransport.MEMORY)
+    async with pool.lease() as connection:
+        assert connection.session is not None
+        prompt = await connection.session.get_prompt(
+            "imp_user_prompt",
+            {
+                "precondition": sample_precondition,
+                "postcondition": sample_postcondition,
+                "metavariables": sample_metavariables,
+                "failed_attempts": "",
+            },
+        )
+    assert sample_precondition in prompt.messages[0].content.text
+    assert not _server_pids()
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_nested_leases_share_the_connection():
+    """Experts spawned within a lease share its connection instead of waiting at `max_size` for their own."""
+    pool = SessionPool(0, max_size=1, transport=MCPTransport.MEMORY)
+
+    async def nested() -> ServerConnection:
+        async with pool.lease() as connection:
+            return connection
+
+    async with pool.lease() as connection:
+        children = await asyncio.wait_for(
+            asyncio.gather(nested(), asyncio.create_task(nested())), 5
+        )
+    assert children == [connection, connection]
+    async with pool.lease() as reused:
+        assert reused is connection
+    await pool.close()
+
+
+@pytest.mark.parametrize("stderr", ["", "error: unsolved goals"])
+@pytest.mark.asyncio
+async def test_local_prompts(sample_hoare_triple: HoareTriple, stderr: str):
+    """Prompts rendered client-side are exactly what the server returns."""
+    arguments = {
+        "hoare_proof_user_prompt": {
+            "precondition": sample_hoare_triple.specification.precondition,
+            "command": sample_hoare_triple.command,
+            "postcondition": sample_hoare_triple.specification.postcondition,
+            "metavariables": "",
+            "stderr": stderr,
+            "polarity": Polarity.NEG.value,
+        },
+        "imp_user_prompt": {
+            "precondition": sample_hoare_triple.specification.precondition,
+            "postcondition": sample_hoare_triple.specification.postcondition,
+            "metavariables": "",
+            "failed_attempts": stderr,
+        },
+    }
+    pool = SessionPool(0, max_size=1, transport=MCPTransport.MEMORY)
+    async with pool.lease() as connection:
+        assert connection.session is not None
+        assert connection.prompt_renderer is not None
+        for name, prompt_arguments in arguments.items():
+            served = await connection.session.get_prompt(name, prompt_arguments)
+            rendered = await connection.prompt_renderer.render(name, prompt_arguments)
+            assert rendered == [
+                message.content.model_dump() for message in served.messages
+            ]
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_http_workspaces(monkeypatch: pytest.MonkeyPatch):
+    """Several clients share one networked server, which only checks in workspaces it leased them."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "from containment import mcp_server_run; mcp_server_run()",
+        ],
+        env={
+            **os.environ,
+            "FCP_MCP_SERVE": "streamable-http",
+            "FASTMCP_PORT": str(port),
+        },
+        stderr=subprocess.DEVNULL,
+    )
+    monkeypatch.setattr(pool_module, "MCP_URL", f"http://127.0.0.1:{port}/mcp")
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port)).close()
+                break
+            except ConnectionRefusedError:
+                await asyncio.sleep(0.2)
+        connections = await asyncio.gather(
+            *(ServerConnection.open(transport=MCPTransport.HTTP) for _ in range(3))
+        )
+        workspaces = []
+        for connection in connections:
+            assert connection.session is not None
+            opened = await connection.session.call_tool("workspace-open", {})
+            workspaces.append(ServerWorkspace(**json.loads(opened.content[0].text)))  # type: ignore
+        assert len({workspace.id for workspace in workspaces}) == 3
+        session = connections[0].session
+        assert session is not None
+        refused = await session.call_tool(
+            "typecheck", {"lean_code": "", "cwd": str(workspaces[0].path)}
+        )
+        assert refused.isError
+        refused = await session.call_tool("typecheck-freshdir", {"lean_code": ""})
+        assert refused.isError
+        for connection, workspace in zip(connections, workspaces):
+            assert connection.session is not None
+            closed = await connection.session.call_tool(
+                "workspace-close", {"workspace": workspace.id}
+            )
+            assert closed.content[0].text == "true"  # type: ignore
+            await connection.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@pytest.mark.asyncio
+async def test_workspaces_expire(monkeypatch: pytest.MonkeyPatch):
+    """Workspaces of clients that went away are returned without anyone opening another."""
+    closed: list[str] = []
+    monkeypatch.setattr(mcp_server, "WORKSPACE_LEASE_SECONDS", 0.05)
+    monkeypatch.setattr(mcp_server, "WORKSPACE_EXPIRY_INTERVAL_SECONDS", 0.05)
+    monkeypatch.setattr(mcp_server, "_workspaces", {})
+    monkeypatch.setattr(mcp_server, "_expiry", None)
+    lease = AsyncExitStack()
+    lease.callback(closed.append, "abandoned")
+    workspace = ServerWorkspace(id="abandoned", path=Path("/nonexistent"))
+    mcp_server._workspaces["abandoned"] = (workspace, lease, time.monotonic())
+    mcp_server._sweep_workspaces()
+    await asyncio.sleep(0.3)
+    assert closed == ["abandoned"]
+    assert not mcp_server._workspaces
+    assert mcp_server._expiry is not None
+    mcp_server._expiry.cancel()
@@ -0,0 +1,235 @@
+import pytest
+from pathlib import Path
+from types import SimpleNamespace
+from litellm import acompletion
+from litellm import token_counter
+from containment.fsio import artifacts
+from containment.mcp.clients.experts.proof.hedge import Hedge
+from containment.mcp.clients.experts.proof.loop import ProofExpert, fit_conversation
+from containment.parsing.lean import compact_stderr
+from containment.structures import (
+    Diagnostic,
+    ElaborationReport,
+    HoareTriple,
+    LakeResponse,
+    Polarity,
+    TheoremCheck,
+)
+
+MODEL = "anthropic/claude-sonnet-4-20250514"
+PROVEN_OK = "<HOARE_TRIPLE_TERM_PROVEN_OK>"
+
+
+def _beam_expert(
+    triple: HoareTriple, proofs: list[str], checks: list[TheoremCheck], stderr: str
+) -> tuple[ProofExpert, list[tuple[str, dict]]]:
+    """A beam expert whose model answers with the proofs, and whose server reports the checks for the batch and the stderr for a single check."""
+    expert = ProofExpert(
+        MODEL, triple, Polarity.POS, beam=len(proofs), structured=False
+    )
+    expert.conversation = [{"role": "user", "content": "prove it"}]
+    answers = iter(proofs)
+    calls: list[tuple[str, dict]] = []
+
+    async def complete(conversation: list[dict]):
+        return await acompletion(
+            model=MODEL,
+            messages=conversation,
+            mock_response=f"<proof>{next(answers)}</proof>",
+        )
+
+    async def call_tool(name: str, arguments: dict):
+        calls.append((name, arguments))
+        if name == "typecheck-batch":
+            texts = [check.model_dump_json() for check in checks]
+        else:
+            texts = [LakeResponse(exit_code=0, stdout="", stderr=stderr).jsons]
+        return SimpleNamespace(content=[SimpleNamespace(text=text) for text in texts])
+
+    expert.complete = complete  # type: ignore[method-assign]
+    expert._call_tool = call_tool  # type: ignore[method-assign]
+    return expert, calls
+
+
+def _check(name: str, success: bool, errors: int = 0) -> TheoremCheck:
+    return TheoremCheck(
+        name=name,
+        success=success,
+        has_sorry=False,
+        errors=[f"1:0: error: {idx}" for idx in range(errors)],
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "stderr, proven", [(PROVEN_OK, True), ("<HOARE_TRIPLE_TERM_HAS_SORRY>", False)]
+)
+async def test_beam_rechecks_winner(
+    sample_hoare_triple: HoareTriple, tmp_path: Path, stderr: str, proven: bool
+):
+    """The first passing candidate wins, and only the check of it alone decides the iteration."""
+    expert, calls = _beam_expert(
+        sample_hoare_triple,
+        ["simp", "omega", "aesop"],
+        [_check("a", False, 2), _check("b", True), _check("c", True)],
+        stderr,
+    )
+    success, _ = await expert._iter_beam(tmp_path)
+    assert success is proven
+    assert expert.proof == "omega"
+    assert [name for name, _ in calls] == ["typecheck-batch", "typecheck"]
+    assert "omega" in calls[1][1]["lean_code"]
+    assert expert.conversation[-1]["content"] == "<proof>omega</proof>"
+
+
+@pytest.mark.asyncio
+async def test_beam_continues_with_fewest_errors(
+    sample_hoare_triple: HoareTriple, tmp_path: Path
+):
+    """Without a passing candidate, the one with the fewest errors continues the conversation, unchecked again."""
+    expert, calls = _beam_expert(
+        sample_hoare_triple,
+        ["simp", "omega", "aesop"],
+        [_check("a", False, 3), _check("b", False, 2), _check("c", False, 1)],
+        PROVEN_OK,
+    )
+    success, feedback = await expert._iter_beam(tmp_path)
+    assert not success
+    assert expert.proof == "aesop"
+    assert feedback == "1:0: error: 0"
+    assert [name for name, _ in calls] == ["typecheck-batch"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("term_proven", [True, False])
+async def test_structured_check_is_single_gate(
+    sample_hoare_triple: HoareTriple, tmp_path: Path, term_proven: bool
+):
+    """A structured check elaborates once, and its term check has the last word."""
+    expert = ProofExpert(MODEL, sample_hoare_triple, Polarity.POS, structured=True)
+    canary = PROVEN_OK if term_proven else "<HOARE_TRIPLE_TERM_HAS_SORRY>"
+    report = ElaborationReport(
+        exit_code=0,
+        diagnostics=[
+            Diagnostic(severity="information", line=9, column=0, message=canary)
+        ],
+        theorems=[_check("my_hoare_triple", True)],
+        term_proven=term_proven,
+    )
+    calls: list[str] = []
+
+    async def call_tool(name: str, arguments: dict):
+        calls.append(name)
+        return SimpleNamespace(content=[SimpleNamespace(text=report.model_dump_json())])
+
+    expert._call_tool = call_tool  # type: ignore[method-assign]
+    proven, feedback = await expert._typecheck("theorem my_hoare_triple", tmp_path)
+    assert proven is term_proven
+    assert calls == ["typecheck-structured"]
+    assert (canary in feedback) is not term_proven
+
+
+def test_snapshots_of_concurrent_experts_differ(
+    sample_hoare_triple: HoareTriple,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """Experts on the same triple, polarity and model keep their own audit trails."""
+    monkeypatch.setattr(artifacts, "target_dir", tmp_path)
+    experts = [ProofExpert(MODEL, sample_hoare_triple, Polarity.POS) for _ in range(2)]
+    for idx, expert in enumerate(experts):
+        expert.code_dt = [f"attempt of expert {idx}"]
+    paths = [expert._snapshot(1) for expert in experts]
+    assert paths[0] != paths[1]
+    assert all(path.parent == tmp_path for path in paths)
+    assert [path.read_text() for path in paths] == [
+        "attempt of expert 0",
+        "attempt of expert 1",
+    ]
+
+
+def _stderr(turn: int) -> str:
+    return "\n".join(
+        f"Basic.lean:{line}:2: error: unsolved goals in turn {turn}\nx : ℤ\n⊢ x + {line} > 0"
+        for line in range(20)
+    )
+
+
+def _conversation() -> tuple[list[dict], dict[int, str]]:
+    """Five exchanges, each user turn but the first carrying lean feedback."""
+    conversation: list[dict] = []
+    stderrs: dict[int, str] = {}
+    for turn in range(5):
+        stderr = _stderr(turn) if turn else ""
+        user_turn = {"role": "user", "content": f"Prove it. Feedback:\n{stderr}"}
+        if stderr:
+            stderrs[id(user_turn)] = stderr
+        conversation += [user_turn, {"role": "assistant", "content": f"attempt {turn}"}]
+    return conversation[:-1], stderrs
+
+
+def _tokens(conversation: list[dict]) -> int:
+    return token_counter(model=MODEL, messages=conversation)
+
+
+def test_fit_compacts_old_feedback():
+    """Old feedback is compacted before anything is dropped, and the latest turn is left alone."""
+    conversation, stderrs = _conversation()
+    full = _tokens(conversation)
+    fitted, tokens = fit_conversation(
+        conversation, MODEL, budget=full // 2, stderrs=stderrs
+    )
+    assert len(fitted) == len(conversation)
+    assert tokens == _tokens(fitted) <= full // 2
+    assert compact_stderr(_stderr(1)) in fitted[2]["content"]
+    assert fitted[-1] is conversation[-1]
+    assert list(stderrs) == [id(conversation[-1])]
+
+
+def test_fit_drops_old_exchanges():
+    """Past compaction, the oldest exchanges go, but never the first or the latest user turn."""
+    conversation, stderrs = _conversation()
+    budget = _tokens([conversation[0], conversation[-1]]) + 10
+    fitted, tokens = fit_conversation(
+        conversation, MODEL, budget=budget, stderrs=stderrs
+    )
+    assert fitted == [conversation[0], conversation[-1]]
+    assert tokens <= budget
+    assert list(stderrs) == [id(conversation[-1])]
+
+
+def test_fit_counts_system_prompt():
+    """The system prompt's tokens come out of the budget, and are part of the count."""
+    conversation, _ = _conversation()
+    full = _tokens(conversation)
+    system_prompt = "You are a careful prover. " * 200
+    fitted, tokens = fit_conversation(
+        conversation, MODEL, budget=full, stderrs={}, system_prompt=system_prompt
+    )
+    assert len(fitted) < len(conversation)
+    assert _tokens(fitted) < tokens <= full
+
+
+@pytest.mark.asyncio
+async def test_hedged_expert_leases_after_admission(
+    sample_hoare_triple: HoareTriple, monkeypatch: pytest.MonkeyPatch
+):
+    """A hedged loop connects only once admitted, and a loop the hedge never admits doesn't connect at all."""
+    connected: list[Polarity] = []
+
+    async def connect(self: ProofExpert) -> list:
+        connected.append(self.polarity)
+        assert await self._admitted()  # the grant from before connecting
+        return []
+
+    monkeypatch.setattr(ProofExpert, "_connect_to_server_and_run", connect)
+    hedge = Hedge(budget=1)
+    await ProofExpert.connect_and_run(
+        MODEL, sample_hoare_triple, Polarity.POS, hedge=hedge
+    )
+    refused = await ProofExpert.connect_and_run(
+        MODEL, sample_hoare_triple, Polarity.NEG, hedge=hedge
+    )
+    assert connected == [Polarity.POS]
+    assert refused.verification_result == []
+    assert hedge.used == 1
@@ -0,0 +1,240 @@
+import asyncio
+import time
+import pytest
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from pathlib import Path
+from containment import protocol
+from containment.mcp.clients.experts.proof import search
+from containment.structures.enums import ProofMethod
+from containment.structures import (
+    ExpertMetadata,
+    HoareTriple,
+    ImpFailure,
+    Polarity,
+    Specification,
+    Strategy,
+    VerificationFailure,
+    VerificationSuccess,
+)
+
+MODEL = "anthropic/claude-sonnet-4-20250514"
+
+
+@pytest.mark.asyncio
+async def test_pipelined_boundary_loop(
+    sample_specification: Specification, monkeypatch: pytest.MonkeyPatch
+):
+    """The second program is proven while the slow, unprovable first one still runs, which is then cancelled."""
+    synthesized: list[int] = []
+    cancelled: list[str] = []
+
+    async def synthesize(model, specification, *, failed_attempts):
+        synthesized.append(len(failed_attempts))
+        await asyncio.sleep(0.01)
+        return HoareTriple(
+            specification=specification,
+            command=f"imp {{ x := {len(synthesized)}; }}",
+        )
+
+    async def prove(model, triple, **kwargs):
+        metadata = ExpertMetadata(model=model, polarity=Polarity.POS)
+        try:
+            if "x := 1;" in triple.command:
+                await asyncio.sleep(5)
+                return [
+                    VerificationFailure(
+                        triple=triple,
+                        proof="sorry",
+                        error_message="unprovable",
+                        audit_trail=Path(),
+                        metadata=metadata,
+                    )
+                ]
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.append(triple.command)
+            raise
+        if "x := 2;" not in triple.command:
+            await asyncio.sleep(5)
+        return VerificationSuccess(
+            triple=triple, proof="aesop", audit_trail=Path(), metadata=metadata
+        )
+
+    monkeypatch.setattr(protocol, "_synthesize", synthesize)
+    monkeypatch.setattr(protocol, "_prove_loop", prove)
+    start = time.monotonic()
+    result = await protocol.boundary_loop(
+        MODEL, sample_specification, attempt_budget=5, pipeline_depth=2
+    )
+    assert time.monotonic() - start < 1
+    assert isinstance(result, VerificationSuccess)
+    assert result.triple.command == "imp { x := 2; }"
+    assert "imp { x := 1; }" in cancelled
+    assert 3 <= len(synthesized) < 5
+
+
+@pytest.mark.asyncio
+async def test_syntax_errors_retry_immediately(
+    sample_specification: Specification, monkeypatch: pytest.MonkeyPatch
+):
+    """Programs that don't parse are retried with their error, without using up the attempts."""
+    seen: list[int] = []
+
+    async def shot(model, specification, *, failed_attempts):
+        seen.append(len(failed_attempts))
+        if len(seen) < 3:
+            return ImpFailure(
+                specification=specification,
+                attempted_completion="imp { x = 1; }",
+                metadata=ExpertMetadata(model=model, polarity=Polarity.POS),
+                syntax_error="expected `:=`",
+            )
+        return HoareTriple(specification=specification, command="imp { x := 1; }")
+
+    monkeypatch.setattr(protocol, "_synthesize_shot", shot)
+    triple = await protocol._synthesize(MODEL, sample_specification, imp_attempts=1)
+    assert triple.command == "imp { x := 1; }"
+    assert seen == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_portfolio_first_proof_wins(
+    sample_specification: Specification, monkeypatch: pytest.MonkeyPatch
+):
+    """The fast strategy wins, a crashing one drops out, and the slow one is cancelled with its time recorded."""
+    cancelled: list[str] = []
+
+    async def prove(strategy, triple, **kwargs):
+        metadata = ExpertMetadata(model=strategy.model, polarity=Polarity.POS)
+        if strategy.method == ProofMethod.TREE_SEARCH_BASIC:
+            raise RuntimeError("pantograph is down")
+        try:
+            await asyncio.sleep(0.05 if strategy.model == "fast" else 5)
+        except asyncio.CancelledError:
+            cancelled.append(str(strategy))
+            raise
+        return VerificationSuccess(
+            triple=triple, proof="aesop", audit_trail=Path(), metadata=metadata
+        )
+
+    monkeypatch.setattr(protocol, "_prove_strategy", prove)
+    triple = HoareTriple(specification=sample_specification, command="imp { skip; }")
+    strategies = protocol.portfolio("slow", ["fast"])
+    result = await protocol._prove_portfolio(
+        strategies,
+        triple,
+        proof_loop_budget=1,
+        proof_search_max_steps=1,
+        proof_search_max_trials_per_goal=1,
+        proof_beam=1,
+    )
+    assert isinstance(result, VerificationSuccess)
+    assert result.metadata.strategy == "loop:fast"
+    assert cancelled == ["loop:slow"]
+    assert set(result.metadata.strategy_seconds) == {str(s) for s in strategies}
+    assert result.metadata.strategy_seconds["loop:slow"] < 1
+
+
+@pytest.mark.asyncio
+async def test_search_strategy_times_out(
+    sample_hoare_triple: HoareTriple,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """A tree search stuck in a synchronous step still times out, and its pantograph server is closed."""
+    closed: list[object] = []
+    server = SimpleNamespace()
+
+    async def load_sorry_async(lean_code: str):
+        return [SimpleNamespace(goal_state=SimpleNamespace(state_id=0), messages=[])]
+
+    server.load_sorry_async = load_sorry_async
+
+    async def init(cwd: Path):
+        return server
+
+    @asynccontextmanager
+    async def lease():
+        yield tmp_path
+
+    async def connect(self: search.Expert):
+        return await self.run()
+
+    monkeypatch.setattr(search, "pantograph_init", init)
+    monkeypatch.setattr(search, "pantograph_close", closed.append)
+    monkeypatch.setattr(search.workspace_pool, "lease", lease)
+    monkeypatch.setattr(search.Expert, "_connect_to_server_and_run", connect)
+    monkeypatch.setattr(
+        search.DumbHoareSearch,
+        "search",
+        lambda *_, **__: time.sleep(1),
+        raising=False,
+    )
+    start = time.monotonic()
+    result = await protocol._prove_strategy(
+        Strategy(method=ProofMethod.TREE_SEARCH_BASIC, model=MODEL),
+        sample_hoare_triple,
+        proof_loop_budget=1,
+        proof_search_max_steps=1,
+        proof_search_max_trials_per_goal=1,
+        proof_beam=1,
+        timeout=0.1,
+    )
+    assert time.monotonic() - start < 0.5
+    assert isinstance(result, list)
+    assert "ran out" in result[0].error_message
+    assert closed == [server]
+
+
+@pytest.mark.asyncio
+async def test_hedged_refutation(
+    sample_specification: Specification, monkeypatch: pytest.MonkeyPatch
+):
+    """The negative loop only starts once the positive one stalls, outpaces it while its errors fall, and its refutation ends the race."""
+    iterations: dict[Polarity, list[int]] = {Polarity.POS: [], Polarity.NEG: []}
+    cancelled: list[Polarity] = []
+
+    class Expert:
+        def __init__(self, result):
+            self.verification_result = result
+
+        @classmethod
+        async def connect_and_run(cls, model, triple, polarity, *, hedge, **kwargs):
+            metadata = ExpertMetadata(model=model, polarity=polarity)
+            errors = 3
+            try:
+                while await hedge.admit(polarity):
+                    iterations[polarity].append(len(iterations[Polarity.POS]))
+                    await asyncio.sleep(0.01)
+                    if polarity == Polarity.NEG:
+                        errors -= 1
+                        if errors == 0:
+                            return cls(
+                                VerificationSuccess(
+                                    triple=triple,
+                                    proof="aesop",
+                                    audit_trail=Path(),
+                                    metadata=metadata,
+                                )
+                            )
+                    hedge.report(polarity, errors)
+            except asyncio.CancelledError:
+                cancelled.append(polarity)
+                raise
+            finally:
+                await hedge.finish(polarity)
+            return cls([])
+
+    monkeypatch.setattr(protocol, "LoopProofExpert", Expert)
+    triple = HoareTriple(specification=sample_specification, command="imp { skip; }")
+    result = await protocol._prove_loop(
+        MODEL, triple, proof_loop_budget=10, multipolarity=False, hedge=True
+    )
+    assert isinstance(result, VerificationSuccess)
+    assert result.metadata.polarity == Polarity.NEG
+    assert cancelled == [Polarity.POS]
+    # stalled after its first iteration set the best error count and three more didn't lower it
+    assert iterations[Polarity.NEG][0] in (4, 5)
+    assert len(iterations[Polarity.NEG]) == 3
+    assert len(iterations[Polarity.POS]) <= iterations[Polarity.NEG][0] + 3
@@ -0,0 +1,50 @@
+import time
+import pytest
+from litellm import ModelResponse, RateLimitError
+from containment.netio import ratelimit
+from containment.netio.ratelimit import ProviderLimiter, TokenBucket
+
+MODEL = "anthropic/claude-sonnet-4-20250514"
+MESSAGES = [{"role": "user", "content": "prove it"}]
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_waits():
+    bucket = TokenBucket(6000)
+    await bucket.acquire(6000)
+    start = time.monotonic()
+    await bucket.acquire(10)  # refills at 100 per second
+    assert 0.05 < time.monotonic() - start < 0.5
+
+
+@pytest.mark.asyncio
+async def test_backoff_and_adaptive_concurrency(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(ratelimit, "BACKOFF_BASE_SECONDS", 0.01)
+    limiter = ProviderLimiter("stub")
+    initial = limiter.concurrency.limit
+    calls = 0
+
+    async def flaky() -> ModelResponse:
+        nonlocal calls
+        calls += 1
+        if calls <= 2:
+            raise RateLimitError("429", llm_provider="anthropic", model=MODEL)
+        return ModelResponse()
+
+    await limiter.run(MODEL, MESSAGES, flaky)
+    assert calls == 3
+    assert limiter.rate_limited == 2
+    assert limiter.concurrency.limit < initial / 2
+    assert limiter.concurrency.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_gives_up(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(ratelimit, "BACKOFF_BASE_SECONDS", 0.0)
+    monkeypatch.setattr(ratelimit, "LLM_MAX_RETRIES", 1)
+
+    async def limited() -> ModelResponse:
+        raise RateLimitError("429", llm_provider="anthropic", model=MODEL)
+
+    with pytest.raises(RateLimitError):
+        await ProviderLimiter("stub").run(MODEL, MESSAGES, limited)
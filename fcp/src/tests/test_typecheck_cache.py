@@ -0,0 +1,80 @@
+import os
+import pytest
+from pathlib import Path
+from containment.fsio.cache import TypecheckCache
+from containment.fsio.lake import Checker
+from containment.mcp import server
+from containment.structures import LakeResponse
+
+OK = LakeResponse(exit_code=0, stdout="", stderr="<HOARE_TRIPLE_TERM_PROVEN_OK>")
+FAIL = LakeResponse(exit_code=1, stdout="", stderr="error: unknown tactic")
+
+
+def test_hit_and_miss(tmp_path: Path):
+    cache = TypecheckCache(tmp_path, library="lib")
+    assert cache.get("theorem a : True := by trivial") is None
+    cache.put("theorem a : True := by trivial", OK)
+    assert cache.get("theorem a : True := by trivial") == OK
+    assert cache.get("theorem a : True := by trivial", "workers") is None
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 2
+
+
+def test_survives_reopen(tmp_path: Path):
+    TypecheckCache(tmp_path, library="lib").put("code", FAIL)
+    assert TypecheckCache(tmp_path, library="lib").get("code") == FAIL
+    assert TypecheckCache(tmp_path, library="other lib").get("code") is None
+
+
+def test_lru_eviction(tmp_path: Path):
+    cache = TypecheckCache(tmp_path, max_entries=2, library="lib")
+    cache.put("first", OK)
+    cache.put("second", OK)
+    # make "first" the most recently used entry
+    os.utime(tmp_path / f"{cache.key('second')}.json", (0, 0))
+    assert cache.get("first") == OK
+    cache.put("third", OK)
+    assert cache.stats["evictions"] == 1
+    assert cache.stats["entries"] == 2
+    assert cache.get("second") is None
+    assert cache.get("first") == OK
+    assert cache.get("third") == OK
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "response, cached",
+    [
+        (OK, True),
+        (
+            LakeResponse(
+                exit_code=1,
+                stdout="",
+                stderr="error: ./././Artifacts/Basic.lean:7:2: unsolved goals",
+            ),
+            True,
+        ),
+        (LakeResponse(exit_code=1, stdout="\n", stderr=""), False),
+        (LakeResponse(exit_code=1, stdout="", stderr="Lean worker failed: EOF"), False),
+        (LakeResponse(exit_code=-9, stdout="", stderr=""), False),
+        (LakeResponse(exit_code=124, stdout="", stderr="", timed_out=True), False),
+    ],
+)
+async def test_only_verdicts_are_cached(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    response: LakeResponse,
+    cached: bool,
+):
+    """Crashes, kills and missing toolchains say nothing about the code, so they are checked again next time."""
+
+    async def run_code_async(self, lean_code, on_stage=None) -> LakeResponse:
+        return response
+
+    cache = TypecheckCache(tmp_path / "cache", library="lib")
+    monkeypatch.setattr(server, "typecheck_cache", cache)
+    monkeypatch.setattr(server, "lean_worker_pool", None)
+    monkeypatch.setattr(Checker, "run_code_async", run_code_async)
+    (tmp_path / "Artifacts").mkdir()
+    await server._check(Checker(cwd=tmp_path), "theorem a : True := by trivial")
+    assert (cache.get("theorem a : True := by trivial") == response) is cached
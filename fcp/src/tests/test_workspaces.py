@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+import pytest
+from pathlib import Path
+from containment.fsio import workspaces
+from containment.fsio.tools import _clone_lake_dir
+from containment.fsio.workspaces import WorkspacePool
+from containment.structures.enums import CloneMode
+
+
+def _lake_project(root: Path) -> Path:
+    """A lake project with a dependency olean, an Imp olean and an Artifacts olean."""
+    for relpath in [
+        "Imp.lean",
+        ".lake/packages/aesop/.lake/build/lib/Aesop.olean",
+        ".lake/build/lib/Imp.olean",
+        ".lake/build/lib/Artifacts/Basic.olean",
+    ]:
+        (root / relpath).parent.mkdir(parents=True, exist_ok=True)
+        (root / relpath).write_text(relpath)
+    return root
+
+
+def _writable(path: Path) -> bool:
+    return bool(os.stat(path).st_mode & 0o222)
+
+
+def test_hardlinked_outputs_are_read_only(tmp_path: Path):
+    """Shared build outputs can't be written through from any clone, while the clone's own outputs and sources can."""
+    lake_dir = _lake_project(tmp_path / "imp")
+    clone = tmp_path / "clone"
+    clone.mkdir()
+    _clone_lake_dir(lake_dir, clone, CloneMode.HARDLINK)
+    for relpath in [
+        ".lake/packages/aesop/.lake/build/lib/Aesop.olean",
+        ".lake/build/lib/Imp.olean",
+    ]:
+        assert os.path.samefile(lake_dir / relpath, clone / relpath)
+        assert not _writable(clone / relpath)
+    for relpath in ["Imp.lean", ".lake/build/lib/Artifacts/Basic.olean"]:
+        assert not os.path.samefile(lake_dir / relpath, clone / relpath)
+        assert _writable(clone / relpath)
+
+
+def test_copies_share_nothing(tmp_path: Path):
+    lake_dir = _lake_project(tmp_path / "imp")
+    for mode in [CloneMode.COPY, CloneMode.REFLINK]:
+        clone = tmp_path / mode.value
+        clone.mkdir()
+        _clone_lake_dir(lake_dir, clone, mode)
+        assert not os.path.samefile(
+            lake_dir / ".lake/build/lib/Imp.olean", clone / ".lake/build/lib/Imp.olean"
+        )
+
+
+@pytest.mark.asyncio
+async def test_failed_clone_wakes_waiters(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    """A lease whose clone fails frees its slot for a lease waiting at `max_size`, and nothing is read before the first lease."""
+    clones = iter([None, tmp_path / "clone"])
+
+    def clone(lake_dir: Path) -> Path:
+        time.sleep(0.1)
+        workspace = next(clones)
+        if workspace is None:
+            raise OSError("disk full")
+        return workspace
+
+    monkeypatch.setattr(workspaces, "temp_lakeproj_init", clone)
+    pool = WorkspacePool(0, max_size=1, lake_dir=tmp_path / "missing")
+    failing = asyncio.create_task(pool._acquire())
+    await asyncio.sleep(0.01)
+    waiting = asyncio.create_task(pool._acquire())
+    with pytest.raises(OSError):
+        await failing
+    assert await asyncio.wait_for(waiting, 1) == tmp_path / "clone"
+
+
+@pytest.mark.asyncio
+async def test_cancelled_clone_is_removed(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    """A clone still running when its lease is cancelled is removed once done, and its slot is freed."""
+    workspace = tmp_path / "clone"
+
+    def clone(lake_dir: Path) -> Path:
+        time.sleep(0.2)
+        workspace.mkdir()
+        return workspace
+
+    monkeypatch.setattr(workspaces, "temp_lakeproj_init", clone)
+    pool = WorkspacePool(0, max_size=1, lake_dir=tmp_path)
+    lease = asyncio.create_task(pool._acquire())
+    await asyncio.sleep(0.05)
+    lease.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await lease
+    assert pool.total == 0
+    await asyncio.sleep(0.4)
+    assert not workspace.exists()